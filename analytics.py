@@ -0,0 +1,383 @@
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate, compress, filterfalse, groupby, repeat
+from math import isnan
+from operator import floordiv, itemgetter, mod, sub
+
+from monitor import (RIDER, DRIVER, REQUEST, CANCEL, PICKUP, DROPOFF,
+                     REPOSITION)
+
+"""
+The analytics module exports the activity history of a Monitor to a
+columnar file and computes breakdowns of it that go beyond
+Monitor.report.
+
+A columnar file holds one typed array per field, so the breakdowns work
+column by column and never build Activity objects. They select rows with
+byte masks over the category and description columns, and group rows by
+identifier through the offsets of each identifier's rows, so that the
+per-row work is done by builtins rather than by Python loops. The arrays
+are stored little-endian with fixed-width types, so other tools (for
+instance numpy.fromfile) can read them directly.
+
+File layout:
+    the MAGIC bytes, the number of activities and the number of
+    identifiers (8 bytes each),
+    the columns, in the order of COLUMNS,
+    the offsets of ActivityColumns, as 8-byte integers,
+    the length in bytes of each UTF-8 encoded identifier, as 8-byte
+    integers,
+    the UTF-8 encoded identifiers, one after the other.
+
+=== Constants ===
+@type MAGIC: bytes
+    The first bytes of a columnar activity file.
+@type COLUMNS: list[(str, str)]
+    The name and array type code of each column.
+@type CATEGORIES: list[str]
+    The categories, indexed by their code in the category column.
+@type DESCRIPTIONS: list[str]
+    The descriptions, indexed by their code in the description column.
+"""
+
+MAGIC = b"RSCACT02"
+
+COLUMNS = [("time", "q"),
+           ("category", "b"),
+           ("description", "b"),
+           ("identifier", "i"),
+           ("row", "i"),
+           ("col", "i"),
+           ("distance", "d")]
+
+CATEGORIES = [RIDER, DRIVER]
+DESCRIPTIONS = [REQUEST, CANCEL, PICKUP, DROPOFF, REPOSITION]
+
+
+class ActivityColumns:
+    """The activity history of a simulation, stored column by column.
+
+    Row i of every column describes the same activity. The activities of
+    each identifier are contiguous and in the order they occurred, the
+    identifiers are numbered in the order of their first activity, and the
+    activities of each category come together, in the order of CATEGORIES.
+
+    === Attributes ===
+    @type time: array
+        The time of each activity.
+    @type category: array
+        The index in CATEGORIES of each activity's category.
+    @type description: array
+        The index in DESCRIPTIONS of each activity's description.
+    @type identifier: array
+        The index in identifiers of each activity's identifier.
+    @type row: array
+        The row of each activity's location.
+    @type col: array
+        The column of each activity's location.
+    @type distance: array
+        The distance recorded with each activity, or NaN.
+    @type identifiers: list[str]
+        The identifiers referred to by the identifier column.
+    @type offsets: array
+        The first row of each identifier's activities, followed by the
+        number of activities.
+    """
+
+    def __init__(self):
+        """Initialize empty ActivityColumns.
+
+        @type self: ActivityColumns
+        @rtype: None
+        """
+        for name, typecode in COLUMNS:
+            setattr(self, name, array(typecode))
+        self.identifiers = []
+        self.offsets = array("q", [0])
+
+    def __len__(self):
+        """Return the number of activities.
+
+        @type self: ActivityColumns
+        @rtype: int
+        """
+        return len(self.time)
+
+
+def columns_from_monitor(monitor):
+    """Return the activity history of <monitor> as ActivityColumns.
+
+    @type monitor: Monitor
+    @rtype: ActivityColumns
+    """
+    columns = ActivityColumns()
+    index = {}
+    starts = []
+    nan = float("nan")
+    for category_code, category in enumerate(CATEGORIES):
+        for activity in monitor.get_activities(category):
+            key = (category_code, activity.identifier)
+            if key not in index:
+                index[key] = len(columns.identifiers)
+                columns.identifiers.append(activity.identifier)
+                starts.append(len(columns))
+            columns.time.append(activity.time)
+            columns.category.append(category_code)
+            columns.description.append(
+                DESCRIPTIONS.index(activity.description))
+            columns.identifier.append(index[key])
+            columns.row.append(activity.location.get_row())
+            columns.col.append(activity.location.get_col())
+            if activity.distance is None:
+                columns.distance.append(nan)
+            else:
+                columns.distance.append(activity.distance)
+    starts.append(len(columns))
+    columns.offsets = array("q", starts)
+    return columns
+
+
+def export_activities(monitor, filename):
+    """Write the activity history of <monitor> to the columnar file
+    <filename>.
+
+    @type monitor: Monitor
+    @type filename: str
+    @rtype: None
+
+    >>> import os
+    >>> from location import Location
+    >>> from monitor import Monitor
+    >>> monitor = Monitor()
+    >>> monitor.notify(0, RIDER, REQUEST, "Ann\\nBo", Location(1, 1))
+    >>> monitor.notify(4, RIDER, CANCEL, "Ann\\nBo", Location(1, 1))
+    >>> export_activities(monitor, "activities.bin")
+    >>> columns = load_activities("activities.bin")
+    >>> os.remove("activities.bin")
+    >>> columns.identifiers, list(columns.offsets)
+    (['Ann\\nBo'], [0, 2])
+    """
+    columns = columns_from_monitor(monitor)
+    encoded = [identifier.encode("utf-8")
+               for identifier in columns.identifiers]
+    lengths = array("q", map(len, encoded))
+    with open(filename, "wb") as file:
+        file.write(MAGIC)
+        file.write(len(columns).to_bytes(8, "little"))
+        file.write(len(encoded).to_bytes(8, "little"))
+        arrays = [getattr(columns, name) for name, _ in COLUMNS]
+        for column in arrays + [columns.offsets, lengths]:
+            if sys.byteorder == "big":
+                column = array(column.typecode, column)
+                column.byteswap()
+            column.tofile(file)
+        file.write(b"".join(encoded))
+
+
+def load_activities(filename):
+    """Return the ActivityColumns stored in the columnar file <filename>.
+
+    Raise a ValueError if <filename> is not a columnar activity file.
+
+    @type filename: str
+    @rtype: ActivityColumns
+    """
+    columns = ActivityColumns()
+    with open(filename, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not an activity file".format(filename))
+        count = int.from_bytes(file.read(8), "little")
+        identifiers = int.from_bytes(file.read(8), "little")
+        sizes = [count] * len(COLUMNS) + [identifiers + 1, identifiers]
+        typecodes = [typecode for _, typecode in COLUMNS] + ["q", "q"]
+        arrays = []
+        for typecode, size in zip(typecodes, sizes):
+            column = array(typecode)
+            column.fromfile(file, size)
+            if sys.byteorder == "big":
+                column.byteswap()
+            arrays.append(column)
+        data = file.read()
+    for (name, _), column in zip(COLUMNS, arrays):
+        setattr(columns, name, column)
+    columns.offsets = arrays[-2]
+    ends = accumulate(arrays[-1])
+    columns.identifiers = [data[end - length:end].decode("utf-8")
+                           for end, length in zip(ends, arrays[-1])]
+    return columns
+
+
+def _spans(columns, category):
+    """Return the first rows and the ends of the row ranges of the
+    identifiers of <category>.
+
+    @type columns: ActivityColumns
+    @type category: RIDER | DRIVER
+    @rtype: (array, array)
+    """
+    code = CATEGORIES.index(category)
+    first = bisect_left(columns.category, code)
+    end = bisect_left(columns.category, code + 1)
+    if first == end:
+        return array("q"), array("q")
+    low = columns.identifier[first]
+    high = columns.identifier[end - 1] + 1
+    return columns.offsets[low:high], columns.offsets[low + 1:high + 1]
+
+
+def _mask(column, codes):
+    """Return a mask of the rows of the byte column <column> whose code is
+    in <codes>: a bytes object with a 1 for each of them and a 0 for every
+    other row.
+
+    @type column: array
+    @type codes: list[int]
+    @rtype: bytes
+
+    >>> list(_mask(array("b", [0, 2, 1, 2]), [1, 2]))
+    [0, 1, 1, 1]
+    """
+    table = bytes(code in codes for code in range(256))
+    return column.tobytes().translate(table)
+
+
+def _both(mask, other):
+    """Return the mask of the rows set in both <mask> and <other>, which
+    have the same length.
+
+    @type mask: bytes
+    @type other: bytes
+    @rtype: bytes
+    """
+    return (int.from_bytes(mask, "little") &
+            int.from_bytes(other, "little")).to_bytes(len(mask), "little")
+
+
+def _group_sum(keys, values):
+    """Return the sum of <values> for each distinct key of <keys>, where
+    values[i] belongs to keys[i].
+
+    @type keys: iterable[object]
+    @type values: iterable[int | float]
+    @rtype: dict[object, int | float]
+
+    >>> _group_sum([2, 1, 2], [10, 20, 30])
+    {1: 20, 2: 40}
+    """
+    pairs = sorted(zip(keys, values), key=itemgetter(0))
+    return {key: sum(map(itemgetter(1), group))
+            for key, group in groupby(pairs, itemgetter(0))}
+
+
+def wait_time_by_period(columns, period=60):
+    """Return the average rider wait time for each period of <period> time
+    units, keyed on the start of the period in which the ride was
+    requested.
+
+    As in Monitor.report, only riders that were picked up or cancelled
+    count.
+
+    @type columns: ActivityColumns
+    @type period: int
+    @rtype: dict[int, float]
+    """
+    time = columns.time
+    starts, ends = _spans(columns, RIDER)
+    # A rider's second activity, if any, ends their wait.
+    waited = list(compress(starts, map((2).__le__, map(sub, ends, starts))))
+    requested = list(map(time.__getitem__, waited))
+    waits = map(sub, map(time.__getitem__, map((1).__add__, waited)),
+                requested)
+    buckets = list(map(sub, requested, map(mod, requested, repeat(period))))
+    totals = _group_sum(buckets, waits)
+    counts = Counter(buckets)
+    return {bucket: totals[bucket] / counts[bucket]
+            for bucket in sorted(totals)}
+
+
+def driver_utilisation(columns):
+    """Return, for each driver, the fraction of the time between their first
+    and last activity that they spent carrying a rider.
+
+    @type columns: ActivityColumns
+    @rtype: dict[str, float]
+    """
+    time = columns.time
+    pickups = _mask(columns.description, [DESCRIPTIONS.index(PICKUP)])
+    dropoffs = _mask(columns.description, [DESCRIPTIONS.index(DROPOFF)])
+    drivers = _mask(columns.category, [CATEGORIES.index(DRIVER)])
+    # The driver pickups directly followed by a dropoff start a ride.
+    rides = _both(_both(pickups, drivers), dropoffs[1:] + b"\0")
+    busy = _group_sum(compress(columns.identifier, rides),
+                      map(sub, compress(time[1:], rides),
+                          compress(time, rides)))
+    utilisation = {}
+    starts, ends = _spans(columns, DRIVER)
+    for start, end in zip(starts, ends):
+        span = time[end - 1] - time[start]
+        index = columns.identifier[start]
+        utilisation[columns.identifiers[index]] = (
+            busy.get(index, 0) / span if span > 0 else 0.0)
+    return utilisation
+
+
+def cancellation_rate_by_cell(columns, cell_size=1):
+    """Return the fraction of ride requests that were cancelled, for each
+    square cell of <cell_size> streets, keyed on the (row, col) of the cell
+    containing the origin of the request.
+
+    @type columns: ActivityColumns
+    @type cell_size: int
+    @rtype: dict[(int, int), float]
+    """
+    starts, _ = _spans(columns, RIDER)
+    cells = list(zip(
+        map(floordiv, map(columns.row.__getitem__, starts),
+            repeat(cell_size)),
+        map(floordiv, map(columns.col.__getitem__, starts),
+            repeat(cell_size))))
+    cancels = _both(_mask(columns.description, [DESCRIPTIONS.index(CANCEL)]),
+                    _mask(columns.category, [CATEGORIES.index(RIDER)]))
+    cancelled_riders = set(compress(columns.identifier, cancels))
+    requests = Counter(cells)
+    cancelled = Counter(compress(cells, map(
+        cancelled_riders.__contains__,
+        map(columns.identifier.__getitem__, starts))))
+    return {cell: cancelled[cell] / requests[cell]
+            for cell in sorted(requests)}
+
+
+def deadhead_ratio(columns):
+    """Return the fraction of the recorded driving distance that drivers
+    covered without a rider, on the way to a pickup or repositioning.
+
+    @type columns: ActivityColumns
+    @rtype: float
+    """
+    drivers = _mask(columns.category, [CATEGORIES.index(DRIVER)])
+    empty_drives = _both(drivers, _mask(
+        columns.description,
+        [DESCRIPTIONS.index(PICKUP), DESCRIPTIONS.index(REPOSITION)]))
+    total = sum(filterfalse(isnan, compress(columns.distance, drivers)))
+    if total == 0:
+        return 0.0
+    empty = sum(filterfalse(isnan, compress(columns.distance,
+                                            empty_drives)))
+    return empty / total
+
+
+def summary(columns, period=60, cell_size=1):
+    """Return every breakdown of <columns> in one dictionary.
+
+    @type columns: ActivityColumns
+    @type period: int
+    @type cell_size: int
+    @rtype: dict[str, object]
+    """
+    return {"wait_time_by_period": wait_time_by_period(columns, period),
+            "driver_utilisation": driver_utilisation(columns),
+            "cancellation_rate_by_cell": cancellation_rate_by_cell(
+                columns, cell_size),
+            "deadhead_ratio": deadhead_ratio(columns)}
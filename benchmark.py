@@ -0,0 +1,207 @@
+import sys
+from time import perf_counter
+
+from container import EventQueue, PriorityQueue
+from dispatcher import Dispatcher
+from event import parse_events
+from simulation import Simulation
+from strategy import DispatchStrategy, STRATEGIES
+from traces import open_trace
+
+"""
+The benchmark module measures alternative implementations of parts of the
+simulation against each other on the same trace.
+
+Every benchmark parses a fresh copy of the trace for each run, times only
+the run itself, and checks that the alternatives agree on the report.
+
+Run it as
+
+    python benchmark.py [trace ...]
+"""
+
+
+def read_lines(source):
+    """Return the lines of the trace <source>, which may be compressed.
+
+    @type source: str
+    @rtype: list[str]
+    """
+    with open_trace(source) as trace:
+        return list(trace)
+
+
+def _timed_run(simulation, lines):
+    """Run <simulation> on the events of <lines> and return its report, the
+    number of events it processed and the seconds it took.
+
+    @type simulation: Simulation
+    @type lines: list[str]
+    @rtype: (dict[str, object], int, float)
+    """
+    events = parse_events(lines)
+    start = perf_counter()
+    simulation.start(events)
+    count = 0
+    while simulation.step() is not None:
+        count += 1
+    seconds = perf_counter() - start
+    return simulation.get_monitor().report(), count, seconds
+
+
+def scheduler_benchmark(lines):
+    """Run the trace <lines> with a plain PriorityQueue and with an
+    EventQueue, and return the time each took, the queue operations each
+    did, and whether their reports agree.
+
+    A PriorityQueue does one insert and one remove per event. An
+    EventQueue saves both for every event that goes through its lane.
+
+    @type lines: list[str]
+    @rtype: dict[str, object]
+
+    >>> with open("events.txt") as file:
+    ...     result = scheduler_benchmark(file.read().splitlines())
+    >>> result["identical"], result["events"], result["lane_events"]
+    (True, 31, 7)
+    """
+    report, count, priority_seconds = _timed_run(
+        Simulation(events=PriorityQueue()), lines)
+    queue = EventQueue()
+    lane_report, _, lane_seconds = _timed_run(Simulation(events=queue), lines)
+    return {"identical": report == lane_report,
+            "events": count,
+            "lane_events": queue.fast,
+            "priority_queue_operations": 2 * count,
+            "event_queue_operations": 2 * (count - queue.fast),
+            "priority_seconds": priority_seconds,
+            "event_queue_seconds": lane_seconds}
+
+
+class _TimedStrategy(DispatchStrategy):
+    """A DispatchStrategy that times every decision of another.
+
+    === Attributes ===
+    @type strategy: DispatchStrategy
+        The strategy timed.
+    @type latencies: list[float]
+        The seconds each decision took.
+    """
+
+    def __init__(self, strategy):
+        """Initialize a _TimedStrategy timing <strategy>.
+
+        @type self: _TimedStrategy
+        @type strategy: DispatchStrategy
+        @rtype: None
+        """
+        self.strategy = strategy
+        self.name = strategy.name
+        self.interval = strategy.interval
+        self.latencies = []
+
+    def _timed(self, method, *args):
+        """Return the result of calling <method> with <args>, recording the
+        time it took.
+
+        @type self: _TimedStrategy
+        @type method: callable
+        @rtype: object
+        """
+        start = perf_counter()
+        result = method(*args)
+        self.latencies.append(perf_counter() - start)
+        return result
+
+    def driver_for(self, dispatcher, rider):
+        """Return the driver the timed strategy gives <rider>.
+
+        @type self: _TimedStrategy
+        @type dispatcher: Dispatcher
+        @type rider: Rider
+        @rtype: Driver | None
+        """
+        return self._timed(self.strategy.driver_for, dispatcher, rider)
+
+    def rider_for(self, dispatcher, driver):
+        """Remove and return the rider the timed strategy gives <driver>.
+
+        @type self: _TimedStrategy
+        @type dispatcher: Dispatcher
+        @type driver: Driver
+        @rtype: Rider | None
+        """
+        return self._timed(self.strategy.rider_for, dispatcher, driver)
+
+    def match(self, dispatcher, timestamp):
+        """Return the (driver, rider) pairs the timed strategy matches at
+        time <timestamp>.
+
+        @type self: _TimedStrategy
+        @type dispatcher: Dispatcher
+        @type timestamp: int
+        @rtype: list[(Driver, Rider)]
+        """
+        return self._timed(self.strategy.match, dispatcher, timestamp)
+
+
+def strategy_benchmark(lines, names=None):
+    """Run the trace <lines> with each dispatch strategy in <names>, and
+    return for each the number of decisions it made, its decisions per
+    second and 99th percentile decision latency in microseconds, and the
+    report of the run.
+
+    A decision is a call that may match a rider and a driver: a rider or
+    driver request, or a batch match.
+
+    @type lines: list[str]
+    @type names: list[str] | None
+        The names of the strategies, or None for every strategy.
+    @rtype: dict[str, dict[str, object]]
+
+    >>> with open("events.txt") as file:
+    ...     lines = file.read().splitlines()
+    >>> results = strategy_benchmark(lines, ["first-idle", "nearest-idle"])
+    >>> results["first-idle"]["report"] == Simulation().run(parse_events(lines))
+    True
+    >>> results["nearest-idle"]["decisions"]
+    18
+    """
+    results = {}
+    for name in names or list(STRATEGIES):
+        strategy = _TimedStrategy(STRATEGIES[name]())
+        simulation = Simulation(dispatcher=Dispatcher(strategy=strategy))
+        report, _, _ = _timed_run(simulation, lines)
+        latencies = sorted(strategy.latencies)
+        total = sum(latencies)
+        results[name] = {
+            "decisions": len(latencies),
+            "decisions_per_second": len(latencies) / total if total else 0.0,
+            "p99_latency_us": (latencies[int(0.99 * (len(latencies) - 1))] *
+                               1e6 if latencies else 0.0),
+            "report": report}
+    return results
+
+
+def main(argv=None):
+    """Run the benchmarks on each trace named in <argv> and print the
+    results.
+
+    @type argv: list[str] | None
+        The traces, or None for sys.argv; events.txt if there are none.
+    @rtype: None
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    for source in argv or ["events.txt"]:
+        lines = read_lines(source)
+        print(source)
+        for key, value in scheduler_benchmark(lines).items():
+            print("    scheduler {}: {}".format(key, value))
+        for name, result in strategy_benchmark(lines).items():
+            for key, value in result.items():
+                print("    strategy {} {}: {}".format(name, key, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+
+"""
+The cache module keeps the reports of simulation runs on disk, addressed by
+what determines them, so that a run repeated on the same trace with the same
+configuration returns its report without simulating again.
+
+The key of a run is a SHA-256 hash of the contents of its trace, hashed a
+block at a time so that a trace of any size is read once in bounded memory,
+of its configuration, and of the version of the simulation engine. The
+engine version is itself a hash of the source of the modules that decide a
+report, so a change to any of them invalidates every report cached before
+it: those are never found again, and are pruned by the next store.
+
+Each report is a small JSON file in the cache directory, named by the
+engine version and the key. A hit marks its file as the most recently used,
+and a store evicts the least recently used reports until the cache holds at
+most <max_entries> reports and <max_bytes> bytes.
+
+=== Constants ===
+@type ENGINE_MODULES: list[str]
+    The modules whose source decides the report of a run.
+@type BLOCK_SIZE: int
+    The number of bytes hashed at a time.
+@type SUFFIX: str
+    The suffix of the file of a cached report.
+"""
+
+ENGINE_MODULES = ["container", "dispatcher", "driver", "event", "location",
+                  "monitor", "network", "pooling", "rebalance", "replication",
+                  "rider", "simulation", "strategy", "threadsafe", "timeindex",
+                  "traces", "travel"]
+BLOCK_SIZE = 1 << 20
+SUFFIX = ".json"
+
+_engine_version = None
+
+
+def file_digest(path, block_size=BLOCK_SIZE):
+    """Return the SHA-256 hex digest of the contents of the file at <path>,
+    read <block_size> bytes at a time.
+
+    @type path: str
+    @type block_size: int
+    @rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        block = file.read(block_size)
+        while block:
+            digest.update(block)
+            block = file.read(block_size)
+    return digest.hexdigest()
+
+
+def engine_version():
+    """Return the version of the simulation engine: a hex digest of the
+    source of ENGINE_MODULES.
+
+    @rtype: str
+
+    >>> engine_version() == engine_version()
+    True
+    """
+    global _engine_version
+    if _engine_version is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for module in ENGINE_MODULES:
+            digest.update(module.encode("utf-8"))
+            digest.update(file_digest(os.path.join(directory,
+                                                   module + ".py")).encode())
+        _engine_version = digest.hexdigest()[:16]
+    return _engine_version
+
+
+def run_key(trace, config):
+    """Return the key of a run on the trace at <trace> with the
+    configuration <config>, under the current engine version.
+
+    Files named by the configuration, such as a road network, should be
+    given by their digests, so that the key changes with their contents.
+
+    @type trace: str
+    @type config: dict[str, object]
+        The options the run depends on; any that can be written as JSON.
+    @rtype: str
+
+    >>> run_key("events.txt", {"strategy": "lru"}) == run_key(
+    ...     "events.txt", {"strategy": "lru"})
+    True
+    >>> run_key("events.txt", {"strategy": "lru"}) == run_key(
+    ...     "events.txt", {"strategy": "batched"})
+    False
+    """
+    digest = hashlib.sha256()
+    digest.update(engine_version().encode("utf-8"))
+    digest.update(file_digest(trace).encode("utf-8"))
+    digest.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """An on-disk cache of run reports, by run key.
+
+    === Attributes ===
+    @type directory: str
+        The directory holding the cached reports.
+    @type max_entries: int
+        The most reports kept.
+    @type max_bytes: int
+        The most bytes of reports kept.
+    @type hits: int
+        The number of lookups that found a report.
+    @type misses: int
+        The number of lookups that did not.
+    """
+
+    def __init__(self, directory, max_entries=1024, max_bytes=64 << 20):
+        """Initialize a ResultCache in <directory>, creating it if needed.
+
+        @type self: ResultCache
+        @type directory: str
+        @type max_entries: int
+        @type max_bytes: int
+        @rtype: None
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        """Return the path of the file of the report with <key>.
+
+        @type self: ResultCache
+        @type key: str
+        @rtype: str
+        """
+        return os.path.join(self.directory, "{}-{}{}".format(
+            engine_version(), key, SUFFIX))
+
+    def get(self, key):
+        """Return the report cached with <key>, or None if there is none.
+
+        @type self: ResultCache
+        @type key: str
+        @rtype: dict[str, object] | None
+        """
+        path = self._path(key)
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return entry["report"]
+
+    def put(self, key, report):
+        """Cache <report> with <key>, then evict the least recently used
+        reports, and those of other engine versions, beyond the limits.
+
+        @type self: ResultCache
+        @type key: str
+        @type report: dict[str, object]
+        @rtype: None
+        """
+        path = self._path(key)
+        partial = "{}.{}.tmp".format(path, os.getpid())
+        with open(partial, "w") as file:
+            json.dump({"key": key, "report": report}, file)
+        os.replace(partial, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the reports of other engine versions, and the least
+        recently used reports while there are more than max_entries or more
+        than max_bytes of them.
+
+        @type self: ResultCache
+        @rtype: None
+
+        >>> from tempfile import TemporaryDirectory
+        >>> with TemporaryDirectory() as directory:
+        ...     cache = ResultCache(directory, max_entries=2)
+        ...     for key in ["a", "b", "c"]:
+        ...         cache.put(key, {"rider_wait_time": 1.0})
+        ...     [cache.get(key) is None for key in ["a", "b", "c"]]
+        [True, False, False]
+        """
+        prefix = engine_version() + "-"
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if name.startswith(prefix):
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime_ns, stat.st_size, path))
+                else:
+                    os.remove(path)
+            except OSError:
+                pass
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or
+                           total > self.max_bytes):
+            _, size, path = entries.pop(0)
+            total -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove every cached report.
+
+        @type self: ResultCache
+        @rtype: None
+        """
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+
+
+def cached_run(cache, trace, config, run):
+    """Return the report of the run on the trace at <trace> with the
+    configuration <config>: the one in <cache> if there is one, or else the
+    one <run> returns, which is then cached.
+
+    @type cache: ResultCache
+    @type trace: str
+    @type config: dict[str, object]
+    @type run: callable
+        Runs the simulation and returns its report.
+    @rtype: dict[str, object]
+
+    >>> from tempfile import TemporaryDirectory
+    >>> from event import create_event_list
+    >>> from simulation import Simulation
+    >>> def run():
+    ...     return Simulation().run(create_event_list("events.txt"))
+    >>> with TemporaryDirectory() as directory:
+    ...     cache = ResultCache(directory)
+    ...     first = cached_run(cache, "events.txt", {}, run)
+    ...     second = cached_run(cache, "events.txt", {}, run)
+    >>> first == second == run(), cache.hits, cache.misses
+    (True, 1, 1)
+    """
+    key = run_key(trace, config)
+    report = cache.get(key)
+    if report is None:
+        report = run()
+        cache.put(key, report)
+    return report
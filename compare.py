@@ -0,0 +1,332 @@
+import sys
+from collections import deque
+
+from journal import read_journal
+
+"""
+The compare module finds where two simulation runs diverge, for regression
+checking after a change to the dispatch logic.
+
+Runs are compared as streams, in lockstep: either two event journals, or
+two live Simulations stepped side by side. Only the first divergence and
+running totals are kept. Live Simulations whose monitors are
+RunningMonitors, and whose initial events are streamed, therefore run in
+memory that does not grow with the length of the runs.
+
+Two journals, or two dispatch strategies on one trace sorted by timestamp,
+can be compared from the command line:
+
+    python compare.py left.journal right.journal
+    python compare.py --trace events.txt --strategies first-idle lru
+
+An event is compared as (event name, timestamp, rider identifier, driver
+identifier), the form read_journal yields; an activity is compared as
+(category, description, time, identifier, location, distance).
+"""
+
+
+def event_record(event):
+    """Return the comparable record of <event>.
+
+    @type event: Event
+    @rtype: (str, int, str | None, str | None)
+    """
+    rider = getattr(event, "rider", None)
+    driver = getattr(event, "driver", None)
+    return (type(event).__name__, event.timestamp,
+            None if rider is None else rider.identifier,
+            None if driver is None else driver.identifier)
+
+
+class _StreamTally:
+    """Running totals for comparing two streams of records.
+
+    === Attributes ===
+    @type name: str
+        The name of the stream: "event" or "activity".
+    @type counts: dict[str, list[int]]
+        The number of records of each kind in the left and right stream.
+    @type first_divergence: dict[str, object] | None
+        The position and records of the first mismatch, if any.
+    """
+
+    def __init__(self, name):
+        """Initialize an empty _StreamTally.
+
+        @type self: _StreamTally
+        @type name: str
+        @rtype: None
+        """
+        self.name = name
+        self.counts = {}
+        self.first_divergence = None
+        self._compared = 0
+
+    def count(self, side, record):
+        """Count <record> on <side> (0 for left, 1 for right).
+
+        @type self: _StreamTally
+        @type side: int
+        @type record: tuple
+        @rtype: None
+        """
+        kind = record[0] if self.name == "event" else "{} {}".format(
+            record[0], record[1])
+        if kind not in self.counts:
+            self.counts[kind] = [0, 0]
+        self.counts[kind][side] += 1
+
+    def match(self, left, right):
+        """Compare the next pair of records, either of which is None if its
+        stream has ended.
+
+        @type self: _StreamTally
+        @type left: tuple | None
+        @type right: tuple | None
+        @rtype: None
+        """
+        if self.first_divergence is None and left != right:
+            self.first_divergence = {"stream": self.name,
+                                     "index": self._compared,
+                                     "left": left,
+                                     "right": right}
+        self._compared += 1
+
+    def totals(self):
+        """Return the number of records in the left and right stream.
+
+        @type self: _StreamTally
+        @rtype: (int, int)
+        """
+        return (sum(left for left, _ in self.counts.values()),
+                sum(right for _, right in self.counts.values()))
+
+
+def _summary(tallies, reports=None):
+    """Return the comparison summary for <tallies>.
+
+    @type tallies: list[_StreamTally]
+    @type reports: (dict[str, object], dict[str, object]) | None
+    @rtype: dict[str, object]
+    """
+    divergences = [tally.first_divergence for tally in tallies
+                   if tally.first_divergence is not None]
+    summary = {"identical": not divergences,
+               "first_divergence": divergences[0] if divergences else None}
+    for tally in tallies:
+        plural = "events" if tally.name == "event" else "activities"
+        summary[plural] = tally.totals()
+        summary[tally.name + "_counts"] = {
+            kind: tuple(count) for kind, count in sorted(tally.counts.items())}
+    if reports is not None:
+        left, right = reports
+        summary["report_delta"] = {key: right[key] - left[key]
+                                   for key in left if key in right}
+    return summary
+
+
+def compare_journals(left, right):
+    """Compare the events recorded in the journals <left> and <right>.
+
+    Return a summary with the first divergence (or None), the number of
+    events in each journal and the number of events of each kind.
+
+    @type left: str
+    @type right: str
+    @rtype: dict[str, object]
+    """
+    tally = _StreamTally("event")
+    left_events = read_journal(left)
+    right_events = read_journal(right)
+    while True:
+        left_event = next(left_events, None)
+        right_event = next(right_events, None)
+        if left_event is None and right_event is None:
+            break
+        if left_event is not None:
+            tally.count(0, left_event)
+        if right_event is not None:
+            tally.count(1, right_event)
+        tally.match(left_event, right_event)
+    return _summary([tally])
+
+
+def compare_simulations(left, left_events, right, right_events):
+    """Run the simulations <left> and <right> side by side on their initial
+    events and compare the events they process and the activities their
+    monitors record.
+
+    Initial events given as a list are scheduled up front. Those given as
+    an iterator, which must be in order of timestamp, are read only as they
+    are due, as Simulation.run_stream reads them.
+
+    Return a summary with the first divergence (or None), the number of
+    events and activities of each run, the number of events and activities
+    of each kind, and the difference between the final reports (right
+    minus left).
+
+    @type left: Simulation
+    @type left_events: list[Event] | iterator[Event]
+    @type right: Simulation
+    @type right_events: list[Event] | iterator[Event]
+    @rtype: dict[str, object]
+
+    >>> from dispatcher import Dispatcher, RegionalWaitList
+    >>> from event import create_event_list
+    >>> from simulation import Simulation
+    >>> same = compare_simulations(Simulation(),
+    ...                            create_event_list("events.txt"),
+    ...                            Simulation(),
+    ...                            create_event_list("events.txt"))
+    >>> same["identical"], same["report_delta"]["rider_wait_time"]
+    (True, 0.0)
+    >>> from monitor import RunningMonitor
+    >>> from strategy import STRATEGIES
+    >>> lru = Dispatcher(strategy=STRATEGIES["lru"]())
+    >>> other = compare_simulations(
+    ...     Simulation(monitor=RunningMonitor()),
+    ...     iter(create_event_list("events.txt")),
+    ...     Simulation(dispatcher=lru, monitor=RunningMonitor()),
+    ...     iter(create_event_list("events.txt")))
+    >>> other["identical"], other["first_divergence"]["stream"]
+    (False, 'event')
+    """
+    events = _StreamTally("event")
+    activities = _StreamTally("activity")
+    pending = (deque(), deque())
+
+    def recorder(side):
+        def record(category, activity):
+            entry = (category, activity.description, activity.time,
+                     activity.identifier, str(activity.location),
+                     activity.distance)
+            activities.count(side, entry)
+            if activities.first_divergence is None:
+                pending[side].append(entry)
+        return record
+
+    left.get_monitor().subscribe(recorder(0))
+    right.get_monitor().subscribe(recorder(1))
+    for simulation, initial_events in [(left, left_events),
+                                       (right, right_events)]:
+        if isinstance(initial_events, list):
+            simulation.start(initial_events)
+        else:
+            simulation.start_stream(initial_events)
+    left_done = right_done = False
+    while not (left_done and right_done):
+        left_event = None if left_done else left.step()
+        right_event = None if right_done else right.step()
+        left_done = left_event is None
+        right_done = right_event is None
+        if left_done and right_done:
+            break
+        left_record = None if left_done else event_record(left_event)
+        right_record = None if right_done else event_record(right_event)
+        if left_record is not None:
+            events.count(0, left_record)
+        if right_record is not None:
+            events.count(1, right_record)
+        events.match(left_record, right_record)
+        # Compare the activities both runs have recorded so far; once they
+        # diverge, only the totals are kept.
+        while pending[0] and pending[1]:
+            activities.match(pending[0].popleft(), pending[1].popleft())
+        if activities.first_divergence is not None:
+            pending[0].clear()
+            pending[1].clear()
+    while pending[0] or pending[1]:
+        activities.match(pending[0].popleft() if pending[0] else None,
+                         pending[1].popleft() if pending[1] else None)
+    reports = (left.get_monitor().report(), right.get_monitor().report())
+    return _summary([events, activities], reports)
+
+
+def _parse_args(argv):
+    """Return the command-line options in <argv>.
+
+    @type argv: list[str]
+    @rtype: argparse.Namespace
+    """
+    from argparse import ArgumentParser
+    from strategy import STRATEGIES
+    parser = ArgumentParser(
+        prog="compare.py",
+        description="Find where two simulation runs diverge.")
+    parser.add_argument("journals", nargs="*", metavar="JOURNAL",
+                        help="the event journals of the two runs")
+    parser.add_argument("--trace",
+                        help="run this trace, sorted by timestamp, twice "
+                             "side by side instead")
+    parser.add_argument("--strategies", nargs=2, metavar=("LEFT", "RIGHT"),
+                        choices=sorted(STRATEGIES),
+                        default=["first-idle", "first-idle"],
+                        help="with --trace, the dispatch strategy of each run "
+                             "(default: first-idle)")
+    parser.add_argument("--network",
+                        help="with --trace, a road network file to travel on")
+    parser.add_argument("--json", action="store_true",
+                        help="print the summary as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Compare the two runs named by the command-line options in <argv>
+    and print the summary.
+
+    @type argv: list[str] | None
+        The command-line options, or None for sys.argv.
+    @rtype: None
+    """
+    options = _parse_args(argv)
+    if options.trace is None:
+        if len(options.journals) != 2:
+            sys.exit("give two journals, or a trace with --trace")
+        try:
+            summary = compare_journals(*options.journals)
+        except ValueError as error:
+            sys.exit(str(error))
+    else:
+        if options.journals:
+            sys.exit("give two journals, or a trace with --trace")
+        from dispatcher import Dispatcher
+        from event import iter_events, parse_events
+        from monitor import RunningMonitor
+        from simulation import Simulation
+        from strategy import STRATEGIES
+        from traces import open_trace
+        network = None
+        if options.network is not None:
+            from network import load_network
+            network = load_network(options.network)
+        runs = []
+        traces = []
+        for name in options.strategies:
+            strategy = STRATEGIES[name]()
+            dispatcher = Dispatcher(network, strategy=strategy)
+            trace = open_trace(options.trace)
+            traces.append(trace)
+            if strategy.interval is None:
+                events = iter_events(trace)
+            else:
+                # A batched strategy needs every initial event up front.
+                events = parse_events(trace)
+            runs += [Simulation(dispatcher=dispatcher,
+                                monitor=RunningMonitor(dispatcher.travel)),
+                     events]
+        try:
+            summary = compare_simulations(*runs)
+        except ValueError as error:
+            sys.exit("{}: {}".format(options.trace, error))
+        finally:
+            for trace in traces:
+                trace.close()
+    if options.json:
+        import json
+        print(json.dumps(summary, sort_keys=True))
+    else:
+        print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
+from bisect import insort
+from collections import OrderedDict, deque
+
+
 class Container:
     """A container that holds objects.
 
@@ -29,6 +33,30 @@ class Container:
         """
         raise NotImplementedError("Implemented in a subclass")
 
+    def take_nearest(self, location):
+        """Remove and return the item to hand to a taker at <location>, or
+        None if no item is within reach.
+
+        By default this is the item remove returns, wherever <location> is.
+
+        Precondition: <self> should not be empty.
+
+        @type self: Container
+        @type location: Location
+        @rtype: Object | None
+        """
+        return self.remove()
+
+    def discard(self, item):
+        """Remove <item> from this Container if it is in it.
+
+        By default the item stays, for whoever removes it to skip.
+
+        @type self: Container
+        @type item: Object
+        @rtype: None
+        """
+
 
 class PriorityQueue(Container):
     """A queue of items that operates in priority order.
@@ -61,6 +89,14 @@ class PriorityQueue(Container):
         """
         self._items = []
 
+    def __len__(self):
+        """Return the number of items in this PriorityQueue.
+
+        @type self: PriorityQueue
+        @rtype: int
+        """
+        return len(self._items)
+
     def __str__(self):
         """Return a str representation of the PriorityQueue.
 
@@ -93,6 +129,22 @@ class PriorityQueue(Container):
         """
         return self._items.pop(0)
 
+    def peek(self):
+        """Return the next item from this PriorityQueue without removing it.
+
+        Precondition: <self> should not be empty.
+
+        @type self: PriorityQueue
+        @rtype: object
+
+        >>> pq = PriorityQueue()
+        >>> pq.add("red")
+        >>> pq.add("blue")
+        >>> pq.peek()
+        'blue'
+        """
+        return self._items[0]
+
     def is_empty(self):
         """
         Return true iff this PriorityQueue is empty.
@@ -124,12 +176,133 @@ class PriorityQueue(Container):
         >>> pq._items
         ['blue', 'green', 'red', 'yellow']
         """
-        i = 0
-        for items in self._items:
-            if item > items:
-                self._items.insert(i, item)
-            else:
-                i += 1
+        # insort places <item> after any equal items, which keeps ties in
+        # FIFO order.
+        insort(self._items, item)
+
+
+class EventQueue(PriorityQueue):
+    """A PriorityQueue of events with a FIFO lane for events at the current
+    time.
+
+    Many events schedule another at their own timestamp. Such an event would
+    be inserted behind every queued event with the same timestamp, so it is
+    appended to the lane instead, and the lane is drained once the queued
+    events of the current time are done, before the clock advances. Events
+    come out in exactly the order a PriorityQueue would give them, without
+    the cost of an insert and remove for each event in the lane.
+
+    The current time is the latest timestamp removed from the queue.
+
+    === Attributes ===
+    @type fast: int
+        The number of events that have gone through the lane.
+    """
+
+    # === Private Attributes ===
+    # @type _now: int | None
+    #   The current time, or None before the first event is removed.
+    # @type _lane: deque[Event]
+    #   The events added at the current time, in the order they were added.
+    #
+    # === Representation Invariants ===
+    # Every event in _lane has timestamp _now.
+
+    def __init__(self):
+        """Initialize an empty EventQueue.
+
+        @type self: EventQueue
+        @rtype: None
+        """
+        PriorityQueue.__init__(self)
+        self.fast = 0
+        self._now = None
+        self._lane = deque()
+
+    def __len__(self):
+        """Return the number of events in this EventQueue.
+
+        @type self: EventQueue
+        @rtype: int
+        """
+        return len(self._items) + len(self._lane)
+
+    def __str__(self):
+        """Return a str representation of the EventQueue.
+
+        @type self: EventQueue
+        @rtype: str
+        """
+        return str(self._items + list(self._lane))
+
+    def _from_lane(self):
+        """Return True iff the next event is the first in the lane.
+
+        @type self: EventQueue
+        @rtype: bool
+        """
+        return (len(self._lane) > 0 and
+                not (self._items and self._items[0].timestamp <= self._now))
+
+    def remove(self):
+        """Remove and return the next event from this EventQueue.
+
+        Precondition: <self> should not be empty.
+
+        @type self: EventQueue
+        @rtype: Event
+
+        >>> from event import Event
+        >>> eq = EventQueue()
+        >>> for timestamp in [2, 1, 1]:
+        ...     eq.add(Event(timestamp))
+        >>> first = eq.remove()
+        >>> now = Event(1)
+        >>> eq.add(now)
+        >>> eq.remove() is now
+        False
+        >>> eq.remove() is now, eq.fast
+        (True, 1)
+        """
+        if self._from_lane():
+            return self._lane.popleft()
+        item = self._items.pop(0)
+        if self._now is None or item.timestamp > self._now:
+            self._now = item.timestamp
+        return item
+
+    def peek(self):
+        """Return the next event from this EventQueue without removing it.
+
+        Precondition: <self> should not be empty.
+
+        @type self: EventQueue
+        @rtype: Event
+        """
+        if self._from_lane():
+            return self._lane[0]
+        return self._items[0]
+
+    def is_empty(self):
+        """Return true iff this EventQueue is empty.
+
+        @type self: EventQueue
+        @rtype: bool
+        """
+        return not self._items and not self._lane
+
+    def add(self, item):
+        """Add the event <item> to this EventQueue.
+
+        @type self: EventQueue
+        @type item: Event
+        @rtype: None
+        """
+        if item.timestamp == self._now:
+            self._lane.append(item)
+            self.fast += 1
+        else:
+            insort(self._items, item)
 
 
 class Queue(Container):
@@ -151,6 +324,14 @@ class Queue(Container):
         """
         self._queue.append(item)
 
+    def __len__(self):
+        """Return the number of items in this Queue.
+
+        @type self: Queue
+        @rtype: int
+        """
+        return len(self._queue)
+
     def __str__(self):
         """Return a str representation of the Queue.
         @type self: Queue
@@ -208,3 +389,100 @@ class Queue(Container):
         True
         """
         return len(self._queue) == 0
+
+
+class LRUCache:
+    """A bounded mapping that evicts the least recently used entry.
+
+    === Attributes ===
+    @type capacity: int
+        The maximum number of entries held by the cache.
+    @type hits: int
+        The number of lookups that found their key.
+    @type misses: int
+        The number of lookups that did not find their key.
+    """
+
+    # === Private Attributes ===
+    # @type _entries: OrderedDict
+    #   The cached entries, ordered from least to most recently used.
+
+    def __init__(self, capacity):
+        """Initialize an empty LRUCache holding at most <capacity> entries.
+
+        @type self: LRUCache
+        @type capacity: int
+        @rtype: None
+        """
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        """Return the number of entries in this LRUCache.
+
+        @type self: LRUCache
+        @rtype: int
+        """
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the value stored for <key>, or <default> if it is missing.
+
+        @type self: LRUCache
+        @type key: object
+        @type default: object
+        @rtype: object
+
+        >>> cache = LRUCache(2)
+        >>> cache.put("a", 1)
+        >>> cache.get("a")
+        1
+        >>> cache.get("b") is None
+        True
+        >>> (cache.hits, cache.misses)
+        (1, 1)
+        """
+        entries = self._entries
+        if key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Store <value> for <key>, evicting the least recently used entry
+        if the cache is full.
+
+        @type self: LRUCache
+        @type key: object
+        @type value: object
+        @rtype: None
+
+        >>> cache = LRUCache(2)
+        >>> cache.put("a", 1)
+        >>> cache.put("b", 2)
+        >>> _ = cache.get("a")
+        >>> cache.put("c", 3)
+        >>> cache.get("b") is None
+        True
+        >>> cache.get("a")
+        1
+        """
+        entries = self._entries
+        entries[key] = value
+        entries.move_to_end(key)
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+
+    def clear(self):
+        """Remove every entry and reset the hit/miss statistics.
+
+        @type self: LRUCache
+        @rtype: None
+        """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
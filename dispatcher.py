@@ -1,6 +1,9 @@
-from driver import Driver
-from rider import Rider, CANCELLED
-from container import Queue
+from collections import deque
+
+from driver import Driver, FleetTable
+from rider import Rider, RiderRegistry, WAITING, CANCELLED
+from container import Container, Queue
+from travel import TravelCache
 
 
 class Dispatcher:
@@ -16,17 +19,48 @@ class Dispatcher:
     the waiting list to the driver. If there is no rider on the waiting list,
     the dispatcher does nothing. Once a driver requests a rider, the driver
     is registered with the dispatcher, and will be used to fulfill future
-    rider requests.
+    rider requests until their shift ends.
+
+    === Attributes ===
+    @type network: RoadNetwork | None
+        The road network drivers travel on, or None for the open grid.
+    @type travel: TravelCache
+        The memoized distances and travel times on the network.
+    @type driver_fleet: FleetTable
+        The state of the registered drivers, in order of registration.
+    @type riders: RiderRegistry
+        The status of every rider who has requested a driver.
+    @type pooling: bool
+        True iff drivers carry several riders at once, as a
+        PoolingDispatcher arranges.
+    @type strategy: DispatchStrategy | None
+        The policy matching riders with drivers, or None to give a rider
+        the first idle driver and a driver the longest-waiting rider.
     """
 
-    def __init__(self):
+    pooling = False
+
+    def __init__(self, network=None, travel_cache_size=65536, wait_list=None,
+                 strategy=None):
         """Initialize a Dispatcher.
 
         @type self: Dispatcher
+        @type network: RoadNetwork | None
+        @type travel_cache_size: int
+            The maximum number of entries held by the travel cache.
+        @type wait_list: Queue | RegionalWaitList | None
+            The wait list for riders, or None for a single FIFO Queue.
+        @type strategy: DispatchStrategy | None
         @rtype: None
         """
-        self.wait_list = Queue()
-        self.driver_fleet = []
+        self.network = network
+        self.travel = TravelCache(network, travel_cache_size)
+        if wait_list is None:
+            wait_list = Queue()
+        self.wait_list = wait_list
+        self.driver_fleet = FleetTable()
+        self.riders = RiderRegistry()
+        self.strategy = strategy
 
     def __str__(self):
         """Return a string representation.
@@ -47,40 +81,305 @@ class Dispatcher:
         @type rider: Rider
         @rtype: Driver | None
         """
-        req_driver = None
-        for driver in self.driver_fleet:
-            if driver.is_idle():
-                req_driver = driver
-                break
-        if req_driver is None:
+        self.riders.register(rider)
+        if self.strategy is not None:
+            driver = self.strategy.driver_for(self, rider)
+        else:
+            driver_id = self.driver_fleet.first_idle()
+            driver = (None if driver_id < 0
+                      else self.driver_fleet.drivers[driver_id])
+        if driver is None:
             self.wait_list.add(rider)
-        return req_driver
+        return driver
 
     def request_rider(self, driver):
         """Return a rider for the driver, or None if no rider is available.
 
         If this is a new driver, register the driver for future rider requests.
+        A driver whose shift has ended is not registered or given a rider.
 
         @type self: Dispatcher
         @type driver: Driver
         @rtype: Rider | None
         """
-        if driver not in self.driver_fleet:
-            self.driver_fleet.append(driver)
-        if self.wait_list.is_empty():
+        if not driver.on_shift:
+            self.remove_driver(driver)
             return None
-        else:
-            return self.wait_list.remove()
+        self.driver_fleet.add(driver)
+        if self.strategy is not None:
+            return self.strategy.rider_for(self, driver)
+        return self.next_waiting(driver.location)
+
+    def next_waiting(self, location):
+        """Remove and return the rider a driver at <location> is given from
+        the wait list, or None if no rider is waiting.
+
+        That is the rider the wait list hands to <location>: the
+        longest-waiting rider, or with a RegionalWaitList the longest-waiting
+        rider in the nearest region that has one. Cancelled riders left on
+        the wait list are skipped.
+
+        @type self: Dispatcher
+        @type location: Location
+        @rtype: Rider | None
+        """
+        while not self.wait_list.is_empty():
+            rider = self.wait_list.take_nearest(location)
+            if rider is None or rider.status == WAITING:
+                return rider
+        return None
+
+    def remove_driver(self, driver):
+        """Unregister <driver>, whose shift has ended.
+
+        The fleet is compacted once more than half of its rows are vacant,
+        so that scanning it costs time proportional to the active fleet.
+
+        @type self: Dispatcher
+        @type driver: Driver
+        @rtype: None
+        """
+        self.driver_fleet.remove(driver)
+        if self.driver_fleet.vacancies() * 2 > len(self.driver_fleet.drivers):
+            self.driver_fleet.compact()
 
     def cancel_ride(self, rider):
         """Cancel the ride request for rider.
 
+        The rider is discarded from the wait list; a wait list that keeps
+        them has them skipped by request_rider.
+
         Precondition: A ride request exists for the rider.
-        Precondition: The rider is next on the wait list.
 
         @type self: Dispatcher
         @type rider: Rider
         @rtype: None
         """
-        if rider == self.wait_list.remove():
+        if rider.status == WAITING:
             rider.status = CANCELLED
+            self.wait_list.discard(rider)
+
+
+class RegionalWaitList(Container):
+    """A wait list for riders that is partitioned into square regions of
+    the city grid, keyed on the origin of each rider.
+
+    A driver is matched with the longest-waiting rider in the nearest
+    non-empty region, searching outward ring by ring from the driver's
+    region. So that distant riders are not starved, the longest-waiting
+    rider overall is matched instead once <max_skips> other riders have
+    been matched ahead of them.
+
+    === Attributes ===
+    @type region_size: int
+        The width and height of a region, in streets.
+    @type max_radius: int | None
+        The number of rings searched around a driver's region, or None to
+        search until a rider is found.
+    @type max_skips: int | None
+        The number of riders that may be matched ahead of the
+        longest-waiting rider, or None to disable aging.
+    """
+
+    # === Private Attributes ===
+    # @type _regions: dict[(int, int), deque[list]]
+    #   The entries of the waiting riders in each non-empty region, oldest
+    #   first. An entry is [rider, arrival number, matched count when
+    #   added]; the rider is set to None once the entry is removed.
+    # @type _entries: dict[Rider, list]
+    #   The entry of each waiting rider. Riders are keyed by object, as
+    #   two waiting riders may share an identifier.
+    # @type _arrivals: deque[list]
+    #   Every entry, oldest first, used for aging.
+    # @type _arrived: int
+    #   The number of riders added so far.
+    # @type _matched: int
+    #   The number of riders removed so far.
+
+    def __init__(self, region_size=4, max_radius=None, max_skips=None):
+        """Initialize an empty RegionalWaitList.
+
+        @type self: RegionalWaitList
+        @type region_size: int
+        @type max_radius: int | None
+        @type max_skips: int | None
+        @rtype: None
+
+        >>> RegionalWaitList(0)
+        Traceback (most recent call last):
+        ...
+        ValueError: the region size must be at least 1, not 0
+        """
+        if region_size < 1:
+            raise ValueError("the region size must be at least 1, "
+                             "not {}".format(region_size))
+        self.region_size = region_size
+        self.max_radius = max_radius
+        self.max_skips = max_skips
+        self._regions = {}
+        self._entries = {}
+        self._arrivals = deque()
+        self._arrived = 0
+        self._matched = 0
+
+    def __len__(self):
+        """Return the number of riders on this wait list.
+
+        @type self: RegionalWaitList
+        @rtype: int
+        """
+        return len(self._entries)
+
+    def __str__(self):
+        """Return a str representation of the RegionalWaitList.
+
+        @type self: RegionalWaitList
+        @rtype: str
+        """
+        return "RegionalWaitList ({} riders in {} regions)".format(
+            len(self._entries), len(self._regions))
+
+    def _region(self, location):
+        """Return the region containing <location>.
+
+        @type self: RegionalWaitList
+        @type location: Location
+        @rtype: (int, int)
+        """
+        return (location.get_row() // self.region_size,
+                location.get_col() // self.region_size)
+
+    def add(self, rider):
+        """Add <rider> to the queue of the region of their origin.
+
+        @type self: RegionalWaitList
+        @type rider: Rider
+        @rtype: None
+        """
+        entry = [rider, self._arrived, self._matched]
+        self._arrived += 1
+        self._entries[rider] = entry
+        self._arrivals.append(entry)
+        region = self._region(rider.origin)
+        if region not in self._regions:
+            self._regions[region] = deque()
+        self._regions[region].append(entry)
+
+    def _take(self, entry):
+        """Remove <entry> and return its rider.
+
+        @type self: RegionalWaitList
+        @type entry: list
+        @rtype: Rider
+        """
+        rider = entry[0]
+        entry[0] = None
+        del self._entries[rider]
+        self._matched += 1
+        return rider
+
+    def _head(self, queue):
+        """Return the oldest entry of <queue> that is still waiting, or None.
+
+        Removed entries at the front of <queue> are dropped.
+
+        @type self: RegionalWaitList
+        @type queue: deque[list]
+        @rtype: list | None
+        """
+        while queue and queue[0][0] is None:
+            queue.popleft()
+        if queue:
+            return queue[0]
+        return None
+
+    def remove(self):
+        """Remove and return the longest-waiting rider.
+
+        Precondition: <self> should not be empty.
+
+        @type self: RegionalWaitList
+        @rtype: Rider
+        """
+        return self._take(self._head(self._arrivals))
+
+    def take_nearest(self, location):
+        """Remove and return a rider for a driver at <location>, or None if
+        no rider is within reach.
+
+        @type self: RegionalWaitList
+        @type location: Location
+        @rtype: Rider | None
+
+        >>> from location import Location
+        >>> from rider import Rider
+        >>> wait_list = RegionalWaitList(region_size=2, max_skips=1)
+        >>> wait_list.add(Rider("far", Location(9, 9), Location(1, 1), 5))
+        >>> wait_list.add(Rider("near", Location(1, 2), Location(3, 3), 5))
+        >>> wait_list.add(Rider("next", Location(0, 1), Location(3, 3), 5))
+        >>> wait_list.take_nearest(Location(1, 3)).identifier
+        'near'
+        >>> wait_list.take_nearest(Location(1, 3)).identifier
+        'far'
+        """
+        oldest = self._head(self._arrivals)
+        if oldest is None:
+            self._regions.clear()
+            return None
+        if (self.max_skips is not None and
+                self._matched - oldest[2] >= self.max_skips):
+            return self._take(oldest)
+        row, col = self._region(location)
+        radius = 0
+        while self.max_radius is None or radius <= self.max_radius:
+            best = None
+            for d_row in range(-radius, radius + 1):
+                d_col = radius - abs(d_row)
+                if d_col == 0:
+                    ring = [(row + d_row, col)]
+                else:
+                    ring = [(row + d_row, col - d_col),
+                            (row + d_row, col + d_col)]
+                for region in ring:
+                    queue = self._regions.get(region)
+                    if queue is None:
+                        continue
+                    entry = self._head(queue)
+                    if entry is None:
+                        del self._regions[region]
+                    elif best is None or entry[1] < best[1]:
+                        best = entry
+            if best is not None:
+                return self._take(best)
+            radius += 1
+        return None
+
+    def discard(self, rider):
+        """Remove <rider> from this wait list if they are on it.
+
+        @type self: RegionalWaitList
+        @type rider: Rider
+        @rtype: None
+
+        >>> from location import Location
+        >>> from rider import Rider
+        >>> wait_list = RegionalWaitList()
+        >>> first = Rider("Ann", Location(1, 1), Location(2, 2), 5)
+        >>> second = Rider("Ann", Location(1, 1), Location(3, 3), 5)
+        >>> wait_list.add(first)
+        >>> wait_list.add(second)
+        >>> wait_list.discard(first)
+        >>> wait_list.remove() is second, wait_list.is_empty()
+        (True, True)
+        """
+        entry = self._entries.pop(rider, None)
+        if entry is not None:
+            entry[0] = None
+
+    def is_empty(self):
+        """Return True iff no rider is waiting.
+
+        @type self: RegionalWaitList
+        @rtype: bool
+        """
+        return len(self._entries) == 0
@@ -1,9 +1,15 @@
-from location import Location, manhattan_distance
+from array import array
+
+from location import Location, intern_location, manhattan_distance
 
 
 class Driver:
     """A driver for a ride-sharing service.
 
+    A driver registered with a Dispatcher keeps its location, speed and
+    status in the dispatcher's FleetTable; the Driver object is a view of
+    its row.
+
     === Attributes ===
     @type identifier: str
         A unique identifier for the driver
@@ -11,8 +17,17 @@ class Driver:
         The current location of the driver.
     @type is_idle: bool
         A property that is True if the driver is idle and False otherwise.
+    @type on_shift: bool
+        True if the driver is working and False otherwise.
     """
 
+    # === Private Attributes ===
+    # @type _table: FleetTable | None
+    #   The table holding this driver's state, or None if the state is
+    #   held by this object.
+    # @type _id: int
+    #   The row of this driver in _table.
+
     def __init__(self, identifier, location, speed):
         """Initialize a Driver.
 
@@ -23,10 +38,104 @@ class Driver:
         @rtype: None
         """
         self.identifier = identifier
-        self.location = location
-        self.speed = speed
-        self.is_idle = True
-        self.destination = None
+        self._table = None
+        self._id = -1
+        self._location = location
+        self._speed = speed
+        self._is_idle = True
+        self._on_shift = True
+        self._destination = None
+
+    @property
+    def location(self):
+        """Return the current location of the driver.
+
+        @type self: Driver
+        @rtype: Location
+        """
+        if self._table is None:
+            return self._location
+        return self._table.get_location(self._id)
+
+    @location.setter
+    def location(self, location):
+        if self._table is None:
+            self._location = location
+        else:
+            self._table.rows[self._id] = location.get_row()
+            self._table.cols[self._id] = location.get_col()
+
+    @property
+    def speed(self):
+        """Return the speed of the driver.
+
+        @type self: Driver
+        @rtype: int
+        """
+        if self._table is None:
+            return self._speed
+        return self._table.speeds[self._id]
+
+    @speed.setter
+    def speed(self, speed):
+        if self._table is None:
+            self._speed = speed
+        else:
+            self._table.speeds[self._id] = speed
+
+    @property
+    def is_idle(self):
+        """Return True iff the driver is idle.
+
+        @type self: Driver
+        @rtype: bool
+        """
+        if self._table is None:
+            return self._is_idle
+        return self._table.idle[self._id] == 1
+
+    @is_idle.setter
+    def is_idle(self, is_idle):
+        if self._table is None:
+            self._is_idle = is_idle
+        else:
+            self._table.idle[self._id] = 1 if is_idle else 0
+
+    @property
+    def on_shift(self):
+        """Return True iff the driver is working.
+
+        @type self: Driver
+        @rtype: bool
+        """
+        if self._table is None:
+            return self._on_shift
+        return self._table.on_shift[self._id] == 1
+
+    @on_shift.setter
+    def on_shift(self, on_shift):
+        if self._table is None:
+            self._on_shift = on_shift
+        else:
+            self._table.on_shift[self._id] = 1 if on_shift else 0
+
+    @property
+    def destination(self):
+        """Return the destination of the driver, or None.
+
+        @type self: Driver
+        @rtype: Location | None
+        """
+        if self._table is None:
+            return self._destination
+        return self._table.get_destination(self._id)
+
+    @destination.setter
+    def destination(self, destination):
+        if self._table is None:
+            self._destination = destination
+        else:
+            self._table.set_destination(self._id, destination)
 
     def __str__(self):
         """Return a string representation.
@@ -55,45 +164,317 @@ class Driver:
                 self.is_idle == other.is_idle and
                 self.destination == other.destination)
 
-    def get_travel_time(self, destination):
+    def get_travel_time(self, destination, network=None):
         """Return the time it will take to arrive at the destination,
         rounded to the nearest integer.
 
+        Travel follows <network> if one is given, and the open grid
+        otherwise.
+
         @type self: Driver
         @type destination: Location
+        @type network: RoadNetwork | TravelCache | None
         @rtype: int
         """
+        if network is not None:
+            return network.travel_time(self.location, destination, self.speed)
         time = manhattan_distance(self.location, destination) / self.speed
         return int(time)
 
-    def start_drive(self, location):
+    def start_drive(self, location, network=None):
         """Start driving to the location and return the required travel time
         to location.
 
         @type self: Driver
         @type location: Location
+        @type network: RoadNetwork | TravelCache | None
         @rtype: int
         """
         self.is_idle = False
         self.destination = location
-        return self.get_travel_time(location)
+        return self.get_travel_time(location, network)
 
     def end_drive(self):
         """End the drive and arrive at the destination.
 
+        A driver whose shift has ended does not become idle.
+
         Precondition: self.destination is not None.
 
         @type self: Driver
         @rtype: None
         """
-        self.is_idle = True
+        self.is_idle = self.on_shift
         self.location = self.destination
         self.destination = None
 
     def end_shift(self):
         """Driver has finished his job for the day and is no longer taking riders.
 
+        A driver who is driving a rider finishes the ride first.
+
         @type self: Driver
         @rtype: None
         """
         self.is_idle = False
+        self.on_shift = False
+
+    def start_shift(self):
+        """Driver has started working and is taking riders once they have
+        finished any drive in progress.
+
+        @type self: Driver
+        @rtype: None
+        """
+        self.on_shift = True
+        self.is_idle = self.destination is None
+
+
+class FleetTable:
+    """The state of a fleet of drivers, stored in parallel typed arrays.
+
+    Row i of every array describes the driver with id i. Scans over the
+    fleet run over contiguous memory instead of following Driver and
+    Location objects. Rows are in order of registration; the row of a
+    removed driver is vacant until the table is compacted.
+
+    === Attributes ===
+    @type rows: array
+        The row of each driver's location.
+    @type cols: array
+        The column of each driver's location.
+    @type speeds: array
+        The speed of each driver.
+    @type idle: array
+        1 if the driver is idle and 0 otherwise (always 0 for a vacant row).
+    @type on_shift: array
+        1 if the driver is working and 0 otherwise.
+    @type moving: array
+        1 if the driver has a destination and 0 otherwise.
+    @type dest_rows: array
+        The row of each driver's destination, if they have one.
+    @type dest_cols: array
+        The column of each driver's destination, if they have one.
+    @type drivers: list[Driver | None]
+        The Driver viewing each row, or None for a vacant row.
+    """
+
+    # === Private Attributes ===
+    # @type _ids: dict[str, int]
+    #   The id of each driver in the table, by identifier.
+
+    def __init__(self):
+        """Initialize an empty FleetTable.
+
+        @type self: FleetTable
+        @rtype: None
+        """
+        self.rows = array("i")
+        self.cols = array("i")
+        self.speeds = array("i")
+        self.idle = array("b")
+        self.on_shift = array("b")
+        self.moving = array("b")
+        self.dest_rows = array("i")
+        self.dest_cols = array("i")
+        self.drivers = []
+        self._ids = {}
+
+    def __len__(self):
+        """Return the number of drivers in the table.
+
+        @type self: FleetTable
+        @rtype: int
+        """
+        return len(self._ids)
+
+    def __iter__(self):
+        """Return an iterator over the drivers in order of registration.
+
+        @type self: FleetTable
+        @rtype: iterator[Driver]
+        """
+        return (driver for driver in self.drivers if driver is not None)
+
+    def __contains__(self, driver):
+        """Return True iff <driver> is in the table.
+
+        @type self: FleetTable
+        @type driver: Driver
+        @rtype: bool
+        """
+        return driver.identifier in self._ids
+
+    def __str__(self):
+        """Return a string representation.
+
+        @type self: FleetTable
+        @rtype: str
+        """
+        return "[{}]".format(", ".join(str(driver) for driver in self))
+
+    def get_location(self, driver_id):
+        """Return the location of the driver with <driver_id>.
+
+        @type self: FleetTable
+        @type driver_id: int
+        @rtype: Location
+        """
+        return intern_location(self.rows[driver_id], self.cols[driver_id])
+
+    def get_destination(self, driver_id):
+        """Return the destination of the driver with <driver_id>, or None.
+
+        @type self: FleetTable
+        @type driver_id: int
+        @rtype: Location | None
+        """
+        if self.moving[driver_id] == 0:
+            return None
+        return intern_location(self.dest_rows[driver_id],
+                               self.dest_cols[driver_id])
+
+    def set_destination(self, driver_id, destination):
+        """Set the destination of the driver with <driver_id>.
+
+        @type self: FleetTable
+        @type driver_id: int
+        @type destination: Location | None
+        @rtype: None
+        """
+        if destination is None:
+            self.moving[driver_id] = 0
+        else:
+            self.moving[driver_id] = 1
+            self.dest_rows[driver_id] = destination.get_row()
+            self.dest_cols[driver_id] = destination.get_col()
+
+    def add(self, driver):
+        """Add <driver> to the table, which then holds their state, and
+        return their id.
+
+        >>> table = FleetTable()
+        >>> driver = Driver("Crocus", Location(3, 1), 2)
+        >>> table.add(driver)
+        0
+        >>> driver.start_drive(Location(3, 5))
+        2
+        >>> (table.idle[0], table.dest_cols[0])
+        (0, 5)
+
+        @type self: FleetTable
+        @type driver: Driver
+        @rtype: int
+        """
+        driver_id = self._ids.get(driver.identifier)
+        if driver_id is not None:
+            return driver_id
+        driver_id = len(self.drivers)
+        location = driver.location
+        destination = driver.destination
+        self.rows.append(location.get_row())
+        self.cols.append(location.get_col())
+        self.speeds.append(driver.speed)
+        self.idle.append(1 if driver.is_idle else 0)
+        self.on_shift.append(1 if driver.on_shift else 0)
+        self.moving.append(0)
+        self.dest_rows.append(0)
+        self.dest_cols.append(0)
+        self.set_destination(driver_id, destination)
+        self.drivers.append(driver)
+        self._ids[driver.identifier] = driver_id
+        driver._table = self
+        driver._id = driver_id
+        return driver_id
+
+    def remove(self, driver):
+        """Remove <driver> from the table, which hands their state back to
+        the Driver object, and leave their row vacant.
+
+        @type self: FleetTable
+        @type driver: Driver
+        @rtype: None
+        """
+        driver_id = self._ids.pop(driver.identifier, None)
+        if driver_id is None:
+            return
+        location = driver.location
+        speed = driver.speed
+        is_idle = driver.is_idle
+        on_shift = driver.on_shift
+        destination = driver.destination
+        driver._table = None
+        driver._id = -1
+        driver.location = location
+        driver.speed = speed
+        driver.is_idle = is_idle
+        driver.on_shift = on_shift
+        driver.destination = destination
+        self.drivers[driver_id] = None
+        self.idle[driver_id] = 0
+
+    def vacancies(self):
+        """Return the number of vacant rows.
+
+        @type self: FleetTable
+        @rtype: int
+        """
+        return len(self.drivers) - len(self._ids)
+
+    def compact(self):
+        """Remove the vacant rows, keeping the order of the other rows.
+
+        @type self: FleetTable
+        @rtype: None
+        """
+        keep = [driver_id for driver_id, driver in enumerate(self.drivers)
+                if driver is not None]
+        for name in ("rows", "cols", "speeds", "idle", "on_shift", "moving",
+                     "dest_rows", "dest_cols"):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode,
+                                      [column[i] for i in keep]))
+        self.drivers = [self.drivers[i] for i in keep]
+        for driver_id, driver in enumerate(self.drivers):
+            driver._id = driver_id
+            self._ids[driver.identifier] = driver_id
+
+    def first_idle(self):
+        """Return the id of the first idle driver, or -1 if none is idle.
+
+        @type self: FleetTable
+        @rtype: int
+        """
+        try:
+            return self.idle.index(1)
+        except ValueError:
+            return -1
+
+    def nearest_idle(self, location):
+        """Return the id of the idle driver nearest to <location> on the open
+        grid, or -1 if none is idle. Ties go to the earliest registration.
+
+        @type self: FleetTable
+        @type location: Location
+        @rtype: int
+        """
+        row = location.get_row()
+        col = location.get_col()
+        best = -1
+        best_distance = None
+        for driver_id, (idle, d_row, d_col) in enumerate(
+                zip(self.idle, self.rows, self.cols)):
+            if idle:
+                distance = abs(d_row - row) + abs(d_col - col)
+                if best_distance is None or distance < best_distance:
+                    best = driver_id
+                    best_distance = distance
+        return best
+
+    def idle_count(self):
+        """Return the number of idle drivers.
+
+        @type self: FleetTable
+        @rtype: int
+        """
+        return self.idle.count(1)
@@ -4,10 +4,11 @@ This file should contain all of the classes necessary to model the different
 kinds of events in the simulation
 """
 from rider import Rider, CANCELLED, SATISFIED
-from dispatcher import Dispatcher
 from driver import Driver
 from location import deserialize_location
-from monitor import Monitor, RIDER, DRIVER, REQUEST, CANCEL, PICKUP, DROPOFF
+from traces import open_trace
+from monitor import (RIDER, DRIVER, REQUEST, CANCEL, PICKUP, DROPOFF,
+                     REPOSITION)
 
 
 class Event:
@@ -216,10 +217,16 @@ class RiderRequest(Event):
         events = []
         monitor.notify(self.timestamp, RIDER, REQUEST, self.rider.identifier,
                        self.rider.origin)
+        if dispatcher.pooling:
+            return dispatcher.request_shared(self.timestamp, self.rider)
         driver = dispatcher.request_driver(self.rider)
         if driver is not None:
-            travel_time = driver.start_drive(self.rider.origin)
-            events.append(Pickup(self.timestamp + travel_time, self.rider, driver))
+            distance = dispatcher.travel.distance(driver.location,
+                                                  self.rider.origin)
+            travel_time = driver.start_drive(self.rider.origin,
+                                             dispatcher.travel)
+            events.append(Pickup(self.timestamp + travel_time, self.rider,
+                                 driver, distance))
             if travel_time > self.rider.patience:
                 events.append(Cancellation(self.timestamp + self.rider.patience, self.rider))
         return events
@@ -257,19 +264,30 @@ class DriverRequest(Event):
 
         If a rider is available, return a Pickup event.
 
+        A driver who was sent repositioning between arriving and this
+        request requests a rider when they arrive instead.
+
         @type self: DriverRequest
         @type dispatcher: Dispatcher
         @type monitor: Monitor
         @rtype: list[Event]
         """
         events = []
+        if self.driver.destination is not None:
+            return events
         monitor.notify(self.timestamp, DRIVER, REQUEST,
                        self.driver.identifier, self.driver.location)
         rider = dispatcher.request_rider(self.driver)
-        if rider is not None:
-            travel_time = self.driver.start_drive(rider.origin)
+        if rider is not None and dispatcher.pooling:
+            events.extend(dispatcher.start_trip(self.timestamp, self.driver,
+                                                rider))
+        elif rider is not None:
+            distance = dispatcher.travel.distance(self.driver.location,
+                                                  rider.origin)
+            travel_time = self.driver.start_drive(rider.origin,
+                                                  dispatcher.travel)
             events.append(Pickup(self.timestamp + travel_time, rider,
-                                 self.driver))
+                                 self.driver, distance))
         return events
 
     def __str__(self):
@@ -333,19 +351,24 @@ class Pickup(Event):
         The rider
     @type driver: Driver
         The driver.
+    @type distance: int | float | None
+        The distance the driver covers to reach the rider, recorded when
+        the driver was dispatched.
     """
 
-    def __init__(self, timestamp, rider, driver):
+    def __init__(self, timestamp, rider, driver, distance=None):
         """Initialize a Pickup Event.
 
         @type self: Pickup
         @type rider: Rider
         @type driver: Driver
+        @type distance: int | float | None
         @rtype: None
         """
         super().__init__(timestamp)
         self.rider = rider
         self.driver = driver
+        self.distance = distance
 
     def do(self, dispatcher, monitor):
         """Set driver's location as the rider's location.
@@ -360,18 +383,21 @@ class Pickup(Event):
         @rtype: list[Event]
         """
         events = []
-        self.driver.start_drive(self.rider.origin)
+        self.driver.end_drive()
         if self.rider.get_status() == CANCELLED:
-            self.driver.end_drive()
             events.append(DriverRequest(self.timestamp, self.driver))
         else:
             monitor.notify(self.timestamp, RIDER, PICKUP,
                            self.rider.identifier, self.rider.origin)
             monitor.notify(self.timestamp, DRIVER, PICKUP,
-                           self.driver.identifier, self.driver.location)
-            travel_time = self.driver.get_travel_time(self.driver.destination)
+                           self.driver.identifier, self.driver.location,
+                           self.distance)
+            distance = dispatcher.travel.distance(self.rider.origin,
+                                                  self.rider.destination)
+            travel_time = self.driver.start_drive(self.rider.destination,
+                                                  dispatcher.travel)
             events.append(Dropoff(self.timestamp + travel_time, self.rider,
-                                  self.driver))
+                                  self.driver, distance))
         return events
 
     def __str__(self):
@@ -393,20 +419,24 @@ class Dropoff(Event):
         The rider.
     @type driver: Driver
         The driver.
+    @type distance: int | float | None
+        The length of the ride, recorded when the rider was picked up.
     """
 
-    def __init__(self, timestamp, rider, driver):
+    def __init__(self, timestamp, rider, driver, distance=None):
         """Initialize a Dropoff Event
 
         @type self: Dropoff
         @type timestamp: int
         @type rider: Rider
         @type driver: Driver
+        @type distance: int | float | None
         @rtype: None
         """
         super().__init__(timestamp)
         self.rider = rider
         self.driver = driver
+        self.distance = distance
 
     def do(self, dispatcher, monitor):
         """Sets the driver's location to the rider's destination, then leaves
@@ -425,7 +455,8 @@ class Dropoff(Event):
         monitor.notify(self.timestamp, RIDER, DROPOFF,
                        self.rider.identifier, self.rider.destination)
         monitor.notify(self.timestamp, DRIVER, DROPOFF,
-                       self.driver.identifier, self.driver.location)
+                       self.driver.identifier, self.driver.location,
+                       self.distance)
         self.rider.status = SATISFIED
         events.append(DriverRequest(self.timestamp, self.driver))
         return events
@@ -441,35 +472,386 @@ class Dropoff(Event):
                                                                self.driver)
 
 
+class DriverOnline(Event):
+    """A driver starts a shift.
+
+    === Attributes ===
+    @type driver: Driver
+        The driver.
+    """
+
+    def __init__(self, timestamp, driver):
+        """Initialize a DriverOnline event.
+
+        @type self: DriverOnline
+        @type driver: Driver
+        @rtype: None
+        """
+        super().__init__(timestamp)
+        self.driver = driver
+
+    def do(self, dispatcher, monitor):
+        """Start the driver's shift.
+
+        If the driver is not finishing a drive, return a DriverRequest event
+        for the driver to take place immediately. Otherwise the driver
+        requests a rider when the drive ends.
+
+        @type self: DriverOnline
+        @type dispatcher: Dispatcher
+        @type monitor: Monitor
+        @rtype: list[Event]
+        """
+        events = []
+        self.driver.start_shift()
+        if self.driver.is_idle:
+            events.append(DriverRequest(self.timestamp, self.driver))
+        return events
+
+    def __str__(self):
+        """Return a string representation of this event.
+
+        @type self: DriverOnline
+        @rtype: str
+        """
+        return "{} -- {}: Start shift".format(self.timestamp, self.driver)
+
+
+class DriverOffline(Event):
+    """A driver ends a shift.
+
+    === Attributes ===
+    @type driver: Driver
+        The driver.
+    """
+
+    def __init__(self, timestamp, driver):
+        """Initialize a DriverOffline event.
+
+        @type self: DriverOffline
+        @type driver: Driver
+        @rtype: None
+        """
+        super().__init__(timestamp)
+        self.driver = driver
+
+    def do(self, dispatcher, monitor):
+        """End the driver's shift and remove the driver from the fleet.
+
+        A driver who is on the way to a rider or carrying one finishes the
+        ride, but is not given another rider.
+
+        @type self: DriverOffline
+        @type dispatcher: Dispatcher
+        @type monitor: Monitor
+        @rtype: list[Event]
+        """
+        self.driver.end_shift()
+        dispatcher.remove_driver(self.driver)
+        return []
+
+    def __str__(self):
+        """Return a string representation of this event.
+
+        @type self: DriverOffline
+        @rtype: str
+        """
+        return "{} -- {}: End shift".format(self.timestamp, self.driver)
+
+
+class TripStop(Event):
+    """A driver in pooling mode reaches a stop of their trip.
+
+    === Attributes ===
+    @type rider: Rider
+        The rider picked up or dropped off at the stop.
+    @type driver: Driver
+        The driver.
+    @type kind: PICKUP | DROPOFF
+        Whether the rider is picked up or dropped off.
+    @type distance: int | float | None
+        The distance the driver covers from their previous stop.
+    """
+
+    def __init__(self, timestamp, rider, driver, kind, distance=None):
+        """Initialize a TripStop event.
+
+        @type self: TripStop
+        @type rider: Rider
+        @type driver: Driver
+        @type kind: PICKUP | DROPOFF
+        @type distance: int | float | None
+        @rtype: None
+        """
+        super().__init__(timestamp)
+        self.rider = rider
+        self.driver = driver
+        self.kind = kind
+        self.distance = distance
+
+    def do(self, dispatcher, monitor):
+        """Pick up or drop off the rider, unless they cancelled before being
+        picked up.
+
+        Return the event of the driver's next stop, or a DriverRequest
+        event for the driver at the end of their trip.
+
+        @type self: TripStop
+        @type dispatcher: PoolingDispatcher
+        @type monitor: Monitor
+        @rtype: list[Event]
+        """
+        if self.kind == DROPOFF or self.rider.status != CANCELLED:
+            location = (self.rider.origin if self.kind == PICKUP
+                        else self.rider.destination)
+            monitor.notify(self.timestamp, RIDER, self.kind,
+                           self.rider.identifier, location)
+            monitor.notify(self.timestamp, DRIVER, self.kind,
+                           self.driver.identifier, location, self.distance)
+        return dispatcher.complete_stop(self.timestamp, self.driver)
+
+    def __str__(self):
+        """Return a string representation of this event.
+
+        @type self: TripStop
+        @rtype: str
+        """
+        return "{} -- {} -- {}: Driver reaches {} stop".format(
+            self.timestamp, self.rider, self.driver, self.kind)
+
+
+class Reposition(Event):
+    """An idle driver arrives where they were sent by rebalancing.
+
+    === Attributes ===
+    @type driver: Driver
+        The driver.
+    @type distance: int | float | None
+        The distance the driver covers without a rider, recorded when the
+        driver was sent.
+    """
+
+    def __init__(self, timestamp, driver, distance=None):
+        """Initialize a Reposition event.
+
+        @type self: Reposition
+        @type driver: Driver
+        @type distance: int | float | None
+        @rtype: None
+        """
+        super().__init__(timestamp)
+        self.driver = driver
+        self.distance = distance
+
+    def do(self, dispatcher, monitor):
+        """End the driver's drive, record it, and return a DriverRequest
+        event for the driver to take place immediately.
+
+        @type self: Reposition
+        @type dispatcher: Dispatcher
+        @type monitor: Monitor
+        @rtype: list[Event]
+
+        >>> from dispatcher import Dispatcher
+        >>> from location import Location
+        >>> from monitor import Monitor
+        >>> from travel import TravelCache
+        >>> dispatcher, monitor = Dispatcher(), Monitor()
+        >>> driver = Driver("Bob", Location(1, 1), 1)
+        >>> _ = DriverRequest(0, driver).do(dispatcher, monitor)
+        >>> _ = driver.start_drive(Location(4, 5), TravelCache())
+        >>> _ = Reposition(7, driver, 7).do(dispatcher, monitor)
+        >>> monitor.report()["driver_total_distance"]
+        7.0
+        """
+        self.driver.end_drive()
+        monitor.notify(self.timestamp, DRIVER, REPOSITION,
+                       self.driver.identifier, self.driver.location,
+                       self.distance)
+        return [DriverRequest(self.timestamp, self.driver)]
+
+    def __str__(self):
+        """Return a string representation of this event.
+
+        @type self: Reposition
+        @rtype: str
+        """
+        return "{} -- {}: Repositioned".format(self.timestamp, self.driver)
+
+
+class Rebalance(Event):
+    """A periodic pass that sends idle drivers toward unmet demand.
+
+    === Attributes ===
+    @type rebalancer: Rebalancer
+        The rebalancer deciding where drivers go.
+    """
+
+    def __init__(self, timestamp, rebalancer):
+        """Initialize a Rebalance event.
+
+        @type self: Rebalance
+        @type rebalancer: Rebalancer
+        @rtype: None
+        """
+        super().__init__(timestamp)
+        self.rebalancer = rebalancer
+
+    def do(self, dispatcher, monitor):
+        """Send idle drivers toward unmet demand.
+
+        Return a Reposition event for each driver sent, and the next
+        Rebalance event unless it would come after rebalancer.until.
+
+        @type self: Rebalance
+        @type dispatcher: Dispatcher
+        @type monitor: Monitor
+        @rtype: list[Event]
+        """
+        events = self.rebalancer.rebalance(dispatcher, self.timestamp)
+        next_time = self.timestamp + self.rebalancer.interval
+        if (self.rebalancer.until is not None and
+                next_time <= self.rebalancer.until):
+            events.append(Rebalance(next_time, self.rebalancer))
+        return events
+
+    def __str__(self):
+        """Return a string representation of this event.
+
+        @type self: Rebalance
+        @rtype: str
+        """
+        return "{} -- Rebalance idle drivers".format(self.timestamp)
+
+
+class Match(Event):
+    """A periodic batch match of waiting riders with idle drivers.
+
+    === Attributes ===
+    @type strategy: DispatchStrategy
+        The batched strategy making the matches.
+    """
+
+    def __init__(self, timestamp, strategy):
+        """Initialize a Match event.
+
+        @type self: Match
+        @type strategy: DispatchStrategy
+        @rtype: None
+        """
+        super().__init__(timestamp)
+        self.strategy = strategy
+
+    def do(self, dispatcher, monitor):
+        """Match waiting riders with idle drivers, who start driving to
+        their riders.
+
+        Return a Pickup event for each match, and the next Match event
+        unless it would come after strategy.until with no rider waiting or
+        no driver left.
+
+        @type self: Match
+        @type dispatcher: Dispatcher
+        @type monitor: Monitor
+        @rtype: list[Event]
+        """
+        events = []
+        for driver, rider in self.strategy.match(dispatcher, self.timestamp):
+            distance = dispatcher.travel.distance(driver.location,
+                                                  rider.origin)
+            travel_time = driver.start_drive(rider.origin, dispatcher.travel)
+            events.append(Pickup(self.timestamp + travel_time, rider, driver,
+                                 distance))
+        next_time = self.timestamp + self.strategy.interval
+        until = self.strategy.until
+        if until is not None and (next_time <= until or (
+                not dispatcher.wait_list.is_empty() and
+                len(dispatcher.driver_fleet) > 0)):
+            events.append(Match(next_time, self.strategy))
+        return events
+
+    def __str__(self):
+        """Return a string representation of this event.
+
+        @type self: Match
+        @rtype: str
+        """
+        return "{} -- Match waiting riders".format(self.timestamp)
+
+
 def create_event_list(filename):
     """Return a list of Events based on raw list of events in <filename>.
     
+    The file may be compressed with gzip, xz or bzip2.
+
     Precondition: the file stored at <filename> is in a specified format.
     
     @type filename: str
         The name of a file that contains the list of events.
     @rtype: list[Event]
     """
-    events = []
-    with open(filename, "r") as file:
-        for line in file:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            tokens = line.split()
-            timestamp = int(tokens[0])
-            event_type = tokens[1]
-            identifier = tokens[2]
-            if event_type == "DriverRequest":
+    with open_trace(filename) as trace:
+        return parse_events(trace)
+
+
+def parse_events(lines, drivers=None):
+    """Return a list of Events based on the raw events in <lines>.
+
+    Blank lines and lines starting with "#" are skipped.
+
+    @type lines: iterable[str]
+    @type drivers: dict[str, Driver] | None
+        The drivers registered before <lines>, by identifier; the drivers
+        <lines> registers are added to it.
+    @rtype: list[Event]
+
+    >>> events = parse_events(["0 DriverRequest Ann 1,1 1",
+    ...                        "# a comment",
+    ...                        "2 RiderRequest Bob 1,2 3,3 5"])
+    >>> [type(event).__name__ for event in events]
+    ['DriverRequest', 'RiderRequest']
+    """
+    return list(iter_events(lines, drivers))
+
+
+def iter_events(lines, drivers=None):
+    """Yield the Events based on the raw events in <lines>, one at a time,
+    as parse_events would return them.
+
+    @type lines: iterable[str]
+    @type drivers: dict[str, Driver] | None
+    @rtype: iterator[Event]
+    """
+    if drivers is None:
+        drivers = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        tokens = line.split()
+        timestamp = int(tokens[0])
+        event_type = tokens[1]
+        identifier = tokens[2]
+        if event_type == "DriverRequest":
+            location = deserialize_location(tokens[3])
+            speed = int(tokens[4])
+            driver = Driver(identifier, location, speed)
+            drivers[identifier] = driver
+            event = DriverRequest(timestamp, driver)
+        elif event_type == "RiderRequest":
+            origin = deserialize_location(tokens[3])
+            destination = deserialize_location(tokens[4])
+            patience = int(tokens[5])
+            rider = Rider(identifier, origin, destination, patience)
+            event = RiderRequest(timestamp, rider)
+        elif event_type == "DriverOnline":
+            driver = drivers.get(identifier)
+            if driver is None:
                 location = deserialize_location(tokens[3])
                 speed = int(tokens[4])
                 driver = Driver(identifier, location, speed)
-                event = DriverRequest(timestamp, driver)
-            elif event_type == "RiderRequest":
-                origin = deserialize_location(tokens[3])
-                destination = deserialize_location(tokens[4])
-                patience = int(tokens[5])
-                rider = Rider(identifier, origin, destination, patience)
-                event = RiderRequest(timestamp, rider)
-            events.append(event)
-    return events
+                drivers[identifier] = driver
+            event = DriverOnline(timestamp, driver)
+        elif event_type == "DriverOffline":
+            event = DriverOffline(timestamp, drivers[identifier])
+        yield event
@@ -0,0 +1,274 @@
+import struct
+import threading
+from queue import Queue as BlockQueue
+
+from event import (RiderRequest, DriverRequest, Cancellation, Pickup, Dropoff,
+                   DriverOnline, DriverOffline, Reposition, Rebalance,
+                   TripStop, Match)
+
+"""
+The journal module appends every processed event to a compact binary file
+without slowing down the simulation loop.
+
+Records are packed into a ring of preallocated blocks. When a block is
+full it is handed to a background writer thread, which writes it out in a
+single call and returns it to the ring. The simulation loop only
+synchronizes with the writer once per block.
+
+A journal file starts with MAGIC and contains two kinds of records:
+    an event record: the event's code, its timestamp, and the ids of its
+        rider and driver (NO_ID if it has none), packed as EVENT_RECORD;
+    a name record: NAME_CODE, the id being defined and the length of the
+        name, packed as NAME_RECORD, followed by the UTF-8 encoded name.
+A name record appears before the first event record that uses its id.
+
+=== Constants ===
+@type MAGIC: bytes
+    The first bytes of a journal file.
+@type EVENT_CODES: dict[type, int]
+    The code of each event class.
+@type EVENT_NAMES: dict[int, str]
+    The name of the event class with each code.
+@type NAME_CODE: int
+    The code of a name record.
+@type NO_ID: int
+    The id recorded for a missing rider or driver.
+@type EVENT_RECORD: struct.Struct
+    The layout of an event record.
+@type NAME_RECORD: struct.Struct
+    The layout of the fixed part of a name record.
+"""
+
+MAGIC = b"RSCJRN01"
+
+EVENT_CODES = {RiderRequest: 1,
+               DriverRequest: 2,
+               Cancellation: 3,
+               Pickup: 4,
+               Dropoff: 5,
+               DriverOnline: 6,
+               DriverOffline: 7,
+               Reposition: 8,
+               Rebalance: 9,
+               TripStop: 10,
+               Match: 11}
+EVENT_NAMES = {code: cls.__name__ for cls, code in EVENT_CODES.items()}
+NAME_CODE = 0
+NO_ID = 0xFFFFFFFF
+
+EVENT_RECORD = struct.Struct("<BqII")
+NAME_RECORD = struct.Struct("<BIH")
+
+
+class JournalWriter:
+    """Appends processed events to a journal file from a background thread.
+
+    A JournalWriter is a context manager; the journal is complete once it
+    is closed.
+
+    === Attributes ===
+    @type filename: str
+        The name of the journal file.
+    @type records: int
+        The number of event records written so far.
+    """
+
+    # === Private Attributes ===
+    # @type _file: file
+    #   The open journal file; only the writer thread uses it.
+    # @type _names: dict[str, int]
+    #   The id of each rider and driver identifier defined so far.
+    # @type _block: bytearray
+    #   The block being filled.
+    # @type _used: int
+    #   The number of bytes used in _block.
+    # @type _free: BlockQueue
+    #   The blocks ready to be filled.
+    # @type _full: BlockQueue
+    #   The (block, used) pairs waiting to be written, then None to stop.
+    # @type _thread: threading.Thread
+    #   The writer thread.
+    # @type _error: Exception | None
+    #   The error raised in the writer thread, if any.
+
+    def __init__(self, filename, block_size=1 << 20, blocks=4):
+        """Initialize a JournalWriter and start its writer thread.
+
+        @type self: JournalWriter
+        @type filename: str
+        @type block_size: int
+            The size of each block in bytes.
+        @type blocks: int
+            The number of blocks in the ring.
+        @rtype: None
+        """
+        self.filename = filename
+        self.records = 0
+        self._file = open(filename, "wb")
+        self._file.write(MAGIC)
+        self._names = {}
+        self._free = BlockQueue()
+        self._full = BlockQueue()
+        for _ in range(blocks - 1):
+            self._free.put(bytearray(block_size))
+        self._block = bytearray(block_size)
+        self._used = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._write_blocks,
+                                        name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        """Return this JournalWriter.
+
+        @type self: JournalWriter
+        @rtype: JournalWriter
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close this JournalWriter.
+
+        @type self: JournalWriter
+        @rtype: None
+        """
+        self.close()
+
+    def _write_blocks(self):
+        """Write full blocks to the file until told to stop.
+
+        @type self: JournalWriter
+        @rtype: None
+        """
+        while True:
+            item = self._full.get()
+            if item is None:
+                return
+            block, used = item
+            try:
+                if self._error is None:
+                    self._file.write(memoryview(block)[:used])
+            except OSError as error:
+                self._error = error
+            self._free.put(block)
+
+    def _reserve(self, size):
+        """Make room for <size> bytes in the current block.
+
+        @type self: JournalWriter
+        @type size: int
+        @rtype: None
+        """
+        if self._used + size > len(self._block):
+            self._full.put((self._block, self._used))
+            self._block = self._free.get()
+            self._used = 0
+            if size > len(self._block):
+                self._block = bytearray(size)
+
+    def _name_id(self, identifier):
+        """Return the id of <identifier>, recording a name record for it
+        if it is new.
+
+        @type self: JournalWriter
+        @type identifier: str
+        @rtype: int
+        """
+        name_id = self._names.get(identifier)
+        if name_id is None:
+            name_id = len(self._names)
+            self._names[identifier] = name_id
+            name = identifier.encode("utf-8")
+            self._reserve(NAME_RECORD.size + len(name))
+            NAME_RECORD.pack_into(self._block, self._used, NAME_CODE,
+                                  name_id, len(name))
+            start = self._used + NAME_RECORD.size
+            self._block[start:start + len(name)] = name
+            self._used = start + len(name)
+        return name_id
+
+    def record(self, event):
+        """Append <event> to the journal.
+
+        @type self: JournalWriter
+        @type event: Event
+        @rtype: None
+        """
+        rider = getattr(event, "rider", None)
+        driver = getattr(event, "driver", None)
+        rider_id = NO_ID if rider is None else self._name_id(rider.identifier)
+        driver_id = NO_ID if driver is None else self._name_id(
+            driver.identifier)
+        self._reserve(EVENT_RECORD.size)
+        EVENT_RECORD.pack_into(self._block, self._used,
+                               EVENT_CODES[type(event)], event.timestamp,
+                               rider_id, driver_id)
+        self._used += EVENT_RECORD.size
+        self.records += 1
+
+    def close(self):
+        """Write out the remaining records, stop the writer thread and close
+        the file.
+
+        Raise the error the writer thread met, if any.
+
+        @type self: JournalWriter
+        @rtype: None
+        """
+        if self._thread.is_alive():
+            self._full.put((self._block, self._used))
+            self._used = 0
+            self._full.put(None)
+            self._thread.join()
+            self._file.close()
+        if self._error is not None:
+            raise self._error
+
+
+def read_journal(filename, block_size=1 << 20):
+    """Yield the events recorded in the journal <filename>, in order, as
+    (event name, timestamp, rider identifier, driver identifier) tuples.
+    A missing rider or driver identifier is None.
+
+    Raise a ValueError if <filename> is not a journal.
+
+    @type filename: str
+    @type block_size: int
+    @rtype: iterator[(str, int, str | None, str | None)]
+    """
+    names = {NO_ID: None}
+    with open(filename, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a journal".format(filename))
+        data = b""
+        position = 0
+        while True:
+            chunk = file.read(block_size)
+            data = data[position:] + chunk
+            position = 0
+            end = len(data)
+            while position < end:
+                code = data[position]
+                if code == NAME_CODE:
+                    if position + NAME_RECORD.size > end:
+                        break
+                    _, name_id, length = NAME_RECORD.unpack_from(data,
+                                                                 position)
+                    start = position + NAME_RECORD.size
+                    if start + length > end:
+                        break
+                    names[name_id] = data[start:start + length].decode(
+                        "utf-8")
+                    position = start + length
+                else:
+                    if position + EVENT_RECORD.size > end:
+                        break
+                    record = EVENT_RECORD.unpack_from(data, position)
+                    position += EVENT_RECORD.size
+                    yield (EVENT_NAMES[code], record[1], names[record[2]],
+                           names[record[3]])
+            if not chunk:
+                if position < len(data):
+                    raise ValueError("{} ends with a partial record".format(
+                        filename))
+                return
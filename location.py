@@ -33,6 +33,17 @@ class Location:
                 self._row == other._row and
                 self._col == other._col)
 
+    def __hash__(self):
+        """Return a hash value consistent with __eq__.
+
+        @type self: Location
+        @rtype: int
+
+        >>> hash(Location(1, 2)) == hash(Location(1, 2))
+        True
+        """
+        return hash((self._row, self._col))
+
     def get_row(self):
         """Return the row
 
@@ -71,11 +82,39 @@ def manhattan_distance(origin, destination):
     return int(distance)
 
 
+_interned = {}
+
+
+def intern_location(row, column):
+    """Return the shared Location for (<row>, <column>).
+
+    Interned locations let caches keyed on locations compare keys by
+    identity.
+
+    @type row: int
+    @type column: int
+    @rtype: Location
+
+    >>> intern_location(1, 2) is intern_location(1, 2)
+    True
+    """
+    key = (row, column)
+    location = _interned.get(key)
+    if location is None:
+        location = Location(row, column)
+        _interned[key] = location
+    return location
+
+
 def deserialize_location(location_str):
     """Deserialize a location
 
     @type location_str: str
         A location in the format 'row,col'
     @rtype: Location
+
+    >>> str(deserialize_location("12,3"))
+    '(12, 3)'
     """
-    return Location(location_str[0], location_str[-1])
+    row, col = location_str.split(",")
+    return intern_location(int(row), int(col))
@@ -0,0 +1,309 @@
+import sys
+from types import FunctionType, MethodType, ModuleType
+
+from array import array
+from collections import deque
+from itertools import islice
+
+from dispatcher import Dispatcher
+from driver import Driver, FleetTable
+from location import Location
+from monitor import Monitor
+from network import RoadNetwork
+from rider import Rider, RiderRegistry
+from travel import TravelCache
+
+"""
+The memory module accounts for the memory a simulation holds, subsystem by
+subsystem, so that a run that grows too large can be traced to its cause.
+
+A MemoryAccountant samples, every <interval> units of simulated time, the
+number of objects and the approximate bytes held by:
+
+    drivers      the fleet and its Driver objects
+    riders       the rider registry and the Rider objects still referenced
+    wait_list    the wait list of riders
+    monitor      the recorded activities
+    travel_cache the memoized distances and travel times
+    events       the scheduled events
+
+Sizes are estimated by walking each subsystem's objects from its root and
+adding up sys.getsizeof. Large containers are sampled: only SAMPLE of their
+items are walked, and stand for the rest. The walk of one subsystem stops
+at the objects of another, so nothing is counted twice, and interned
+Locations, shared by every subsystem, are not counted. The Riders, and the
+Drivers not yet in the fleet, that are reached on the way, by the scheduled
+events or on the wait list, are counted as riders and drivers.
+
+With <trace> set, tracemalloc runs too, and each sample also records the
+bytes allocated by Python in all since the accountant was attached, which
+the estimates can be checked against.
+
+=== Constants ===
+@type SAMPLE: int
+    The number of items of a large container walked.
+@type SUBSYSTEMS: list[str]
+    The subsystems accounted for, in the order they are walked.
+"""
+
+SAMPLE = 32
+SUBSYSTEMS = ["drivers", "riders", "wait_list", "monitor", "travel_cache",
+              "events"]
+
+# The objects not counted, because they are shared or not data.
+_SHARED = (Location, type, ModuleType, FunctionType, MethodType)
+# The roots of subsystems, at which a walk from another subsystem stops.
+_ROOTS = (Monitor, Dispatcher, FleetTable, RiderRegistry, TravelCache,
+          RoadNetwork)
+# The objects that hold no references to walk.
+_ATOMS = (str, bytes, int, float, bool, array, type(None))
+
+
+def _walk(root, seen, stop, found):
+    """Return the estimated number of objects reachable from <root>, and
+    their bytes, skipping the objects in <seen> and adding those walked to
+    it.
+
+    The walk does not enter shared objects, or instances of the types in
+    <stop> other than <root>. The Riders, and Drivers not in a fleet, that
+    it reaches are added to <found> by id, with the number of them each
+    stands for, unless they are already there.
+
+    Of a container with more than SAMPLE items, only SAMPLE items spread
+    evenly over it are walked, standing for the others. An atom, such as a
+    string, that the walk reaches more than once is shared, and counted
+    once rather than for the items its first owner stands for. Keys of
+    dictionaries always count for those items, since no other key can
+    share them. Reference counts are not used to detect sharing, as they
+    differ between Python versions.
+
+    @type root: object
+    @type seen: set[int]
+    @type stop: tuple[type]
+    @type found: dict[int, (Rider | Driver, float)]
+    @rtype: (float, float)
+
+    >>> floats = [[0.5 + i] for i in range(320)]
+    >>> _walk(floats, set(), (), {}) == (641, sys.getsizeof(floats) + 320 * (
+    ...     sys.getsizeof([0.5]) + sys.getsizeof(0.5)))
+    True
+    >>> shared = [[0.5 + i, "shared"] for i in range(320)]
+    >>> _walk(shared, set(), (), {}) == (642, sys.getsizeof(shared) + 320 * (
+    ...     sys.getsizeof([0.5, ""]) + sys.getsizeof(0.5)) + sys.getsizeof(
+    ...     "shared"))
+    True
+    """
+    objects = 0.0
+    size = 0.0
+    # The scale of each atom counted for more than itself, by id.
+    scaled = {}
+    stack = [(root, 1.0, False)]
+    while stack:
+        obj, scale, key = stack.pop()
+        if id(obj) in seen:
+            first = scaled.pop(id(obj), None)
+            if first is not None:
+                objects -= first - 1
+                size -= sys.getsizeof(obj) * (first - 1)
+            continue
+        if isinstance(obj, _SHARED):
+            continue
+        if obj is not root and isinstance(obj, stop):
+            if isinstance(obj, Rider) or (isinstance(obj, Driver) and
+                                          obj._table is None):
+                found.setdefault(id(obj), (obj, scale))
+            continue
+        if scale > 1 and not key and isinstance(obj, _ATOMS):
+            scaled[id(obj)] = scale
+        seen.add(id(obj))
+        objects += scale
+        size += sys.getsizeof(obj) * scale
+        if isinstance(obj, _ATOMS):
+            continue
+        if isinstance(obj, dict):
+            step = max(1, len(obj) // SAMPLE)
+            scale *= step
+            # The items of the underlying table, which an OrderedDict would
+            # otherwise look up one by one.
+            stack.extend(entry
+                         for key, value in islice(dict.items(obj), 0, None,
+                                                  step)
+                         for entry in [(key, scale, True),
+                                       (value, scale, False)])
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            step = max(1, len(obj) // SAMPLE)
+            scale *= step
+            stack.extend((item, scale, False)
+                         for item in islice(obj, 0, None, step))
+        else:
+            attributes = getattr(obj, "__dict__", None)
+            if attributes is not None:
+                stack.append((attributes, scale, False))
+            for cls in type(obj).__mro__:
+                for slot in cls.__dict__.get("__slots__", ()):
+                    if hasattr(obj, slot):
+                        stack.append((getattr(obj, slot), scale, False))
+    return objects, size
+
+
+def measure(simulation):
+    """Return the estimated objects and bytes held by each subsystem of
+    <simulation>, as {subsystem: (objects, bytes)}.
+
+    @type simulation: Simulation
+    @rtype: dict[str, (int, int)]
+
+    >>> from event import create_event_list
+    >>> from simulation import Simulation
+    >>> sim = Simulation()
+    >>> sim.start(create_event_list("events.txt"))
+    >>> before = measure(sim)
+    >>> list(before) == SUBSYSTEMS
+    True
+    >>> report = sim.run([])
+    >>> after = measure(sim)
+    >>> after["events"] < before["events"], after["monitor"] > before["monitor"]
+    (True, True)
+    """
+    dispatcher = simulation.get_dispatcher()
+    roots = [dispatcher.driver_fleet, dispatcher.riders, dispatcher.wait_list,
+             simulation.get_monitor(), dispatcher.travel,
+             simulation.get_event_queue()]
+    seen = set()
+    found = {}
+    usage = {}
+    for subsystem, root in zip(SUBSYSTEMS, roots):
+        stop = _ROOTS + (Rider,) if subsystem == "drivers" else \
+            _ROOTS + (Rider, Driver)
+        usage[subsystem] = list(_walk(root, seen, stop, found))
+    for cls, subsystem in [(Rider, "riders"), (Driver, "drivers")]:
+        reached = [(obj, scale) for obj, scale in found.values()
+                   if isinstance(obj, cls)]
+        if not reached:
+            continue
+        # Walk a sample of the riders or drivers reached, and let it stand
+        # for all of them.
+        sample = reached[::max(1, len(reached) // SAMPLE)]
+        share = sum(scale for _, scale in reached) / len(sample)
+        for obj, _ in sample:
+            objects, size = _walk(obj, seen, _ROOTS, {})
+            usage[subsystem][0] += objects * share
+            usage[subsystem][1] += size * share
+    return {subsystem: (int(round(objects)), int(round(size)))
+            for subsystem, (objects, size) in usage.items()}
+
+
+class MemoryAccountant:
+    """Samples the memory held by each subsystem of a Simulation at
+    intervals of simulated time.
+
+    === Attributes ===
+    @type interval: int
+        The simulated time between samples.
+    @type trace: bool
+        True iff tracemalloc also measures the bytes Python has allocated.
+    @type series: list[dict[str, object]]
+        The samples so far, oldest first. Each has the simulated "time",
+        the (objects, bytes) of every subsystem, and with trace the
+        "traced" bytes allocated and their "traced_peak".
+    """
+
+    # === Private Attributes ===
+    # @type _simulation: Simulation | None
+    #   The simulation sampled, once attached.
+    # @type _next: int | None
+    #   The simulated time of the next sample, or None before the first.
+    # @type _time: int | None
+    #   The timestamp of the latest event observed.
+    # @type _started: bool
+    #   True iff attach started tracemalloc, which finish then stops.
+
+    def __init__(self, interval=60, trace=False):
+        """Initialize a MemoryAccountant with no samples.
+
+        @type self: MemoryAccountant
+        @type interval: int
+        @type trace: bool
+        @rtype: None
+        """
+        self.interval = interval
+        self.trace = trace
+        self.series = []
+        self._simulation = None
+        self._next = None
+        self._time = None
+        self._started = False
+
+    def attach(self, simulation):
+        """Sample <simulation> as it runs.
+
+        @type self: MemoryAccountant
+        @type simulation: Simulation
+        @rtype: None
+        """
+        self._simulation = simulation
+        if self.trace:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+
+    def observe(self, timestamp):
+        """Note that an event at <timestamp> has been done, and take a
+        sample if the interval has passed.
+
+        @type self: MemoryAccountant
+        @type timestamp: int
+        @rtype: None
+        """
+        self._time = timestamp
+        if self._next is None or timestamp >= self._next:
+            self.sample(timestamp)
+            self._next = timestamp + self.interval
+
+    def sample(self, timestamp):
+        """Record the memory held by each subsystem at <timestamp>.
+
+        @type self: MemoryAccountant
+        @type timestamp: int
+        @rtype: None
+        """
+        entry = {"time": timestamp}
+        entry.update(measure(self._simulation))
+        if self.trace:
+            import tracemalloc
+            entry["traced"], entry["traced_peak"] = \
+                tracemalloc.get_traced_memory()
+        self.series.append(entry)
+
+    def finish(self):
+        """Record a last sample after the final event, and stop
+        tracemalloc if attach started it.
+
+        @type self: MemoryAccountant
+        @rtype: None
+
+        >>> from event import create_event_list
+        >>> from simulation import Simulation
+        >>> accountant = MemoryAccountant(interval=10)
+        >>> report = Simulation(memory=accountant).run(
+        ...     create_event_list("events.txt"))
+        >>> [entry["time"] for entry in accountant.series]
+        [0, 10, 20, 30, 34]
+        >>> accountant.series[-1]["monitor"][0] > accountant.series[0][
+        ...     "monitor"][0]
+        True
+        >>> import tracemalloc
+        >>> tracemalloc.start()
+        >>> report = Simulation(memory=MemoryAccountant(10, True)).run(
+        ...     create_event_list("events.txt"))
+        >>> tracemalloc.is_tracing()
+        True
+        >>> tracemalloc.stop()
+        """
+        if self._time is not None:
+            self.sample(self._time)
+        if self._started:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started = False
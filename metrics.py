@@ -0,0 +1,249 @@
+from time import perf_counter
+
+from monitor import RIDER, REQUEST, PICKUP, CANCEL
+
+"""
+The metrics module exposes live counters of a running simulation, so that
+a long run can be watched without stopping it.
+
+The run loop only ever increments plain integers on a SimulationMetrics;
+everything else (the scheduler queue depth, the wait-list length, the
+number of idle drivers) is read from the simulation when a scrape asks for
+it. Scrapes take no lock: each value is read in a single step under the
+interpreter lock, so a scrape never blocks the run loop and costs it
+nothing between scrapes, though values read in one scrape may be a few
+events apart.
+
+A MetricsServer serves the counters over HTTP in the Prometheus text
+format, from a daemon thread, on the local interface only.
+
+=== Constants ===
+@type CONTENT_TYPE: str
+    The content type of the Prometheus text exposition format.
+"""
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class SimulationMetrics:
+    """Live counters of a Simulation.
+
+    === Attributes ===
+    @type events: int
+        The number of events processed so far.
+    @type time: int
+        The timestamp of the latest event processed.
+    @type window: int
+        The number of most recent waits the rolling wait time averages.
+    """
+
+    # === Private Attributes ===
+    # @type _simulation: Simulation | None
+    #   The simulation the counters are read from, once attached.
+    # @type _requests: dict[str, int]
+    #   The request time of every rider still waiting to be picked up.
+    # @type _waits: list[int]
+    #   A ring of the most recent waits.
+    # @type _next: int
+    #   The index in _waits of the next wait to record.
+    # @type _wait_count: int
+    #   The number of waits in _waits.
+    # @type _wait_sum: int
+    #   The sum of the waits in _waits.
+    # @type _last_sample: (float, int)
+    #   The wall-clock time and number of events of the latest sample.
+
+    def __init__(self, window=100):
+        """Initialize SimulationMetrics with no events processed.
+
+        @type self: SimulationMetrics
+        @type window: int
+        @rtype: None
+        """
+        self.events = 0
+        self.time = 0
+        self.window = window
+        self._simulation = None
+        self._requests = {}
+        self._waits = [0] * window
+        self._next = 0
+        self._wait_count = 0
+        self._wait_sum = 0
+        self._last_sample = (perf_counter(), 0)
+
+    def attach(self, simulation):
+        """Read the counters of <simulation> and record the waits its
+        monitor is notified of.
+
+        @type self: SimulationMetrics
+        @type simulation: Simulation
+        @rtype: None
+        """
+        self._simulation = simulation
+        simulation.get_monitor().subscribe(self._record)
+
+    def _record(self, category, activity):
+        """Record the wait of a rider picked up or cancelled in <activity>.
+
+        @type self: SimulationMetrics
+        @type category: str
+        @type activity: Activity
+        @rtype: None
+        """
+        if category != RIDER:
+            return
+        if activity.description == REQUEST:
+            self._requests[activity.identifier] = activity.time
+        elif activity.description in (PICKUP, CANCEL):
+            requested = self._requests.pop(activity.identifier, None)
+            if requested is None:
+                return
+            wait = activity.time - requested
+            self._wait_sum += wait - self._waits[self._next]
+            self._waits[self._next] = wait
+            self._next = (self._next + 1) % self.window
+            if self._wait_count < self.window:
+                self._wait_count += 1
+
+    def rolling_wait_time(self):
+        """Return the average of the most recent waits, or 0.0 if no rider
+        has finished waiting.
+
+        @type self: SimulationMetrics
+        @rtype: float
+        """
+        count = self._wait_count
+        return self._wait_sum / count if count else 0.0
+
+    def sample(self):
+        """Return the current value of every metric.
+
+        The event rate is measured since the previous sample.
+
+        @type self: SimulationMetrics
+        @rtype: dict[str, int | float]
+
+        >>> from event import create_event_list
+        >>> from simulation import Simulation
+        >>> metrics = SimulationMetrics()
+        >>> sim = Simulation(metrics=metrics)
+        >>> report = sim.run(create_event_list("events.txt"))
+        >>> sample = metrics.sample()
+        >>> sample["events_total"], sample["queue_depth"]
+        (31, 0)
+        >>> sample["rolling_wait_time"] == report["rider_wait_time"]
+        True
+        """
+        now = perf_counter()
+        events = self.events
+        last_time, last_events = self._last_sample
+        self._last_sample = (now, events)
+        elapsed = now - last_time
+        sample = {"events_total": events,
+                  "events_per_second": ((events - last_events) / elapsed
+                                        if elapsed > 0 else 0.0),
+                  "simulated_time": self.time,
+                  "rolling_wait_time": self.rolling_wait_time()}
+        simulation = self._simulation
+        if simulation is not None:
+            dispatcher = simulation.get_dispatcher()
+            sample["queue_depth"] = simulation.pending()
+            sample["wait_list_length"] = len(dispatcher.wait_list)
+            sample["idle_drivers"] = dispatcher.driver_fleet.idle_count()
+        return sample
+
+    def exposition(self):
+        """Return the current metrics in the Prometheus text format.
+
+        @type self: SimulationMetrics
+        @rtype: str
+
+        >>> print(SimulationMetrics().exposition().splitlines()[0])
+        # TYPE rideshare_events_total counter
+        """
+        lines = []
+        for name, value in self.sample().items():
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines.append("# TYPE rideshare_{} {}".format(name, kind))
+            lines.append("rideshare_{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves SimulationMetrics over HTTP from a daemon thread.
+
+    === Attributes ===
+    @type metrics: SimulationMetrics
+        The metrics served.
+    @type host: str
+        The interface the server listens on.
+    @type port: int
+        The port the server listens on; a port of 0 is replaced by the one
+        the system picks when the server starts.
+    """
+
+    # === Private Attributes ===
+    # @type _server: http.server.HTTPServer | None
+    #   The running server, if started.
+
+    def __init__(self, metrics, port=9464, host="127.0.0.1"):
+        """Initialize a MetricsServer for <metrics>, without starting it.
+
+        @type self: MetricsServer
+        @type metrics: SimulationMetrics
+        @type port: int
+        @type host: str
+        @rtype: None
+        """
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        """Start serving the metrics at /metrics.
+
+        @type self: MetricsServer
+        @rtype: None
+
+        >>> from urllib.request import urlopen
+        >>> server = MetricsServer(SimulationMetrics(), port=0)
+        >>> server.start()
+        >>> url = "http://127.0.0.1:{}/metrics".format(server.port)
+        >>> b"rideshare_events_total 0" in urlopen(url).read()
+        True
+        >>> server.stop()
+        """
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from threading import Thread
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = HTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        """Stop serving the metrics.
+
+        @type self: MetricsServer
+        @rtype: None
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
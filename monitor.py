@@ -7,7 +7,8 @@ help keep a record of activities that have occurred.
 
 Activities fall into two categories: River activities and Driver
 activities. Each activity also has a description, which is one of
-request, cancel, pickup or dropoff.
+request, cancel, pickup, dropoff or reposition; only drivers reposition,
+when rebalancing sends them somewhere without a rider.
 
 === Constants === 
 @type RIDER: str
@@ -22,6 +23,8 @@ request, cancel, pickup or dropoff.
     A constant used for the pickup activity description.
 @type DROPOFF: str
     A constant used for the dropoff activity description.
+@type REPOSITION: str
+    A constant used for the reposition activity description.
 """
 
 RIDER = "rider"
@@ -31,6 +34,7 @@ REQUEST = "request"
 CANCEL = "cancel"
 PICKUP = "pickup"
 DROPOFF = "dropoff"
+REPOSITION = "reposition"
 
 
 class Activity:
@@ -45,9 +49,12 @@ class Activity:
         An identifier for the person doing the activity.
     @type location: Location
         The location at which the activity occurred.
+    @type distance: int | float | None
+        The distance driven to reach the location, if it was recorded.
     """
 
-    def __init__(self, timestamp, description, identifier, location):
+    def __init__(self, timestamp, description, identifier, location,
+                 distance=None):
         """Initialize an Activity
 
         @type self: Activity
@@ -55,17 +62,24 @@ class Activity:
         @type description: str
         @type identifier: str
         @type location: Location
+        @type distance: int | float | None
         @rtype: None
         """
         self.description = description
         self.time = timestamp
         self.identifier = identifier
         self.location = location
+        self.distance = distance
 
 
 class Monitor:
     """A monitor that is notified of activities and keeps a record them.
     When required, it generates a report of the activities that it has recorded.
+
+    === Attributes ===
+    @type network: RoadNetwork | TravelCache | None
+        The road network used to measure driving distances that were not
+        recorded with their activity, or None for the open grid.
     """
 
     # === Private Attributes ===
@@ -73,17 +87,23 @@ class Monitor:
     #       A dictionary whose key is a category, and value is another
     #       dictionary. The key of the second dictionary is an identifier
     #       and its value is a list of Activities.
+    # @type _subscribers: list[callable]
+    #       The functions called with (category, activity) for every new
+    #       activity.
 
-    def __init__(self):
+    def __init__(self, network=None):
         """Initialize a Monitor
 
         @type self: Monitor
+        @type network: RoadNetwork | TravelCache | None
         """
+        self.network = network
         self._activities = {
             RIDER: {},
             DRIVER: {}
         }
         """@type _activities: dict[str, dict[str, list[Activity]]]"""
+        self._subscribers = []
 
     def __str__(self):
         """Return a string representation.
@@ -94,7 +114,8 @@ class Monitor:
         return "Monitor ({} drivers, {} riders)".format(
             len(self._activities[DRIVER]), len(self._activities[RIDER]))
 
-    def notify(self, timestamp, category, description, identifier, location):
+    def notify(self, timestamp, category, description, identifier, location,
+               distance=None):
         """Notify the monitory of activity.
 
         @type self: Monitor
@@ -102,18 +123,57 @@ class Monitor:
             The time of the activity.
         @type category: DRIVER | RIDER
             The category of the activity.
-        @type description: REQUEST | CANCEL | PICKUP | DROPOFF
+        @type description: REQUEST | CANCEL | PICKUP | DROPOFF | REPOSITION
             A description of the activity.
         @type identifier: str
             The identifier for the actor.
         @type location: Location
             The location of the activity.
+        @type distance: int | float | None
+            The distance driven to reach the location, if it is known.
         @rtype: None
         """
         if identifier not in self._activities[category]:
             self._activities[category][identifier] = []
-        activity = Activity(timestamp, description, identifier, location)
+        activity = Activity(timestamp, description, identifier, location,
+                            distance)
         self._activities[category][identifier].append(activity)
+        for subscriber in self._subscribers:
+            subscriber(category, activity)
+
+    def subscribe(self, subscriber):
+        """Call <subscriber> with (category, activity) for every activity
+        recorded from now on.
+
+        @type self: Monitor
+        @type subscriber: callable
+        @rtype: None
+        """
+        self._subscribers.append(subscriber)
+
+    def get_activities(self, category):
+        """Return an iterator over the activities of <category>.
+
+        The activities of each identifier are contiguous and in the order
+        they occurred.
+
+        @type self: Monitor
+        @type category: DRIVER | RIDER
+        @rtype: iterator[Activity]
+        """
+        for activities in self._activities[category].values():
+            for activity in activities:
+                yield activity
+
+    def _sequences(self, category):
+        """Return an iterator over the activities of each identifier of
+        <category>, as a list in the order they occurred.
+
+        @type self: Monitor
+        @type category: DRIVER | RIDER
+        @rtype: iterator[list[Activity]]
+        """
+        return iter(self._activities[category].values())
 
     def report(self):
         """Return a report of the activities that have occurred
@@ -125,6 +185,22 @@ class Monitor:
                 "driver_total_distance": self._average_total_distance(),
                 "driver_ride_distance": self._average_ride_distance()}
 
+    def _distance(self, start, end):
+        """Return the distance driven between activities <start> and <end>.
+
+        The distance recorded with <end> is used when there is one.
+
+        @type self: Monitor
+        @type start: Activity
+        @type end: Activity
+        @rtype: int | float
+        """
+        if end.distance is not None:
+            return end.distance
+        if self.network is not None:
+            return self.network.distance(start.location, end.location)
+        return manhattan_distance(start.location, end.location)
+
     def _average_wait_time(self):
         """Return the average wait time of riders that have either been picked
         up or have cancelled their ride.
@@ -134,7 +210,7 @@ class Monitor:
         """
         wait_time = 0
         count = 0
-        for activities in self._activities[RIDER].values():
+        for activities in self._sequences(RIDER):
             # A rider that has less than two activities hasn't finished
             # waiting (they haven't cancelled or been picked up).
             if len(activities) >= 2:
@@ -153,37 +229,40 @@ class Monitor:
         @rtype: float
         """
         distance = 0
-        drivers = self._activities[DRIVER].values()
-        for activities in drivers:
+        drivers = 0
+        for activities in self._sequences(DRIVER):
+            drivers += 1
+            # The last activity before activities[i] other than a request;
+            # requests happen in place and are skipped.
+            previous = None
             for i in range(len(activities) - 1):
-                if activities[i].description == PICKUP:
-                    pickup = activities[i]
-                    if activities[i+1].description == DROPOFF:
-                        dropoff = activities[i+1]
-                        distance += manhattan_distance(pickup.location,
-                                                       dropoff.location)
-                elif activities[i].description == DROPOFF:
-                    dropoff = activities[i]
-                    next_activity = activities[i+1].description
-                    second_next_activity = activities[i+2].description
-                    if (next_activity == PICKUP) and (second_next_activity ==
-                                                      DROPOFF):
-                        pickup = activities[i+1]
-                        distance += manhattan_distance(dropoff.location,
-                                                       pickup.location)
-        if len(drivers) == 0:
+                activity = activities[i]
+                if activities[i+1].description == REPOSITION:
+                    distance += self._distance(activity, activities[i+1])
+                if (activity.description == PICKUP and
+                        activities[i+1].description == DROPOFF):
+                    distance += self._distance(activity, activities[i+1])
+                    if (previous is not None and
+                            previous.description in (DROPOFF, REPOSITION)):
+                        distance += self._distance(previous, activity)
+                if activity.description != REQUEST:
+                    previous = activity
+        if drivers == 0:
             return 0.0
-        return distance / len(drivers)
+        return distance / drivers
 
     def _average_ride_distance(self):
         """Return the average distance drivers have driven on rides.
 
+        Drivers that have not completed a ride count as driving no distance.
+
         @type self: Monitor
         @rtype: float
         """
         distance = 0
-        drivers = list(self._activities[DRIVER].values())
-        for activities in drivers:
+        drivers = 0
+        for activities in self._sequences(DRIVER):
+            drivers += 1
             rides_distance = 0
             ride_count = 0
             for i in range(len(activities) - 1):
@@ -192,10 +271,128 @@ class Monitor:
                     if activities[i+1].description == DROPOFF:
                         dropoff = activities[i+1]
                         ride_count += 1
-                        rides_distance += manhattan_distance(pickup.location,
-                                                             dropoff.location)
-            rides_distance = rides_distance / ride_count
-            distance += rides_distance
-        if len(drivers) == 0:
+                        rides_distance += self._distance(pickup, dropoff)
+            if ride_count > 0:
+                distance += rides_distance / ride_count
+        if drivers == 0:
             return 0
-        return distance / len(drivers)
+        return distance / drivers
+
+
+class RunningMonitor(Monitor):
+    """A Monitor that keeps running totals of the activities it is notified
+    of instead of the activities themselves, so that its memory does not
+    grow with the length of a run.
+
+    It keeps the latest activities of each driver, and the request time of
+    each rider still waiting. A rider is forgotten once they are picked up
+    or cancel, so a rider identifier that requests again counts as a new
+    rider; Monitor only counts the first wait of an identifier. Otherwise
+    its report is the same as Monitor's, up to the rounding of sums taken
+    in another order.
+    """
+
+    # === Private Attributes ===
+    # @type _requests: dict[str, int]
+    #       The request time of every rider still waiting.
+    # @type _wait_time: int
+    #       The total wait of the riders who have been picked up or have
+    #       cancelled.
+    # @type _waits: int
+    #       The number of those riders.
+    # @type _drivers: dict[str, list]
+    #       For each driver, [their latest activity, the latest of their
+    #       activities before it other than a request, or None, the
+    #       distance they have driven, the distance they have driven on
+    #       rides, the number of their rides].
+
+    def __init__(self, network=None):
+        """Initialize a RunningMonitor
+
+        @type self: RunningMonitor
+        @type network: RoadNetwork | TravelCache | None
+        @rtype: None
+        """
+        Monitor.__init__(self, network)
+        self._requests = {}
+        self._wait_time = 0
+        self._waits = 0
+        self._drivers = {}
+
+    def __str__(self):
+        """Return a string representation.
+
+        @type self: RunningMonitor
+        @rtype: str
+        """
+        return "RunningMonitor ({} drivers, {} riders waiting)".format(
+            len(self._drivers), len(self._requests))
+
+    def notify(self, timestamp, category, description, identifier, location,
+               distance=None):
+        """Notify the monitor of activity.
+
+        @type self: RunningMonitor
+        @type timestamp: int
+        @type category: DRIVER | RIDER
+        @type description: REQUEST | CANCEL | PICKUP | DROPOFF | REPOSITION
+        @type identifier: str
+        @type location: Location
+        @type distance: int | float | None
+        @rtype: None
+
+        >>> monitor = RunningMonitor()
+        >>> monitor.notify(0, RIDER, REQUEST, "Ann", Location(1, 1))
+        >>> monitor.notify(0, DRIVER, REQUEST, "Bob", Location(1, 3))
+        >>> monitor.notify(2, DRIVER, PICKUP, "Bob", Location(1, 1))
+        >>> monitor.notify(2, RIDER, PICKUP, "Ann", Location(1, 1))
+        >>> monitor.notify(5, DRIVER, DROPOFF, "Bob", Location(4, 1))
+        >>> monitor.report()
+        ... # doctest: +NORMALIZE_WHITESPACE
+        {'rider_wait_time': 2.0, 'driver_total_distance': 3.0,
+         'driver_ride_distance': 3.0}
+        """
+        activity = Activity(timestamp, description, identifier, location,
+                            distance)
+        if category == RIDER:
+            if identifier in self._requests:
+                self._wait_time += timestamp - self._requests.pop(identifier)
+                self._waits += 1
+            elif description == REQUEST:
+                self._requests[identifier] = timestamp
+        else:
+            state = self._drivers.get(identifier)
+            if state is None:
+                self._drivers[identifier] = [activity, None, 0, 0, 0]
+            else:
+                last, previous = state[0], state[1]
+                if description == REPOSITION:
+                    state[2] += self._distance(last, activity)
+                if last.description == PICKUP and description == DROPOFF:
+                    ride = self._distance(last, activity)
+                    state[2] += ride
+                    state[3] += ride
+                    state[4] += 1
+                    if (previous is not None and
+                            previous.description in (DROPOFF, REPOSITION)):
+                        state[2] += self._distance(previous, last)
+                if last.description != REQUEST:
+                    state[1] = last
+                state[0] = activity
+        for subscriber in self._subscribers:
+            subscriber(category, activity)
+
+    def report(self):
+        """Return a report of the activities that have occurred
+
+        @type self: RunningMonitor
+        @rtype: dict[str, object]
+        """
+        drivers = len(self._drivers)
+        total = sum(state[2] for state in self._drivers.values())
+        rides = sum(state[3] / state[4] for state in self._drivers.values()
+                    if state[4] > 0)
+        return {"rider_wait_time": (self._wait_time / self._waits
+                                    if self._waits else 0),
+                "driver_total_distance": total / drivers if drivers else 0.0,
+                "driver_ride_distance": rides / drivers if drivers else 0}
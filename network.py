@@ -0,0 +1,310 @@
+import heapq
+
+from container import LRUCache
+from location import Location, deserialize_location
+
+"""
+The network module contains the RoadNetwork class, which replaces the open
+grid assumed by manhattan_distance with an explicit graph of street segments.
+A network can model blocked intersections (they are simply left out),
+one-way streets and zones with different speeds (a slow zone has segments
+with a higher cost).
+
+Queries are answered with the ALT algorithm: A* search guided by
+lower bounds taken from precomputed landmark distance tables. Recent
+origin-destination pairs are kept in an LRU cache.
+
+The edge-list format read by load_network is one street segment per line:
+<from> <to> <cost> [oneway]
+<from>, <to> are <row>,<col>. <cost> is the distance a driver covers on the
+segment; a driver with speed s needs <cost> / s time units to traverse it.
+Segments are two-way unless the line ends with 'oneway'.
+
+=== Constants ===
+@type ONEWAY: str
+    The marker for a one-way segment in an edge-list file.
+"""
+
+ONEWAY = "oneway"
+
+_INFINITY = float("inf")
+
+
+class RoadNetwork:
+    """A road network that computes shortest-path distances between
+    intersections.
+
+    === Attributes ===
+    @type landmark_count: int
+        The number of landmarks used to bound the A* search.
+    """
+
+    # === Private Attributes ===
+    # @type _index: dict[(int, int), int]
+    #   Maps an intersection (row, col) to its node number.
+    # @type _out: list[list[(int, float)]]
+    #   For each node, the (node, cost) pairs of the segments leaving it.
+    # @type _in: list[list[(int, float)]]
+    #   For each node, the (node, cost) pairs of the segments entering it.
+    # @type _from_landmark: list[list[float]]
+    #   For each landmark, the distance from the landmark to every node.
+    # @type _to_landmark: list[list[float]]
+    #   For each landmark, the distance from every node to the landmark.
+    # @type _cache: LRUCache
+    #   Recently computed distances keyed on (origin node, destination node).
+    # @type _prepared: bool
+    #   True iff the landmark tables are up to date with the segments.
+
+    def __init__(self, landmark_count=8, cache_size=65536):
+        """Initialize an empty RoadNetwork.
+
+        @type self: RoadNetwork
+        @type landmark_count: int
+        @type cache_size: int
+            The number of origin-destination pairs kept in the cache.
+        @rtype: None
+        """
+        self.landmark_count = landmark_count
+        self._index = {}
+        self._out = []
+        self._in = []
+        self._from_landmark = []
+        self._to_landmark = []
+        self._cache = LRUCache(cache_size)
+        self._prepared = False
+
+    def __str__(self):
+        """Return a string representation.
+
+        @type self: RoadNetwork
+        @rtype: str
+        """
+        segments = sum(len(edges) for edges in self._out)
+        return "RoadNetwork ({} intersections, {} segments)".format(
+            len(self._out), segments)
+
+    def _node(self, location):
+        """Return the node number of <location>, adding it if it is new.
+
+        @type self: RoadNetwork
+        @type location: Location
+        @rtype: int
+        """
+        key = (location.get_row(), location.get_col())
+        node = self._index.get(key)
+        if node is None:
+            node = len(self._out)
+            self._index[key] = node
+            self._out.append([])
+            self._in.append([])
+        return node
+
+    def add_segment(self, origin, destination, cost, oneway=False):
+        """Add a street segment between <origin> and <destination>.
+
+        @type self: RoadNetwork
+        @type origin: Location
+        @type destination: Location
+        @type cost: int | float
+            Precondition: must be positive.
+        @type oneway: bool
+            True iff the segment can only be driven from origin to
+            destination.
+        @rtype: None
+        """
+        u = self._node(origin)
+        v = self._node(destination)
+        self._out[u].append((v, cost))
+        self._in[v].append((u, cost))
+        if not oneway:
+            self._out[v].append((u, cost))
+            self._in[u].append((v, cost))
+        self._prepared = False
+
+    def prepare(self):
+        """Precompute the landmark distance tables.
+
+        Landmarks are chosen greedily, each one as far as possible from the
+        landmarks chosen before it, which gives tight bounds on grid-like
+        networks. This is called automatically by the first query after
+        the network changes.
+
+        @type self: RoadNetwork
+        @rtype: None
+        """
+        self._from_landmark = []
+        self._to_landmark = []
+        self._cache.clear()
+        if len(self._out) > 0:
+            count = min(self.landmark_count, len(self._out))
+            spread = [0] * len(self._out)
+            chosen = set()
+            landmark = 0
+            for _ in range(count):
+                chosen.add(landmark)
+                from_table = _dijkstra(self._out, landmark)
+                self._from_landmark.append(from_table)
+                self._to_landmark.append(_dijkstra(self._in, landmark))
+                for node, d in enumerate(from_table):
+                    if d != _INFINITY:
+                        spread[node] += d
+                candidates = [node for node in range(len(spread))
+                              if node not in chosen]
+                if not candidates:
+                    break
+                landmark = max(candidates, key=spread.__getitem__)
+        self._prepared = True
+
+    def _bound(self, node, target):
+        """Return a lower bound on the distance from <node> to <target>.
+
+        @type self: RoadNetwork
+        @type node: int
+        @type target: int
+        @rtype: float
+        """
+        bound = 0
+        for from_table, to_table in zip(self._from_landmark,
+                                        self._to_landmark):
+            # Triangle inequality in both directions around the landmark.
+            forward = from_table[target] - from_table[node]
+            backward = to_table[node] - to_table[target]
+            if forward == forward and forward > bound:
+                bound = forward
+            if backward == backward and backward > bound:
+                bound = backward
+        return bound
+
+    def _search(self, source, target):
+        """Return the shortest-path distance from <source> to <target>.
+
+        @type self: RoadNetwork
+        @type source: int
+        @type target: int
+        @rtype: float
+        """
+        best = {source: 0}
+        frontier = [(self._bound(source, target), 0, source)]
+        out = self._out
+        while frontier:
+            _, d, node = heapq.heappop(frontier)
+            if node == target:
+                return d
+            if d > best[node]:
+                continue
+            for neighbour, cost in out[node]:
+                nd = d + cost
+                if nd < best.get(neighbour, _INFINITY):
+                    best[neighbour] = nd
+                    estimate = nd + self._bound(neighbour, target)
+                    if estimate != _INFINITY:
+                        heapq.heappush(frontier, (estimate, nd, neighbour))
+        return _INFINITY
+
+    def distance(self, origin, destination):
+        """Return the shortest driving distance from <origin> to
+        <destination>.
+
+        Raise a ValueError if either location is not on the network or the
+        destination cannot be reached.
+
+        @type self: RoadNetwork
+        @type origin: Location
+        @type destination: Location
+        @rtype: int | float
+
+        >>> network = RoadNetwork()
+        >>> network.add_segment(Location(1, 1), Location(1, 2), 1)
+        >>> network.add_segment(Location(1, 2), Location(2, 2), 3, True)
+        >>> network.distance(Location(1, 1), Location(2, 2))
+        4
+        >>> network.distance(Location(2, 2), Location(1, 1))
+        Traceback (most recent call last):
+        ...
+        ValueError: (1, 1) cannot be reached from (2, 2)
+        """
+        if not self._prepared:
+            self.prepare()
+        try:
+            source = self._index[(origin.get_row(), origin.get_col())]
+            target = self._index[(destination.get_row(),
+                                  destination.get_col())]
+        except KeyError:
+            raise ValueError("{} or {} is not on the network".format(
+                origin, destination))
+        key = (source, target)
+        d = self._cache.get(key)
+        if d is None:
+            d = self._search(source, target)
+            self._cache.put(key, d)
+        if d == _INFINITY:
+            raise ValueError("{} cannot be reached from {}".format(
+                destination, origin))
+        return d
+
+    def travel_time(self, origin, destination, speed):
+        """Return the time a driver with <speed> needs to get from <origin>
+        to <destination>, rounded down to an integer like
+        Driver.get_travel_time.
+
+        @type self: RoadNetwork
+        @type origin: Location
+        @type destination: Location
+        @type speed: int
+        @rtype: int
+        """
+        return int(self.distance(origin, destination) / speed)
+
+
+def _dijkstra(edges, source):
+    """Return the distance from <source> to every node along <edges>.
+
+    Unreachable nodes have an infinite distance.
+
+    @type edges: list[list[(int, float)]]
+    @type source: int
+    @rtype: list[float]
+    """
+    dist = [_INFINITY] * len(edges)
+    dist[source] = 0
+    frontier = [(0, source)]
+    while frontier:
+        d, node = heapq.heappop(frontier)
+        if d > dist[node]:
+            continue
+        for neighbour, cost in edges[node]:
+            nd = d + cost
+            if nd < dist[neighbour]:
+                dist[neighbour] = nd
+                heapq.heappush(frontier, (nd, neighbour))
+    return dist
+
+
+def load_network(filename, landmark_count=8, cache_size=65536):
+    """Return a prepared RoadNetwork built from the edge list in <filename>.
+
+    Precondition: the file stored at <filename> is in the edge-list format
+    described in the module docstring.
+
+    @type filename: str
+        The name of a file that contains the edge list.
+    @type landmark_count: int
+    @type cache_size: int
+    @rtype: RoadNetwork
+    """
+    network = RoadNetwork(landmark_count, cache_size)
+    with open(filename, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            tokens = line.split()
+            origin = deserialize_location(tokens[0])
+            destination = deserialize_location(tokens[1])
+            cost = float(tokens[2])
+            if cost == int(cost):
+                cost = int(cost)
+            oneway = len(tokens) > 3 and tokens[3] == ONEWAY
+            network.add_segment(origin, destination, cost, oneway)
+    network.prepare()
+    return network
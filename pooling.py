@@ -0,0 +1,522 @@
+from dispatcher import Dispatcher
+from event import TripStop, Cancellation, DriverRequest
+from monitor import PICKUP, DROPOFF
+from rider import CANCELLED, SATISFIED
+
+"""
+The pooling module lets a driver carry several riders at once.
+
+A driver in pooling mode follows a Trip: a route of pickup and dropoff
+stops. A new ride request is inserted into the route of an active trip
+when that keeps every rider of the trip within their limits: each rider
+is picked up within their patience, no ride takes more than
+(1 + max_detour) times its direct travel time, and the car never holds
+more than <capacity> riders. Otherwise the request is served the usual
+way, by an idle driver or the wait list.
+
+So that a request does not scan every active trip, trips are kept in a
+TripIndex: a grid of cells and time buckets recording where and when each
+trip is due to stop. Only the trips due to stop near the rider's origin
+before the rider runs out of patience are tried.
+"""
+
+
+class Trip:
+    """The route of a driver carrying pooled riders.
+
+    The driver is on the way to the first stop; the route after it may
+    still change.
+
+    === Attributes ===
+    @type driver: Driver
+        The driver.
+    @type stops: list[list]
+        The remaining stops, in order. A stop is [PICKUP or DROPOFF, rider,
+        location].
+    @type arrival: int
+        The time the driver reaches the first stop.
+    @type onboard: int
+        The number of riders in the car.
+    @type picked_up: dict[str, int]
+        The time each rider in the car was picked up, by identifier.
+    @type deadlines: dict[str, int]
+        The latest pickup time of each rider not yet picked up.
+    @type limits: dict[str, int]
+        The longest ride time of each rider of the trip.
+    """
+
+    # === Private Attributes ===
+    # @type _keys: list[(int, int, int)]
+    #   The TripIndex keys this trip is filed under.
+
+    def __init__(self, driver, arrival):
+        """Initialize a Trip with no stops.
+
+        @type self: Trip
+        @type driver: Driver
+        @type arrival: int
+        @rtype: None
+        """
+        self.driver = driver
+        self.stops = []
+        self.arrival = arrival
+        self.onboard = 0
+        self.picked_up = {}
+        self.deadlines = {}
+        self.limits = {}
+        self._keys = []
+
+    def __str__(self):
+        """Return a string representation.
+
+        @type self: Trip
+        @rtype: str
+        """
+        return "Trip of {} ({} stops, {} on board)".format(
+            self.driver.identifier, len(self.stops), self.onboard)
+
+    def arrivals(self, travel):
+        """Return the arrival time at each stop of this trip.
+
+        @type self: Trip
+        @type travel: TravelCache
+        @rtype: list[int]
+        """
+        speed = self.driver.speed
+        time = self.arrival
+        times = [time]
+        for (_, _, start), (_, _, end) in zip(self.stops, self.stops[1:]):
+            time += travel.travel_time(start, end, speed)
+            times.append(time)
+        return times
+
+    def schedule(self, stops, legs, capacity):
+        """Return the arrival time at each of <stops> if the driver follows
+        them from the first stop of this trip, or None if that breaks a
+        rider's limits or the capacity.
+
+        <stops> must start with the current first stop, and legs[k] is the
+        travel time from stops[k] to stops[k + 1].
+
+        @type self: Trip
+        @type stops: list[list]
+        @type legs: list[int]
+        @type capacity: int
+        @rtype: list[int] | None
+        """
+        time = self.arrival
+        load = self.onboard
+        picked_up = {}
+        times = []
+        for k, (kind, rider, _) in enumerate(stops):
+            if k > 0:
+                time += legs[k - 1]
+            identifier = rider.identifier
+            if kind == PICKUP:
+                if time > self.deadlines[identifier]:
+                    return None
+                load += 1
+                if load > capacity:
+                    return None
+                picked_up[identifier] = time
+            else:
+                start = picked_up.get(identifier)
+                if start is None:
+                    start = self.picked_up[identifier]
+                if time - start > self.limits[identifier]:
+                    return None
+                load -= 1
+            times.append(time)
+        return times
+
+
+class TripIndex:
+    """A spatio-temporal index of the stops of active trips.
+
+    A trip is filed under the (row, column, time bucket) of the cell and
+    the period in which it is due at each of its stops.
+
+    === Attributes ===
+    @type cell_size: int
+        The width and height of a cell, in streets.
+    @type period: int
+        The length of a time bucket.
+    """
+
+    # === Private Attributes ===
+    # @type _buckets: dict[(int, int, int), dict[Trip, None]]
+    #   The trips filed under each key, in the order they were filed, so
+    #   that the trips found for a request come in a reproducible order.
+
+    def __init__(self, cell_size=4, period=10):
+        """Initialize an empty TripIndex.
+
+        @type self: TripIndex
+        @type cell_size: int
+        @type period: int
+        @rtype: None
+        """
+        self.cell_size = cell_size
+        self.period = period
+        self._buckets = {}
+
+    def __len__(self):
+        """Return the number of keys with filed trips.
+
+        @type self: TripIndex
+        @rtype: int
+        """
+        return len(self._buckets)
+
+    def remove(self, trip):
+        """Remove <trip> from the index.
+
+        @type self: TripIndex
+        @type trip: Trip
+        @rtype: None
+        """
+        for key in trip._keys:
+            trips = self._buckets.get(key)
+            if trips is not None:
+                trips.pop(trip, None)
+                if not trips:
+                    del self._buckets[key]
+        trip._keys = []
+
+    def add(self, trip, times):
+        """File <trip>, whose stops are due at <times>, under its keys.
+
+        @type self: TripIndex
+        @type trip: Trip
+        @type times: list[int]
+        @rtype: None
+        """
+        self.remove(trip)
+        keys = {(location.get_row() // self.cell_size,
+                 location.get_col() // self.cell_size,
+                 time // self.period)
+                for (_, _, location), time in zip(trip.stops, times)}
+        for key in sorted(keys):
+            if key in self._buckets:
+                self._buckets[key][trip] = None
+            else:
+                self._buckets[key] = {trip: None}
+        trip._keys = sorted(keys)
+
+    def near(self, location, start, end, radius=1):
+        """Return the trips due at a stop within <radius> cells of
+        <location> between the times <start> and <end>.
+
+        @type self: TripIndex
+        @type location: Location
+        @type start: int
+        @type end: int
+        @type radius: int
+        @rtype: list[Trip]
+        """
+        row = location.get_row() // self.cell_size
+        col = location.get_col() // self.cell_size
+        found = {}
+        for bucket in range(start // self.period, end // self.period + 1):
+            for d_row in range(-radius, radius + 1):
+                for d_col in range(-radius, radius + 1):
+                    trips = self._buckets.get((row + d_row, col + d_col,
+                                               bucket))
+                    if trips is not None:
+                        found.update(trips)
+        return list(found)
+
+
+class PoolingDispatcher(Dispatcher):
+    """A dispatcher that pools riders whose routes overlap into shared
+    trips.
+
+    === Attributes ===
+    @type capacity: int
+        The most riders a driver carries at once.
+    @type max_detour: float
+        How much longer than its direct travel time a pooled ride may take,
+        as a fraction of the direct time.
+    @type index: TripIndex
+        The stops of the active trips.
+    @type trips: dict[str, Trip]
+        The active trip of each driver, by identifier.
+    @type shared: int
+        The number of riders added to a trip already under way.
+    """
+
+    pooling = True
+
+    def __init__(self, network=None, travel_cache_size=65536, wait_list=None,
+                 capacity=2, max_detour=0.5, cell_size=4, period=10):
+        """Initialize a PoolingDispatcher.
+
+        @type self: PoolingDispatcher
+        @type network: RoadNetwork | None
+        @type travel_cache_size: int
+        @type wait_list: Queue | RegionalWaitList | None
+        @type capacity: int
+        @type max_detour: float
+        @type cell_size: int
+            The cell size of the TripIndex.
+        @type period: int
+            The length of a time bucket of the TripIndex.
+        @rtype: None
+        """
+        Dispatcher.__init__(self, network, travel_cache_size, wait_list)
+        self.capacity = capacity
+        self.max_detour = max_detour
+        self.index = TripIndex(cell_size, period)
+        self.trips = {}
+        self.shared = 0
+
+    def _limit(self, rider, speed):
+        """Return the longest time the ride of <rider> may take with a
+        driver of <speed>.
+
+        @type self: PoolingDispatcher
+        @type rider: Rider
+        @type speed: int
+        @rtype: int
+        """
+        direct = self._travel_time(rider.origin, rider.destination, speed)
+        return int(direct * (1 + self.max_detour))
+
+    def _travel_time(self, origin, destination, speed):
+        """Return the time a driver with <speed> needs to get from <origin>
+        to <destination>.
+
+        On the open grid the time is computed directly, which is cheaper
+        than a lookup in the travel cache.
+
+        @type self: PoolingDispatcher
+        @type origin: Location
+        @type destination: Location
+        @type speed: int
+        @rtype: int
+        """
+        if self.network is None:
+            return int((abs(destination.get_row() - origin.get_row()) +
+                        abs(destination.get_col() - origin.get_col())) /
+                       speed)
+        return self.travel.travel_time(origin, destination, speed)
+
+    def _best_insertion(self, trip, rider, deadline, limit):
+        """Return the route of <trip> with the stops of <rider> inserted
+        after the first stop that ends soonest, its arrival times, and how
+        much later it ends than the current route; or None if no insertion
+        is feasible.
+
+        The travel times between the stops and the rider's origin and
+        destination are looked up once, not once per candidate route, and
+        pickup positions that are already too late or too full are skipped.
+
+        @type self: PoolingDispatcher
+        @type trip: Trip
+        @type rider: Rider
+        @type deadline: int
+            The latest time <rider> may be picked up.
+        @type limit: int
+            The longest time the ride of <rider> may take.
+        @rtype: (list[list], list[int], int) | None
+        """
+        stops = trip.stops
+        n = len(stops)
+        speed = trip.driver.speed
+        travel_time = self._travel_time
+        origin = rider.origin
+        destination = rider.destination
+        locations = [location for _, _, location in stops]
+        legs = [travel_time(start, end, speed)
+                for start, end in zip(locations, locations[1:])]
+        # The arrival time at, and the load on leaving, each current stop.
+        arrivals = [trip.arrival]
+        for leg in legs:
+            arrivals.append(arrivals[-1] + leg)
+        loads = []
+        load = trip.onboard
+        for kind, _, _ in stops:
+            load += 1 if kind == PICKUP else -1
+            loads.append(load)
+        to_origin = [travel_time(location, origin, speed)
+                     for location in locations]
+        pickups = [i for i in range(1, n + 1)
+                   if arrivals[i - 1] + to_origin[i - 1] <= deadline and
+                   loads[i - 1] < self.capacity]
+        if not pickups:
+            return None
+        from_origin = [travel_time(origin, location, speed)
+                       for location in locations]
+        to_destination = [travel_time(location, destination, speed)
+                          for location in locations]
+        from_destination = [travel_time(destination, location, speed)
+                            for location in locations]
+        direct = travel_time(origin, destination, speed)
+
+        identifier = rider.identifier
+        trip.deadlines[identifier] = deadline
+        trip.limits[identifier] = limit
+        pickup = [PICKUP, rider, origin]
+        dropoff = [DROPOFF, rider, destination]
+        best = None
+        for i in pickups:
+            for j in range(i, n + 1):
+                route = (stops[:i] + [pickup] + stops[i:j] + [dropoff] +
+                         stops[j:])
+                route_legs = legs[:i - 1] + [to_origin[i - 1]]
+                if i == j:
+                    route_legs.append(direct)
+                else:
+                    route_legs.append(from_origin[i])
+                    route_legs += legs[i:j - 1]
+                    route_legs.append(to_destination[j - 1])
+                if j < n:
+                    route_legs.append(from_destination[j])
+                    route_legs += legs[j:]
+                times = trip.schedule(route, route_legs, self.capacity)
+                if times is not None and (best is None or
+                                          times[-1] < best[1][-1]):
+                    best = (route, times, times[-1] - arrivals[-1])
+        del trip.deadlines[identifier]
+        del trip.limits[identifier]
+        return best
+
+    def _start_leg(self, trip, timestamp):
+        """Send the driver of <trip> from their location toward the first
+        stop and return the TripStop event of their arrival.
+
+        @type self: PoolingDispatcher
+        @type trip: Trip
+        @type timestamp: int
+        @rtype: TripStop
+        """
+        driver = trip.driver
+        kind, rider, location = trip.stops[0]
+        distance = self.travel.distance(driver.location, location)
+        trip.arrival = timestamp + driver.start_drive(location, self.travel)
+        return TripStop(trip.arrival, rider, driver, kind, distance)
+
+    def start_trip(self, timestamp, driver, rider):
+        """Start a new trip of <driver> to carry <rider> and return the
+        events it spawns.
+
+        @type self: PoolingDispatcher
+        @type timestamp: int
+        @type driver: Driver
+        @type rider: Rider
+        @rtype: list[Event]
+        """
+        trip = Trip(driver, timestamp)
+        identifier = rider.identifier
+        trip.stops = [[PICKUP, rider, rider.origin],
+                      [DROPOFF, rider, rider.destination]]
+        trip.deadlines[identifier] = timestamp + rider.patience
+        trip.limits[identifier] = self._limit(rider, driver.speed)
+        events = [self._start_leg(trip, timestamp)]
+        if trip.arrival - timestamp > rider.patience:
+            events.append(Cancellation(timestamp + rider.patience, rider))
+        self.trips[driver.identifier] = trip
+        self.index.add(trip, trip.arrivals(self.travel))
+        return events
+
+    def request_shared(self, timestamp, rider):
+        """Serve the ride request of <rider> at <timestamp> and return the
+        events it spawns.
+
+        The rider joins the active trip they lengthen least, if any can
+        take them and its driver's shift has not ended; otherwise the first
+        idle driver starts a trip for them; otherwise they join the wait
+        list.
+
+        @type self: PoolingDispatcher
+        @type timestamp: int
+        @type rider: Rider
+        @rtype: list[Event]
+
+        >>> from driver import Driver
+        >>> from location import Location
+        >>> from rider import Rider
+        >>> dispatcher = PoolingDispatcher(capacity=2)
+        >>> dispatcher.driver_fleet.add(Driver("Lupin", Location(1, 1), 1))
+        0
+        >>> first = Rider("Mallow", Location(1, 2), Location(1, 9), 5)
+        >>> [type(event).__name__
+        ...  for event in dispatcher.request_shared(0, first)]
+        ['TripStop']
+        >>> second = Rider("Nigella", Location(1, 3), Location(1, 8), 5)
+        >>> dispatcher.request_shared(1, second)
+        []
+        >>> [(kind, rider.identifier) for kind, rider, _
+        ...  in dispatcher.trips["Lupin"].stops]
+        ... # doctest: +NORMALIZE_WHITESPACE
+        [('pickup', 'Mallow'), ('pickup', 'Nigella'), ('dropoff', 'Nigella'),
+         ('dropoff', 'Mallow')]
+        >>> dispatcher.trips["Lupin"].driver.end_shift()
+        >>> third = Rider("Oregano", Location(1, 4), Location(1, 7), 5)
+        >>> dispatcher.request_shared(2, third), len(dispatcher.wait_list)
+        ([], 1)
+        """
+        self.riders.register(rider)
+        deadline = timestamp + rider.patience
+        best = None
+        for trip in self.index.near(rider.origin, timestamp, deadline):
+            if not trip.driver.on_shift:
+                continue
+            limit = self._limit(rider, trip.driver.speed)
+            insertion = self._best_insertion(trip, rider, deadline, limit)
+            if insertion is not None and (best is None or
+                                          insertion[2] < best[3]):
+                best = (trip,) + insertion + (limit,)
+        if best is not None:
+            trip, route, times, _, limit = best
+            trip.stops = route
+            trip.deadlines[rider.identifier] = deadline
+            trip.limits[rider.identifier] = limit
+            self.index.add(trip, times)
+            self.shared += 1
+            return []
+        driver_id = self.driver_fleet.first_idle()
+        if driver_id < 0:
+            self.wait_list.add(rider)
+            return []
+        return self.start_trip(timestamp, self.driver_fleet.drivers[driver_id],
+                               rider)
+
+    def complete_stop(self, timestamp, driver):
+        """Record that <driver> has reached the first stop of their trip and
+        return the events it spawns.
+
+        The driver drives on to the next stop, or requests a rider at the
+        end of the trip. A rider who cancelled before their pickup is
+        removed from the trip.
+
+        @type self: PoolingDispatcher
+        @type timestamp: int
+        @type driver: Driver
+        @rtype: list[Event]
+        """
+        trip = self.trips[driver.identifier]
+        kind, rider, _ = trip.stops.pop(0)
+        driver.end_drive()
+        identifier = rider.identifier
+        if kind == PICKUP:
+            del trip.deadlines[identifier]
+            if rider.status == CANCELLED:
+                trip.stops = [stop for stop in trip.stops
+                              if stop[1] is not rider]
+                del trip.limits[identifier]
+            else:
+                trip.onboard += 1
+                trip.picked_up[identifier] = timestamp
+        else:
+            trip.onboard -= 1
+            del trip.picked_up[identifier]
+            del trip.limits[identifier]
+            rider.status = SATISFIED
+        if not trip.stops:
+            self.index.remove(trip)
+            del self.trips[driver.identifier]
+            return [DriverRequest(timestamp, driver)]
+        event = self._start_leg(trip, timestamp)
+        self.index.add(trip, trip.arrivals(self.travel))
+        return [event]
@@ -0,0 +1,308 @@
+from itertools import compress
+
+from event import Reposition
+from monitor import RIDER, REQUEST
+
+"""
+The rebalance module moves idle drivers toward the parts of the city where
+riders have recently been requesting rides.
+
+Demand is estimated per square cell of the grid as an exponentially
+decaying count of ride requests. The decay is applied lazily: each cell
+stores its count as of its last request, so recording a request costs
+O(1) however many cells there are, and a count is only brought up to date
+when it is read.
+
+Every rebalancing pass shares the idle drivers among the cells in
+proportion to their demand, and sends the drivers in cells with more idle
+drivers than their share to nearby cells with fewer, searching outward
+ring by ring from each cell short of drivers, most short first. The idle
+drivers are found by a single scan of the FleetTable arrays.
+"""
+
+
+class DemandMap:
+    """An exponentially decaying count of the ride requests in each cell.
+
+    === Attributes ===
+    @type cell_size: int
+        The width and height of a cell, in streets.
+    @type half_life: int | float
+        The time after which a request counts half as much.
+    """
+
+    # === Private Attributes ===
+    # @type _cells: dict[(int, int), list]
+    #   The [count, time of the last request, location of the last request]
+    #   of each cell that has had a request.
+
+    def __init__(self, cell_size=4, half_life=60):
+        """Initialize an empty DemandMap.
+
+        @type self: DemandMap
+        @type cell_size: int
+        @type half_life: int | float
+        @rtype: None
+        """
+        self.cell_size = cell_size
+        self.half_life = half_life
+        self._cells = {}
+
+    def __len__(self):
+        """Return the number of cells that have had a request.
+
+        @type self: DemandMap
+        @rtype: int
+        """
+        return len(self._cells)
+
+    def cell(self, location):
+        """Return the cell containing <location>.
+
+        @type self: DemandMap
+        @type location: Location
+        @rtype: (int, int)
+        """
+        return (location.get_row() // self.cell_size,
+                location.get_col() // self.cell_size)
+
+    def _decay(self, elapsed):
+        """Return the weight of a request made <elapsed> time units ago.
+
+        @type self: DemandMap
+        @type elapsed: int | float
+        @rtype: float
+        """
+        return 2.0 ** (-elapsed / self.half_life)
+
+    def record(self, timestamp, location):
+        """Record a ride request at <location> at time <timestamp>.
+
+        Precondition: requests are recorded in order of time.
+
+        @type self: DemandMap
+        @type timestamp: int
+        @type location: Location
+        @rtype: None
+        """
+        key = self.cell(location)
+        entry = self._cells.get(key)
+        if entry is None:
+            self._cells[key] = [1.0, timestamp, location]
+        else:
+            entry[0] = entry[0] * self._decay(timestamp - entry[1]) + 1.0
+            entry[1] = timestamp
+            entry[2] = location
+
+    def demand(self, cell, timestamp):
+        """Return the demand in <cell> at time <timestamp>.
+
+        @type self: DemandMap
+        @type cell: (int, int)
+        @type timestamp: int
+        @rtype: float
+
+        >>> from location import Location
+        >>> demand = DemandMap(cell_size=2, half_life=10)
+        >>> demand.record(0, Location(1, 1))
+        >>> demand.record(10, Location(0, 1))
+        >>> demand.demand((0, 0), 20)
+        0.75
+        """
+        entry = self._cells.get(cell)
+        if entry is None:
+            return 0.0
+        return entry[0] * self._decay(timestamp - entry[1])
+
+    def snapshot(self, timestamp):
+        """Return the demand in every cell that has had a request at time
+        <timestamp>, and the location of the latest request in each.
+
+        Cells whose demand has decayed below 1/1000 are forgotten.
+
+        @type self: DemandMap
+        @type timestamp: int
+        @rtype: dict[(int, int), (float, Location)]
+        """
+        snapshot = {}
+        stale = []
+        for key, (count, time, location) in self._cells.items():
+            demand = count * self._decay(timestamp - time)
+            if demand < 0.001:
+                stale.append(key)
+            else:
+                snapshot[key] = (demand, location)
+        for key in stale:
+            del self._cells[key]
+        return snapshot
+
+
+class Rebalancer:
+    """Periodically sends idle drivers toward cells with unmet demand.
+
+    A Simulation given a Rebalancer schedules a Rebalance event every
+    <interval> time units. A driver being repositioned is not idle; they
+    request a rider on arrival.
+
+    === Attributes ===
+    @type demand: DemandMap
+        The recent ride requests.
+    @type interval: int
+        The time between rebalancing passes, at least 1.
+    @type max_moves: int | None
+        The most drivers sent in one pass, or None for no limit.
+    @type max_radius: int
+        The farthest, in cells, a driver is sent.
+    @type until: int | None
+        The time of the last pass, or None to stop after the next one.
+    @type moves: int
+        The number of drivers sent so far.
+    """
+
+    # === Private Attributes ===
+    # @type _offsets: list[(int, int)]
+    #   The offsets of the cells within max_radius of a cell, nearest
+    #   first, searched ring by ring as in RegionalWaitList.take_nearest.
+
+    def __init__(self, cell_size=8, half_life=60, interval=10,
+                 max_moves=None, max_radius=6):
+        """Initialize a Rebalancer.
+
+        @type self: Rebalancer
+        @type cell_size: int
+        @type half_life: int | float
+        @type interval: int
+        @type max_moves: int | None
+        @type max_radius: int
+        @rtype: None
+
+        >>> Rebalancer(interval=0)
+        Traceback (most recent call last):
+        ...
+        ValueError: the rebalancing interval must be at least 1, not 0
+        """
+        if interval < 1:
+            # A pass every 0 time units would reschedule itself forever.
+            raise ValueError("the rebalancing interval must be at least 1, "
+                             "not {}".format(interval))
+        self.demand = DemandMap(cell_size, half_life)
+        self.interval = interval
+        self.max_moves = max_moves
+        self.max_radius = max_radius
+        self._offsets = []
+        for radius in range(1, max_radius + 1):
+            for d_row in range(-radius, radius + 1):
+                d_col = radius - abs(d_row)
+                self._offsets.append((d_row, -d_col))
+                if d_col != 0:
+                    self._offsets.append((d_row, d_col))
+        self.until = None
+        self.moves = 0
+
+    def attach(self, monitor):
+        """Record the ride requests <monitor> is notified of.
+
+        @type self: Rebalancer
+        @type monitor: Monitor
+        @rtype: None
+        """
+        def record(category, activity):
+            if category == RIDER and activity.description == REQUEST:
+                self.demand.record(activity.time, activity.location)
+        monitor.subscribe(record)
+
+    def plan(self, fleet, timestamp):
+        """Return the moves that bring the idle drivers of <fleet> closer to
+        the demand at time <timestamp>, as (driver id, destination) pairs.
+
+        @type self: Rebalancer
+        @type fleet: FleetTable
+        @type timestamp: int
+        @rtype: list[(int, Location)]
+
+        >>> from driver import Driver, FleetTable
+        >>> from location import Location
+        >>> fleet = FleetTable()
+        >>> for name in ["Iris", "Jasmine", "Kale"]:
+        ...     _ = fleet.add(Driver(name, Location(1, 1), 1))
+        >>> rebalancer = Rebalancer(cell_size=4)
+        >>> rebalancer.demand.record(0, Location(1, 2))
+        >>> rebalancer.demand.record(0, Location(9, 10))
+        >>> rebalancer.demand.record(0, Location(9, 9))
+        >>> [(fleet.drivers[i].identifier, str(location))
+        ...  for i, location in rebalancer.plan(fleet, 0)]
+        [('Kale', '(9, 9)'), ('Jasmine', '(9, 9)')]
+        """
+        demand = self.demand.snapshot(timestamp)
+        total_demand = sum(value for value, _ in demand.values())
+        if total_demand == 0:
+            return []
+        size = self.demand.cell_size
+        idle = {}
+        for driver_id, row, col in compress(
+                zip(range(len(fleet.idle)), fleet.rows, fleet.cols),
+                fleet.idle):
+            key = (row // size, col // size)
+            if key in idle:
+                idle[key].append(driver_id)
+            else:
+                idle[key] = [driver_id]
+        total_idle = sum(len(ids) for ids in idle.values())
+        share = total_idle / total_demand
+
+        surplus = {}
+        for key, ids in idle.items():
+            extra = len(ids) - int(demand[key][0] * share + 0.5
+                                   if key in demand else 0)
+            if extra > 0:
+                surplus[key] = ids[-extra:]
+        deficits = []
+        for key, (value, location) in demand.items():
+            missing = int(value * share + 0.5) - len(idle.get(key, ()))
+            if missing > 0:
+                deficits.append((-missing, key, location))
+        deficits.sort()
+
+        moves = []
+        limit = self.max_moves
+        for missing, (row, col), location in deficits:
+            missing = -missing
+            for d_row, d_col in self._offsets:
+                key = (row + d_row, col + d_col)
+                ids = surplus.get(key)
+                if ids is None:
+                    continue
+                while missing > 0 and ids:
+                    moves.append((ids.pop(), location))
+                    missing -= 1
+                    if limit is not None and len(moves) >= limit:
+                        return moves
+                if not ids:
+                    del surplus[key]
+                    if not surplus:
+                        return moves
+                if missing == 0:
+                    break
+        return moves
+
+    def rebalance(self, dispatcher, timestamp):
+        """Send idle drivers toward unmet demand and return the events of
+        their arrivals.
+
+        @type self: Rebalancer
+        @type dispatcher: Dispatcher
+        @type timestamp: int
+        @rtype: list[Event]
+        """
+        events = []
+        fleet = dispatcher.driver_fleet
+        for driver_id, location in self.plan(fleet, timestamp):
+            driver = fleet.drivers[driver_id]
+            if location == driver.location:
+                continue
+            distance = dispatcher.travel.distance(driver.location, location)
+            travel_time = driver.start_drive(location, dispatcher.travel)
+            events.append(Reposition(timestamp + travel_time, driver,
+                                     distance))
+        self.moves += len(events)
+        return events
@@ -0,0 +1,220 @@
+import random
+from math import sqrt
+
+from dispatcher import Dispatcher
+from event import RiderRequest, parse_events
+from simulation import Simulation
+from travel import TravelCache
+
+"""
+The replication module runs many randomized replications of one scenario
+together, for Monte Carlo studies.
+
+Each replication parses its own copy of the trace, then perturbs it with
+its own seeded random generator: ride requests move by up to <jitter> time
+units and patience is scaled by up to <spread> either way. The
+replications advance in lockstep, each in turn running through the next
+<window> units of simulated time, and share a single TravelCache, so that
+a distance computed for one replication is reused by the others; their
+scenarios overlap, so most of the travel computations are shared.
+
+=== Constants ===
+@type T_975: list[float]
+    The 97.5th percentile of Student's t distribution with 1 to 30
+    degrees of freedom, indexed by degrees of freedom minus one.
+@type Z_975: float
+    The 97.5th percentile of the standard normal distribution, used for
+    more than 30 degrees of freedom.
+"""
+
+T_975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+         2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+         2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052,
+         2.048, 2.045, 2.042]
+Z_975 = 1.96
+
+
+def perturb(events, rng, jitter=0, spread=0.0):
+    """Perturb the ride requests in <events> in place, using <rng>.
+
+    @type events: list[Event]
+    @type rng: random.Random
+    @type jitter: int
+        The most time units a request moves earlier or later.
+    @type spread: float
+        The most a rider's patience is scaled down or up, as a fraction.
+    @rtype: None
+
+    >>> from location import Location
+    >>> from rider import Rider
+    >>> events = [RiderRequest(10, Rider("Oca", Location(1, 1),
+    ...                                  Location(2, 2), 10))]
+    >>> perturb(events, random.Random(1), jitter=3, spread=0.5)
+    >>> events[0].timestamp, events[0].rider.patience
+    (8, 11)
+    """
+    for event in events:
+        if isinstance(event, RiderRequest):
+            if jitter:
+                event.timestamp = max(0, event.timestamp +
+                                      rng.randint(-jitter, jitter))
+            if spread:
+                rider = event.rider
+                rider.patience = max(1, int(round(
+                    rider.patience * rng.uniform(1 - spread, 1 + spread))))
+
+
+def confidence_interval(values):
+    """Return the mean of <values> and the half-width of its 95%
+    confidence interval.
+
+    The half-width is 0 for fewer than two values.
+
+    @type values: list[int | float]
+    @rtype: (float, float)
+
+    >>> mean, half_width = confidence_interval([1, 2, 3])
+    >>> mean, round(half_width, 3)
+    (2.0, 2.484)
+    """
+    count = len(values)
+    mean = sum(values) / count
+    if count < 2:
+        return mean, 0.0
+    variance = sum((value - mean) ** 2 for value in values) / (count - 1)
+    if count - 1 <= len(T_975):
+        critical = T_975[count - 2]
+    else:
+        critical = Z_975
+    return mean, critical * sqrt(variance / count)
+
+
+class ReplicationEngine:
+    """Runs randomized replications of a trace in lockstep.
+
+    === Attributes ===
+    @type seeds: list[int]
+        The seed of each replication.
+    @type travel: TravelCache
+        The travel cache shared by the replications.
+    @type window: int
+        The simulated time every replication advances by before the next
+        one takes its turn.
+    @type reports: list[dict[str, object]]
+        The report of each replication, once run.
+    """
+
+    # === Private Attributes ===
+    # @type _simulations: list[Simulation]
+    #   The simulation of each replication.
+    # @type _events: list[list[Event]]
+    #   The perturbed initial events of each replication.
+
+    def __init__(self, lines, replications=10, seed=0, jitter=0, spread=0.0,
+                 network=None, window=60, factory=None):
+        """Initialize a ReplicationEngine for the trace <lines>.
+
+        @type self: ReplicationEngine
+        @type lines: list[str]
+            The lines of the trace.
+        @type replications: int
+            At least one.
+        @type seed: int
+            The seed of the first replication; the others follow it.
+        @type jitter: int
+        @type spread: float
+        @type network: RoadNetwork | None
+        @type window: int
+        @type factory: callable | None
+            Returns a new Simulation for each replication, whose dispatcher
+            is then given the shared TravelCache; None for a Simulation
+            with a default Dispatcher.
+        @rtype: None
+
+        >>> ReplicationEngine([], replications=0)
+        Traceback (most recent call last):
+        ...
+        ValueError: a replication engine needs at least one replication, not 0
+        """
+        if replications < 1:
+            raise ValueError("a replication engine needs at least one "
+                             "replication, not {}".format(replications))
+        self.window = window
+        self.seeds = list(range(seed, seed + replications))
+        self.travel = TravelCache(network)
+        self.reports = []
+        self._simulations = []
+        self._events = []
+        for replication_seed in self.seeds:
+            events = parse_events(lines)
+            perturb(events, random.Random(replication_seed), jitter, spread)
+            if factory is None:
+                simulation = Simulation(dispatcher=Dispatcher(network))
+            else:
+                simulation = factory()
+            simulation.get_dispatcher().travel = self.travel
+            self._simulations.append(simulation)
+            self._events.append(events)
+
+    def run(self):
+        """Run every replication to the end and return their reports.
+
+        @type self: ReplicationEngine
+        @rtype: list[dict[str, object]]
+
+        >>> from strategy import STRATEGIES
+        >>> def nearest():
+        ...     return Simulation(dispatcher=Dispatcher(
+        ...         strategy=STRATEGIES["nearest-idle"]()))
+        >>> with open("events.txt") as file:
+        ...     lines = file.read().splitlines()
+        >>> reports = ReplicationEngine(lines, 2, factory=nearest).run()
+        >>> reports[0] == reports[1] == nearest().run(parse_events(lines))
+        True
+        """
+        for simulation, events in zip(self._simulations, self._events):
+            simulation.start(events)
+        active = list(self._simulations)
+        time = min((event.timestamp for events in self._events
+                    for event in events), default=0)
+        while active:
+            for simulation in active:
+                simulation.run_until(time)
+            active = [simulation for simulation in active
+                      if not simulation.is_done()]
+            time += self.window
+        self.reports = [simulation.get_monitor().report()
+                        for simulation in self._simulations]
+        return self.reports
+
+    def summary(self):
+        """Return the mean and 95% confidence interval of each statistic
+        over the replications, as {statistic: (mean, low, high)}.
+
+        The bounds are None for a single replication, which gives no
+        spread to estimate them from.
+
+        @type self: ReplicationEngine
+        @rtype: dict[str, (float, float | None, float | None)]
+
+        >>> with open("events.txt") as file:
+        ...     lines = file.read().splitlines()
+        >>> engine = ReplicationEngine(lines, replications=4, jitter=2)
+        >>> reports = engine.run()
+        >>> mean, low, high = engine.summary()["rider_wait_time"]
+        >>> low <= mean <= high
+        True
+        >>> engine = ReplicationEngine(lines, replications=1)
+        >>> reports = engine.run()
+        >>> engine.summary()["rider_wait_time"][1:]
+        (None, None)
+        """
+        summary = {}
+        for key in self.reports[0]:
+            mean, half_width = confidence_interval(
+                [report[key] for report in self.reports])
+            if len(self.reports) < 2:
+                summary[key] = (mean, None, None)
+            else:
+                summary[key] = (mean, mean - half_width, mean + half_width)
+        return summary
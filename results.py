@@ -0,0 +1,269 @@
+import sqlite3
+from itertools import groupby
+from time import time
+
+from location import intern_location
+from monitor import Monitor, Activity, RIDER, DRIVER
+
+"""
+The results module keeps the activities and reports of simulation runs in a
+local SQLite database, so that they can be queried long after the run.
+
+An SQLiteMonitor is a Monitor that writes its activities to the database
+instead of keeping them in memory. Activities are buffered and inserted
+with executemany, a batch at a time, in one transaction per batch, and the
+database is in write-ahead-log mode so that it can be read while a run
+writes to it. Memory use is bounded by the batch size however long the run
+is. The report is computed by streaming each identifier's activities back
+from the database in order, using the index on (run, identifier), and is
+stored with the run.
+
+Many runs share one database; each has a row in the runs table and its
+activities and report are keyed by the run's id.
+
+=== Constants ===
+@type SCHEMA: str
+    The SQL creating the tables and indexes of a results database.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    started REAL
+);
+CREATE TABLE IF NOT EXISTS activities (
+    run INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    description TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    identifier TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    distance REAL
+);
+CREATE INDEX IF NOT EXISTS activities_identifier
+    ON activities (run, identifier);
+CREATE INDEX IF NOT EXISTS activities_time
+    ON activities (run, time);
+CREATE TABLE IF NOT EXISTS reports (
+    run INTEGER NOT NULL,
+    statistic TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run, statistic)
+);
+"""
+
+
+def connect(path):
+    """Return a connection to the results database at <path>, creating its
+    tables if needed.
+
+    @type path: str
+    @rtype: sqlite3.Connection
+    """
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class SQLiteMonitor(Monitor):
+    """A Monitor that keeps its activities in a SQLite database.
+
+    === Attributes ===
+    @type run: int
+        The id of this monitor's run in the database.
+    @type batch_size: int
+        The number of activities inserted at a time.
+    """
+
+    # === Private Attributes ===
+    # @type _connection: sqlite3.Connection
+    #   The connection to the database.
+    # @type _pending: list[tuple]
+    #   The activities not yet inserted, as rows of the activities table.
+
+    def __init__(self, path, name=None, network=None, batch_size=50000):
+        """Initialize an SQLiteMonitor recording a new run named <name> in
+        the database at <path>.
+
+        @type self: SQLiteMonitor
+        @type path: str
+        @type name: str | None
+        @type network: RoadNetwork | TravelCache | None
+        @type batch_size: int
+        @rtype: None
+        """
+        Monitor.__init__(self, network)
+        self.batch_size = batch_size
+        self._pending = []
+        self._connection = connect(path)
+        with self._connection:
+            self.run = self._connection.execute(
+                "INSERT INTO runs (name, started) VALUES (?, ?)",
+                (name, time())).lastrowid
+
+    def __str__(self):
+        """Return a string representation.
+
+        @type self: SQLiteMonitor
+        @rtype: str
+        """
+        self.flush()
+        counts = dict(self._connection.execute(
+            "SELECT category, COUNT(DISTINCT identifier) FROM activities "
+            "WHERE run = ? GROUP BY category", (self.run,)))
+        return "Monitor ({} drivers, {} riders)".format(
+            counts.get(DRIVER, 0), counts.get(RIDER, 0))
+
+    def notify(self, timestamp, category, description, identifier, location,
+               distance=None):
+        """Notify the monitor of activity.
+
+        @type self: SQLiteMonitor
+        @type timestamp: int
+        @type category: DRIVER | RIDER
+        @type description: REQUEST | CANCEL | PICKUP | DROPOFF | REPOSITION
+        @type identifier: str
+        @type location: Location
+        @type distance: int | float | None
+        @rtype: None
+        """
+        self._pending.append((self.run, category, description, timestamp,
+                              identifier, location.get_row(),
+                              location.get_col(), distance))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        if self._subscribers:
+            activity = Activity(timestamp, description, identifier, location,
+                                distance)
+            for subscriber in self._subscribers:
+                subscriber(category, activity)
+
+    def flush(self):
+        """Insert the buffered activities into the database.
+
+        @type self: SQLiteMonitor
+        @rtype: None
+        """
+        if self._pending:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT INTO activities VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    self._pending)
+            self._pending = []
+
+    def _rows(self, category):
+        """Return a cursor over the activities of <category>, ordered by
+        identifier and then in the order they occurred.
+
+        @type self: SQLiteMonitor
+        @type category: DRIVER | RIDER
+        @rtype: sqlite3.Cursor
+        """
+        self.flush()
+        return self._connection.execute(
+            "SELECT identifier, time, description, row, col, distance "
+            "FROM activities INDEXED BY activities_identifier "
+            "WHERE run = ? AND category = ? ORDER BY identifier, rowid",
+            (self.run, category))
+
+    def _sequences(self, category):
+        """Return an iterator over the activities of each identifier of
+        <category>, as a list in the order they occurred.
+
+        Only one identifier's activities are in memory at a time.
+
+        @type self: SQLiteMonitor
+        @type category: DRIVER | RIDER
+        @rtype: iterator[list[Activity]]
+        """
+        for identifier, rows in groupby(self._rows(category),
+                                        lambda row: row[0]):
+            yield [Activity(timestamp, description, identifier,
+                            intern_location(row, col), distance)
+                   for _, timestamp, description, row, col, distance in rows]
+
+    def get_activities(self, category):
+        """Return an iterator over the activities of <category>.
+
+        The activities of each identifier are contiguous and in the order
+        they occurred.
+
+        @type self: SQLiteMonitor
+        @type category: DRIVER | RIDER
+        @rtype: iterator[Activity]
+        """
+        for activities in self._sequences(category):
+            for activity in activities:
+                yield activity
+
+    def report(self):
+        """Return a report of the activities that have occurred, and store
+        it with the run.
+
+        @type self: SQLiteMonitor
+        @rtype: dict[str, object]
+
+        >>> from event import create_event_list
+        >>> from simulation import Simulation
+        >>> monitor = SQLiteMonitor(":memory:", batch_size=4)
+        >>> report = Simulation(monitor=monitor).run(
+        ...     create_event_list("events.txt"))
+        >>> report == Simulation().run(create_event_list("events.txt"))
+        True
+        >>> load_report(monitor._connection, monitor.run) == report
+        True
+        """
+        report = Monitor.report(self)
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO reports VALUES (?, ?, ?)",
+                [(self.run, key, value) for key, value in report.items()])
+        return report
+
+    def close(self):
+        """Insert the buffered activities and close the database.
+
+        @type self: SQLiteMonitor
+        @rtype: None
+        """
+        self.flush()
+        self._connection.close()
+
+
+def load_report(database, run):
+    """Return the report stored for <run> in <database>, which is a path or
+    a connection.
+
+    @type database: str | sqlite3.Connection
+    @type run: int
+    @rtype: dict[str, object]
+    """
+    connection = database
+    if isinstance(database, str):
+        connection = connect(database)
+    try:
+        return dict(connection.execute(
+            "SELECT statistic, value FROM reports WHERE run = ? "
+            "ORDER BY rowid", (run,)))
+    finally:
+        if connection is not database:
+            connection.close()
+
+
+def list_runs(path):
+    """Return the (id, name, start time) of every run in the results
+    database at <path>, oldest first.
+
+    @type path: str
+    @rtype: list[(int, str | None, float)]
+    """
+    connection = connect(path)
+    try:
+        return connection.execute(
+            "SELECT id, name, started FROM runs ORDER BY id").fetchall()
+    finally:
+        connection.close()
@@ -1,3 +1,5 @@
+from array import array
+
 from location import Location
 
 """
@@ -11,12 +13,19 @@ constants that represent the status of the rider.
     A constant used for the cancelled rider status.
 @type SATISFIED: str 
     A constant used for the satisfied rider status. 
+@type STATUSES: list[str]
+    The rider statuses, indexed by the small-int code a RiderRegistry
+    stores for them.
 """
 
 WAITING = "waiting"
 CANCELLED = "cancelled"
 SATISFIED = "satisfied"
 
+STATUSES = [WAITING, CANCELLED, SATISFIED]
+_CODES = {status: code for code, status in enumerate(STATUSES)}
+_WAITING = _CODES[WAITING]
+
 
 class Rider:
     """A rider for a ride-sharing service
@@ -30,8 +39,20 @@ class Rider:
         Drop-off location for Rider
     @param int patience:
         The number of time units that the rider will wait.
+    @param str status:
+        WAITING, CANCELLED or SATISFIED.
     """
 
+    # === Private Attributes ===
+    # @type _registry: RiderRegistry | None
+    #   The registry holding this rider's status, or None if the status is
+    #   held by this object.
+    # @type _id: int
+    #   The dense integer id of this rider in _registry.
+
+    __slots__ = ("identifier", "origin", "destination", "patience",
+                 "_status", "_registry", "_id")
+
     def __init__(self, identifier, origin, destination, patience):
         """Initialize a rider.
 
@@ -51,7 +72,27 @@ class Rider:
         self.origin = origin
         self.destination = destination
         self.patience = patience
-        self.status = WAITING
+        self._status = WAITING
+        self._registry = None
+        self._id = -1
+
+    @property
+    def status(self):
+        """Return the status of the rider.
+
+        @type self: Rider
+        @rtype: str
+        """
+        if self._registry is None:
+            return self._status
+        return STATUSES[self._registry.status[self._id]]
+
+    @status.setter
+    def status(self, status):
+        if self._registry is None:
+            self._status = status
+        else:
+            self._registry.set_status(self, status)
 
     def __str__(self):
         """Return a string representation of the Rider.
@@ -67,17 +108,30 @@ class Rider:
     def __eq__(self, other):
         """Return whether self and other are equal to each other.
 
+        Two riders in the same registry are equal iff they have the same id.
+
         @type self: Rider
         @type other: Any | Rider
         @rtype: bool
         """
-        return (type(self) == type(other) and
-                self.identifier == other.identifier and
+        if type(self) != type(other):
+            return False
+        if self._registry is not None and self._registry is other._registry:
+            return self._id == other._id
+        return (self.identifier == other.identifier and
                 self.origin == other.origin and
                 self.destination == other.destination and
                 self. patience == other.patience and
                 self.status == other.status)
 
+    def __hash__(self):
+        """Return a hash value consistent with __eq__.
+
+        @type self: Rider
+        @rtype: int
+        """
+        return hash(self.identifier)
+
     def get_status(self):
         """Return the status of the rider.
 
@@ -85,3 +139,100 @@ class Rider:
         @rtype: str
         """
         return self.status
+
+
+class RiderRegistry:
+    """A registry that gives every registered rider a dense integer id and
+    stores their status as a small-int code.
+
+    Ids are given per ride request, not per identifier: a rider who
+    requests again under the identifier of an earlier request, waiting or
+    not, gets an id and a status of their own.
+
+    === Attributes ===
+    @type status: array
+        The index in STATUSES of the status of the rider with each id.
+    """
+
+    # === Private Attributes ===
+    # @type _waiting: int
+    #   The number of registered riders still waiting.
+
+    def __init__(self):
+        """Initialize an empty RiderRegistry.
+
+        @type self: RiderRegistry
+        @rtype: None
+        """
+        self.status = array("b")
+        self._waiting = 0
+
+    def __len__(self):
+        """Return the number of registered riders still waiting.
+
+        @type self: RiderRegistry
+        @rtype: int
+        """
+        return self._waiting
+
+    def register(self, rider):
+        """Register <rider>, whose status is then held by this registry, and
+        return their id.
+
+        @type self: RiderRegistry
+        @type rider: Rider
+        @rtype: int
+
+        >>> registry = RiderRegistry()
+        >>> rider = Rider("Almond", Location(1, 1), Location(5, 5), 10)
+        >>> registry.register(rider)
+        0
+        >>> rider.status = CANCELLED
+        >>> registry.status[0] == STATUSES.index(CANCELLED)
+        True
+        >>> registry.count(WAITING), len(registry)
+        (0, 0)
+        >>> again = Rider("Almond", Location(2, 2), Location(5, 5), 10)
+        >>> registry.register(again), again.status, rider.status
+        (1, 'waiting', 'cancelled')
+        >>> twin = Rider("Almond", Location(3, 3), Location(5, 5), 10)
+        >>> registry.register(twin), len(registry)
+        (2, 2)
+        >>> twin.status = CANCELLED
+        >>> again.status, len(registry)
+        ('waiting', 1)
+        """
+        if rider._registry is self:
+            return rider._id
+        rider_id = len(self.status)
+        code = _CODES[rider.status]
+        self.status.append(code)
+        if code == _WAITING:
+            self._waiting += 1
+        rider._registry = self
+        rider._id = rider_id
+        return rider_id
+
+    def set_status(self, rider, status):
+        """Set the status of the registered <rider> to <status>.
+
+        @type self: RiderRegistry
+        @type rider: Rider
+        @type status: str
+        @rtype: None
+        """
+        code = _CODES[status]
+        if self.status[rider._id] == _WAITING:
+            self._waiting -= 1
+        if code == _WAITING:
+            self._waiting += 1
+        self.status[rider._id] = code
+
+    def count(self, status):
+        """Return the number of registered riders with <status>.
+
+        @type self: RiderRegistry
+        @type status: str
+        @rtype: int
+        """
+        return self.status.count(_CODES[status])
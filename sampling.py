@@ -0,0 +1,348 @@
+import random
+from math import ceil, sqrt
+
+from event import parse_events
+from replication import T_975, Z_975, confidence_interval
+from simulation import Simulation
+
+"""
+The sampling module estimates the report of a large trace quickly, by
+simulating a stratified sample of its requests instead of all of them.
+
+Ride requests and driver registrations are each sampled at the same rate.
+They are grouped into strata by the bucket of time they happen in and the
+cell of the grid they start from, and the strata are sampled systematically,
+one after the other with a single random start, so that every stratum keeps
+its share of requests to within one, and so does the trace as a whole. The
+later events of a sampled driver, going online and offline, are kept with
+them. A sample keeps the balance of riders and drivers over time and space,
+and is simulated in about <rate> of the time.
+
+Every statistic of the report is an average, which a sample estimates
+without rescaling for its size. A sample is sparser than the trace, though:
+drivers are farther from riders, so pickups are longer, and a fleet close to
+saturation can tip over. Those biases are corrected with a Calibration,
+which compares a full run of a representative trace with sampled runs of it
+and rescales each statistic by their ratio. The spread of the rescaled
+samples around the full run gives the error bound of an estimate: the
+half-width of a 95% prediction interval, which a run of a trace like the
+representative one falls within.
+
+=== Constants ===
+@type BUCKET: int
+    The default time units in a bucket of a stratum.
+@type CELL: int
+    The default rows and columns in a cell of a stratum.
+@type RIDER: str
+    The group of ride requests.
+@type DRIVER: str
+    The group of driver registrations.
+"""
+
+BUCKET = 60
+CELL = 5
+
+RIDER = "rider"
+DRIVER = "driver"
+
+
+class StratifiedTrace:
+    """The lines of a trace, grouped into strata for sampling.
+
+    Grouping the lines reads the whole trace once; every sample then only
+    visits the strata.
+
+    === Attributes ===
+    @type lines: list[str]
+        The lines of the trace.
+    """
+
+    # === Private Attributes ===
+    # @type _strata: dict[str, list[list[int]]]
+    #   The strata of each group, in order of (bucket, row cell, column
+    #   cell), each a list of the indexes in lines of its requests.
+    # @type _registrations: dict[int, str]
+    #   The identifier of the driver each driver registration registers,
+    #   by the index of its line.
+    # @type _followers: dict[str, list[int]]
+    #   The indexes of the lines of the later events of each driver.
+
+    def __init__(self, lines, bucket=BUCKET, cell=CELL):
+        """Initialize a StratifiedTrace of <lines>, with strata of <bucket>
+        time units by <cell> rows and columns.
+
+        @type self: StratifiedTrace
+        @type lines: list[str]
+        @type bucket: int
+        @type cell: int
+        @rtype: None
+        """
+        self.lines = lines
+        strata = {}
+        registered = set()
+        self._registrations = {}
+        self._followers = {}
+        for index, line in enumerate(lines):
+            tokens = line.split(None, 4)
+            if not tokens or tokens[0].startswith("#"):
+                continue
+            kind = tokens[1]
+            identifier = tokens[2]
+            if kind == "RiderRequest":
+                group = RIDER
+            elif identifier not in registered and len(tokens) > 3:
+                registered.add(identifier)
+                self._registrations[index] = identifier
+                group = DRIVER
+            else:
+                self._followers.setdefault(identifier, []).append(index)
+                continue
+            origin = tokens[3]
+            comma = origin.index(",")
+            key = (group, int(tokens[0]) // bucket,
+                   int(origin[:comma]) // cell, int(origin[comma + 1:]) // cell)
+            members = strata.get(key)
+            if members is None:
+                strata[key] = [index]
+            else:
+                members.append(index)
+        self._strata = {group: [strata[key] for key in sorted(strata)
+                                if key[0] == group]
+                        for group in [RIDER, DRIVER]}
+
+    def sample(self, rate, seed=0):
+        """Return the lines of a stratified sample of this trace at <rate>,
+        in the order they are in the trace.
+
+        Ride requests and driver registrations are sampled at <rate>, and at
+        least one driver is kept. Blank lines and comments are dropped.
+
+        @type self: StratifiedTrace
+        @type rate: float
+            The fraction of requests sampled, from 0 to 1.
+        @type seed: int
+            The seed of the sample.
+        @rtype: list[str]
+        """
+        rng = random.Random(seed)
+        keep = []
+        for group in [RIDER, DRIVER]:
+            strata = self._strata[group]
+            kept = len(keep)
+            position = rng.random()
+            for members in strata:
+                end = position + len(members) * rate
+                # The members where the position passes a whole number,
+                # counted from a random one.
+                if int(end) > int(position):
+                    start = rng.randrange(len(members))
+                    for whole in range(int(position) + 1, int(end) + 1):
+                        offset = min(int(ceil((whole - position) / rate)) - 1,
+                                     len(members) - 1)
+                        keep.append(members[(start + offset) % len(members)])
+                position = end
+            if group == DRIVER and strata and len(keep) == kept:
+                keep.append(rng.choice(rng.choice(strata)))
+        followers = []
+        for index in keep:
+            identifier = self._registrations.get(index)
+            if identifier is not None:
+                followers.extend(self._followers.get(identifier, []))
+        keep.extend(followers)
+        keep.sort()
+        lines = self.lines
+        return [lines[index] for index in keep]
+
+
+def sample_lines(lines, rate, seed=0, bucket=BUCKET, cell=CELL):
+    """Return the lines of a stratified sample of the trace <lines> at
+    <rate>, in the order they are in the trace.
+
+    @type lines: list[str]
+    @type rate: float
+    @type seed: int
+    @type bucket: int
+    @type cell: int
+    @rtype: list[str]
+
+    >>> with open("events.txt") as file:
+    ...     lines = file.read().splitlines()
+    >>> sample = sample_lines(lines, 0.5)
+    >>> [line.split()[1] for line in sample].count("RiderRequest")
+    3
+    >>> sample == sample_lines(lines, 0.5), sample == sample_lines(lines, 0.5,
+    ...                                                            seed=1)
+    (True, False)
+    """
+    return StratifiedTrace(lines, bucket, cell).sample(rate, seed)
+
+
+def sampled_run(trace, rate, seed=0, network=None, factory=None):
+    """Return the report of a simulation of a stratified sample of <trace>.
+
+    @type trace: StratifiedTrace
+    @type rate: float
+    @type seed: int
+    @type network: RoadNetwork | None
+    @type factory: callable | None
+        Returns a new Simulation to run the sample on, or None for a
+        default Simulation on <network>.
+    @rtype: dict[str, object]
+    """
+    simulation = Simulation(network) if factory is None else factory()
+    return simulation.run(parse_events(trace.sample(rate, seed)))
+
+
+def _critical(degrees):
+    """Return the 97.5th percentile of Student's t distribution with
+    <degrees> degrees of freedom.
+
+    @type degrees: int
+    @rtype: float
+    """
+    if degrees <= len(T_975):
+        return T_975[degrees - 1]
+    return Z_975
+
+
+class Calibration:
+    """The correction and error of the estimates sampled at a rate, measured
+    on a representative trace.
+
+    === Attributes ===
+    @type rate: float
+        The rate of the samples.
+    @type full: dict[str, object]
+        The report of the full run of the representative trace.
+    @type factors: dict[str, float]
+        The factor each statistic of a sampled report is rescaled by.
+    @type spreads: dict[str, float]
+        The standard deviation of each rescaled statistic of the sampled
+        runs, relative to the full run.
+    @type runs: int
+        The number of sampled runs compared with the full run.
+    """
+
+    def __init__(self, lines, rate, runs=5, seed=0, network=None,
+                 factory=None):
+        """Initialize a Calibration by running the representative trace
+        <lines> in full, and sampled at <rate> <runs> times.
+
+        @type self: Calibration
+        @type lines: list[str]
+        @type rate: float
+        @type runs: int
+            At least two.
+        @type seed: int
+            The seed of the first sample; the others follow it.
+        @type network: RoadNetwork | None
+        @type factory: callable | None
+            Returns a new Simulation for each run, or None for a default
+            Simulation on <network>.
+        @rtype: None
+
+        >>> Calibration([], 0.5, runs=1)
+        Traceback (most recent call last):
+        ...
+        ValueError: a calibration needs at least two sampled runs, not 1
+        """
+        if runs < 2:
+            raise ValueError("a calibration needs at least two sampled runs, "
+                             "not {}".format(runs))
+        self.rate = rate
+        self.runs = runs
+        simulation = Simulation(network) if factory is None else factory()
+        self.full = simulation.run(parse_events(lines))
+        trace = StratifiedTrace(lines)
+        reports = [sampled_run(trace, rate, sample_seed, network, factory)
+                   for sample_seed in range(seed, seed + runs)]
+        self.factors = {}
+        self.spreads = {}
+        for statistic, exact in self.full.items():
+            values = [report[statistic] for report in reports]
+            mean = sum(values) / runs
+            factor = exact / mean if mean and exact else 1.0
+            errors = [(value * factor - exact) / exact if exact else 0.0
+                      for value in values]
+            self.factors[statistic] = factor
+            self.spreads[statistic] = sqrt(
+                sum(error ** 2 for error in errors) / (runs - 1))
+
+    def bound(self, statistic, samples=1):
+        """Return the half-width of the 95% prediction interval of the mean
+        of <samples> rescaled sampled runs of <statistic>, relative to the
+        statistic.
+
+        @type self: Calibration
+        @type statistic: str
+        @type samples: int
+        @rtype: float
+        """
+        return (_critical(self.runs - 1) * self.spreads[statistic] *
+                sqrt(1.0 / samples + 1.0 / self.runs))
+
+
+def estimate(lines, rate, calibration=None, samples=1, seed=0, network=None,
+             tolerance=0.1, factory=None):
+    """Return an estimate of the report of the trace <lines>, from the mean
+    of <samples> runs of stratified samples of it at <rate>.
+
+    The estimate has the "report", rescaled by <calibration> if there is one;
+    the "error" of each statistic, the half-width of its 95% interval, from
+    <calibration>, or else from the spread of the samples, which leaves
+    their bias out, and None for a single uncalibrated sample; and whether
+    every error is "within_tolerance", at most <tolerance> of its statistic,
+    or None if there are no errors to tell.
+
+    @type lines: list[str]
+    @type rate: float
+    @type calibration: Calibration | None
+        A Calibration at <rate>, or None.
+    @type samples: int
+    @type seed: int
+        The seed of the first sample; the others follow it.
+    @type network: RoadNetwork | None
+    @type tolerance: float
+    @type factory: callable | None
+        Returns a new Simulation for each sample, or None for a default
+        Simulation on <network>.
+    @rtype: dict[str, object]
+
+    >>> with open("events.txt") as file:
+    ...     lines = file.read().splitlines()
+    >>> calibration = Calibration(lines, 0.5, runs=3)
+    >>> result = estimate(lines, 0.5, calibration, seed=3)
+    >>> sorted(result["report"]) == sorted(calibration.full)
+    True
+    >>> all(error >= 0 for error in result["error"].values())
+    True
+    >>> result = estimate(lines, 0.5)
+    >>> result["error"]["rider_wait_time"], result["within_tolerance"]
+    (None, None)
+    """
+    if calibration is not None and calibration.rate != rate:
+        raise ValueError("the calibration is at a rate of {}, not {}".format(
+            calibration.rate, rate))
+    trace = StratifiedTrace(lines)
+    reports = [sampled_run(trace, rate, sample_seed, network, factory)
+               for sample_seed in range(seed, seed + samples)]
+    report = {}
+    error = {}
+    for statistic in reports[0]:
+        mean, half_width = confidence_interval([sample[statistic]
+                                                for sample in reports])
+        if calibration is not None:
+            report[statistic] = mean * calibration.factors[statistic]
+            error[statistic] = abs(report[statistic]) * calibration.bound(
+                statistic, samples)
+        else:
+            report[statistic] = mean
+            error[statistic] = half_width if samples > 1 else None
+    if calibration is None and samples < 2:
+        within = None
+    else:
+        within = all(half_width <= tolerance * abs(report[statistic])
+                     for statistic, half_width in error.items())
+    return {"report": report, "error": error, "rate": rate,
+            "samples": samples, "calibrated": calibration is not None,
+            "within_tolerance": within}
@@ -1,6 +1,7 @@
-from container import PriorityQueue
+import sys
+
+from container import EventQueue, PriorityQueue
 from dispatcher import Dispatcher
-from event import create_event_list
 from monitor import Monitor
 
 
@@ -12,23 +13,75 @@ class Simulation:
     """
 
     # === Private Attributes ===
-    # @type _events: PriorityQueue[Event]
+    # @type _events: EventQueue[Event] | PriorityQueue[Event]
     #       A sequence of events arranged in priority determined by the event
     #       sorting order.
     # @type _dispatcher: Dispatcher
     #       The dispatcher associated with the simulation.
     # @type _monitor: Monitor
     #       The monitor associated with the simulation.
+    # @type _journal: JournalWriter | None
+    #       The journal every processed event is appended to, if any.
+    # @type _rebalancer: Rebalancer | None
+    #       The rebalancer moving idle drivers toward demand, if any.
+    # @type _metrics: SimulationMetrics | None
+    #       The live counters updated as events are processed, if any.
+    # @type _memory: MemoryAccountant | None
+    #       The accountant sampling the memory of each subsystem, if any.
+    # @type _stream: iterator[Event] | None
+    #       The initial events not yet scheduled, when they are streamed.
+    # @type _next: Event | None
+    #       The next initial event of _stream, or None once it is exhausted.
 
-    def __init__(self):
+    def __init__(self, network=None, dispatcher=None, journal=None,
+                 rebalancer=None, metrics=None, monitor=None, events=None,
+                 memory=None):
         """Initialize a Simulation
 
         @type self: Simulation
+        @type network: RoadNetwork | None
+            The road network drivers travel on, or None for the open grid.
+        @type dispatcher: Dispatcher | None
+            The dispatcher to use, or None for a default Dispatcher on
+            <network>.
+        @type journal: JournalWriter | None
+            The journal to append every processed event to, if any.
+        @type rebalancer: Rebalancer | None
+            The rebalancer to move idle drivers toward demand, if any.
+        @type metrics: SimulationMetrics | None
+            The live counters to update as events are processed, if any.
+        @type monitor: Monitor | None
+            The monitor to notify of activities, or None for a Monitor
+            that keeps them in memory.
+        @type events: PriorityQueue | None
+            The empty queue to schedule events in, or None for an
+            EventQueue.
+        @type memory: MemoryAccountant | None
+            The accountant to sample the memory of each subsystem as events
+            are processed, if any.
         @rtype: None
         """
-        self._events = PriorityQueue()
-        self._dispatcher = Dispatcher()
-        self._monitor = Monitor()
+        if dispatcher is None:
+            dispatcher = Dispatcher(network)
+        if events is None:
+            events = EventQueue()
+        self._events = events
+        self._dispatcher = dispatcher
+        if monitor is None:
+            monitor = Monitor(self._dispatcher.travel)
+        self._monitor = monitor
+        self._journal = journal
+        self._rebalancer = rebalancer
+        if rebalancer is not None:
+            rebalancer.attach(self._monitor)
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.attach(self)
+        self._memory = memory
+        if memory is not None:
+            memory.attach(self)
+        self._stream = None
+        self._next = None
 
     def run(self, initial_events):
         """Run the simulation on the list of events in <initial_events>.
@@ -40,18 +93,599 @@ class Simulation:
             An initial list of events.
         @rtype: dict[str, object]
         """
+        self.start(initial_events)
+        while self.step() is not None:
+            pass
+        if self._memory is not None:
+            self._memory.finish()
+        return self._monitor.report()
+
+    def run_stream(self, initial_events):
+        """Run the simulation on the events of the iterable
+        <initial_events>, which are in order of timestamp, reading them only
+        as they are due.
+
+        Only the events due next are held in memory, so a trace of any
+        length can be run from a stream, such as a merge of sorted traces.
+        The report is the same as that of run.
+
+        Raise a ValueError if the events are not in order of timestamp, or
+        if the simulation has a rebalancer or a batched dispatch strategy,
+        which need the time of the last event before the first is run.
+
+        @type self: Simulation
+        @type initial_events: iterable[Event]
+        @rtype: dict[str, object]
+
+        >>> from event import create_event_list
+        >>> streamed = Simulation().run_stream(
+        ...     iter(create_event_list("events.txt")))
+        >>> streamed == Simulation().run(create_event_list("events.txt"))
+        True
+        """
+        self.start_stream(initial_events)
+        while self.step() is not None:
+            pass
+        if self._memory is not None:
+            self._memory.finish()
+        return self._monitor.report()
+
+    def start_stream(self, initial_events):
+        """Schedule the events of the iterable <initial_events>, which are in
+        order of timestamp, as they become due, without running them.
+
+        Use step to run the simulation one event at a time.
+
+        @type self: Simulation
+        @type initial_events: iterable[Event]
+        @rtype: None
+        """
+        strategy = self._dispatcher.strategy
+        if self._rebalancer is not None or (strategy is not None and
+                                            strategy.interval is not None):
+            raise ValueError("a rebalancer or batched strategy needs every "
+                             "initial event up front")
+        self._stream = iter(initial_events)
+        self._next = next(self._stream, None)
+
+    def _schedule_due(self, time):
+        """Schedule the streamed initial events with timestamps up to
+        <time>.
+
+        Scheduling every initial event before any later event with the same
+        timestamp keeps the order run would do them in.
+
+        @type self: Simulation
+        @type time: int
+        @rtype: None
+        """
+        while self._next is not None and self._next.timestamp <= time:
+            event = self._next
+            self._events.add(event)
+            self._next = next(self._stream, None)
+            if self._next is not None and \
+                    self._next.timestamp < event.timestamp:
+                raise ValueError("the streamed events are not in order of "
+                                 "timestamp")
+
+    def _schedule_next(self):
+        """Schedule the streamed initial events due no later than the next
+        scheduled event, or the next of them if none is scheduled.
+
+        @type self: Simulation
+        @rtype: None
+        """
+        if self._next is None:
+            return
+        if self._events.is_empty():
+            self._schedule_due(self._next.timestamp)
+        else:
+            self._schedule_due(self._events.peek().timestamp)
+
+    def start(self, initial_events):
+        """Schedule the events in <initial_events> without running them.
+
+        Use step to run the simulation one event at a time.
+
+        With a rebalancer, rebalancing passes are scheduled from the first
+        to the last of <initial_events>, and so are the batch matches of a
+        batched dispatch strategy.
+
+        @type self: Simulation
+        @type initial_events: list[Event]
+        @rtype: None
+        """
         for event in initial_events:
             self._events.add(event)
-        while not self._events.is_empty():
-            event = self._events.remove()
-            event.do(self._dispatcher, self._monitor)
-            if event is not None:
-                self._events.add(event)
-        return self._monitor.report()
+        if self._rebalancer is not None and initial_events:
+            from event import Rebalance
+            first = min(event.timestamp for event in initial_events)
+            self._rebalancer.until = max(event.timestamp
+                                         for event in initial_events)
+            self._events.add(Rebalance(first, self._rebalancer))
+        strategy = self._dispatcher.strategy
+        if (strategy is not None and strategy.interval is not None and
+                initial_events):
+            from event import Match
+            first = min(event.timestamp for event in initial_events)
+            strategy.until = max(event.timestamp for event in initial_events)
+            self._events.add(Match(first, strategy))
+
+    def step(self):
+        """Do the next scheduled event and return it, or return None if no
+        event is left.
+
+        @type self: Simulation
+        @rtype: Event | None
+        """
+        if self._next is not None:
+            self._schedule_next()
+        if self._events.is_empty():
+            return None
+        event = self._events.remove()
+        if self._journal is not None:
+            self._journal.record(event)
+        new_events = event.do(self._dispatcher, self._monitor)
+        if self._next is not None and new_events:
+            self._schedule_due(max(new_event.timestamp
+                                   for new_event in new_events))
+        for new_event in new_events:
+            self._events.add(new_event)
+        if self._metrics is not None:
+            self._metrics.events += 1
+            self._metrics.time = event.timestamp
+        if self._memory is not None:
+            self._memory.observe(event.timestamp)
+        return event
+
+    def run_until(self, time):
+        """Do every scheduled event up to and including time <time>, and
+        return the number of events done.
+
+        @type self: Simulation
+        @type time: int
+        @rtype: int
+        """
+        count = 0
+        events = self._events
+        self._schedule_next()
+        while not events.is_empty() and events.peek().timestamp <= time:
+            self.step()
+            count += 1
+            self._schedule_next()
+        return count
+
+    def is_done(self):
+        """Return True iff no event is left.
+
+        @type self: Simulation
+        @rtype: bool
+        """
+        return self._events.is_empty() and self._next is None
+
+    def pending(self):
+        """Return the number of scheduled events.
+
+        @type self: Simulation
+        @rtype: int
+        """
+        return len(self._events)
+
+    def get_dispatcher(self):
+        """Return the dispatcher associated with the simulation.
+
+        @type self: Simulation
+        @rtype: Dispatcher
+        """
+        return self._dispatcher
+
+    def get_event_queue(self):
+        """Return the queue of events scheduled by the simulation.
+
+        @type self: Simulation
+        @rtype: EventQueue | PriorityQueue
+        """
+        return self._events
+
+    def get_monitor(self):
+        """Return the monitor associated with the simulation.
+
+        @type self: Simulation
+        @rtype: Monitor
+        """
+        return self._monitor
+
+
+def _parse_args(argv):
+    """Return the command-line options in <argv>.
+
+    @type argv: list[str]
+    @rtype: argparse.Namespace
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(
+        prog="simulation.py",
+        description="Run the ride-sharing simulation on a trace of events.")
+    parser.add_argument("trace", nargs="?", default="events.txt",
+                        help="the trace of events, possibly compressed, or - "
+                             "to read standard input (default: events.txt)")
+    parser.add_argument("--window", metavar="START:END",
+                        help="replay only the events from START to END, "
+                             "seeking with a time index kept next to the "
+                             "trace")
+    parser.add_argument("--stream", action="store_true",
+                        help="read the events of a trace sorted by timestamp "
+                             "only as they are due, instead of all up front")
+    parser.add_argument("--scheduler", choices=["lane", "priority"],
+                        default="lane",
+                        help="schedule events in a priority queue with a "
+                             "FIFO lane for events due at the current time, "
+                             "or in a plain priority queue")
+    parser.add_argument("--dispatcher",
+                        choices=["fifo", "regional", "concurrent"],
+                        default="fifo",
+                        help="match riders first-come first-served, by "
+                             "region, or by region with a lock each")
+    parser.add_argument("--region-size", type=int, default=4,
+                        help="the size of a region of the regional wait list")
+    parser.add_argument("--max-radius", type=int,
+                        help="the number of rings of regions the regional "
+                             "wait list searches around a driver (default: "
+                             "until a rider is found)")
+    parser.add_argument("--max-skips", type=int, default=100,
+                        help="the number of riders the regional wait list "
+                             "may match ahead of the longest-waiting one "
+                             "(default: 100)")
+    parser.add_argument("--strategy", default="first-idle",
+                        choices=["first-idle", "nearest-idle", "lru",
+                                 "batched"],
+                        help="how riders and drivers are matched (default: "
+                             "first-idle)")
+    parser.add_argument("--batch-interval", type=int, default=5,
+                        help="the time between matches of the batched "
+                             "strategy")
+    parser.add_argument("--pool", type=int, metavar="K",
+                        help="let drivers carry up to K riders whose routes "
+                             "overlap")
+    parser.add_argument("--rebalance", type=int, metavar="INTERVAL",
+                        help="move idle drivers toward recent demand every "
+                             "INTERVAL time units")
+    parser.add_argument("--network",
+                        help="an edge list of the road network (default: "
+                             "the open grid)")
+    parser.add_argument("--replications", type=int, metavar="K",
+                        help="run K randomized replications and report "
+                             "95%% confidence intervals")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="the seed of the first replication")
+    parser.add_argument("--jitter", type=int, default=0,
+                        help="the most time units a replication moves a ride "
+                             "request")
+    parser.add_argument("--spread", type=float, default=0.0,
+                        help="the most a replication scales a rider's "
+                             "patience, as a fraction")
+    parser.add_argument("--approximate", type=float, metavar="RATE",
+                        help="estimate the report quickly from stratified "
+                             "samples of RATE of the requests")
+    parser.add_argument("--calibrate", metavar="TRACE",
+                        help="with --approximate, correct the estimate and "
+                             "bound its error with full and sampled runs of "
+                             "a representative TRACE")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="with --approximate, the number of samples "
+                             "averaged (default: 1)")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="with --approximate, the largest error accepted, "
+                             "as a fraction of each statistic (default: 0.1)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve live counters in the Prometheus text "
+                             "format at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--results", metavar="DATABASE",
+                        help="keep the activities and report in a SQLite "
+                             "database")
+    parser.add_argument("--journal", metavar="FILE",
+                        help="append every processed event to a binary "
+                             "journal, which compare.py can read")
+    parser.add_argument("--memory", type=int, metavar="INTERVAL",
+                        help="also report the objects and bytes each "
+                             "subsystem holds, every INTERVAL time units")
+    parser.add_argument("--trace-malloc", action="store_true",
+                        help="with --memory, also report the bytes Python "
+                             "has allocated, measured by tracemalloc")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="return the stored report of an identical "
+                             "earlier run, or store this run's report, in "
+                             "DIRECTORY")
+    parser.add_argument("--stats", action="store_true",
+                        help="also report event counts, timings and travel "
+                             "cache statistics")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run a simulation as configured by the command-line options in <argv>
+    and print its report.
+
+    Only the modules the options need are imported.
+
+    @type argv: list[str] | None
+        The command-line options, or None for sys.argv.
+    @rtype: None
+    """
+    options = _parse_args(argv)
+    if options.trace_malloc and options.memory is None:
+        sys.exit("--trace-malloc needs --memory")
+    if options.rebalance is not None and options.rebalance < 1:
+        sys.exit("--rebalance needs an interval of at least 1")
+    if options.batch_interval < 1:
+        sys.exit("--batch-interval must be at least 1")
+    if options.replications is not None and options.replications < 1:
+        sys.exit("--replications needs at least one replication")
+    if options.region_size < 1:
+        sys.exit("--region-size must be at least 1")
+    if options.approximate is not None and (
+            options.stream or options.window is not None or
+            options.replications is not None or options.cache is not None):
+        sys.exit("--approximate cannot be combined with --stream, --window, "
+                 "--replications or --cache")
+    cache = key = None
+    if options.cache is not None:
+        if (options.trace == "-" or options.replications is not None or
+                options.stats or options.memory is not None or
+                options.results is not None or
+                options.journal is not None or
+                options.metrics_port is not None):
+            sys.exit("--cache needs a trace file, and cannot be combined "
+                     "with --replications, --stats, --memory, --results, "
+                     "--journal or --metrics-port")
+        from cache import ResultCache, file_digest, run_key
+        config = {name: getattr(options, name)
+                  for name in ["window", "scheduler", "dispatcher",
+                               "region_size", "max_radius", "max_skips",
+                               "strategy", "batch_interval", "pool",
+                               "rebalance"]}
+        if options.network is not None:
+            config["network"] = file_digest(options.network)
+        cache = ResultCache(options.cache)
+        key = run_key(options.trace, config)
+        report = cache.get(key)
+        if report is not None:
+            _print(report, options.json)
+            return
+    from time import perf_counter
+    start = perf_counter()
+    from event import parse_events
+    from traces import open_trace
+    source = sys.stdin.buffer if options.trace == "-" else options.trace
+    stream = None
+    if options.stream:
+        if (options.window is not None or options.replications is not None or
+                options.stats or options.rebalance is not None or
+                options.strategy == "batched"):
+            sys.exit("--stream cannot be combined with --window, "
+                     "--replications, --stats, --rebalance or --strategy "
+                     "batched")
+        from event import iter_events
+        # The trace is closed once the run is over.
+        stream = open_trace(source)
+        events = iter_events(stream)
+    elif options.window is not None:
+        if options.trace == "-" or options.replications is not None:
+            sys.exit("--window needs a trace file and no --replications")
+        from timeindex import read_window
+        try:
+            start_time, end_time = (int(time)
+                                    for time in options.window.split(":"))
+            events = read_window(options.trace, start_time, end_time)
+        except ValueError as error:
+            sys.exit("--window: {}".format(error))
+    else:
+        with open_trace(source) as trace:
+            if (options.replications is not None or
+                    options.approximate is not None):
+                lines = list(trace)
+            else:
+                events = parse_events(trace)
+    loaded = perf_counter()
+
+    network = None
+    if options.network is not None:
+        from network import load_network
+        network = load_network(options.network)
+
+    if options.replications is not None or options.approximate is not None:
+        if (options.stats or options.memory is not None or
+                options.results is not None or
+                options.journal is not None or
+                options.metrics_port is not None):
+            sys.exit("--replications and --approximate cannot be combined "
+                     "with --stats, --memory, --results, --journal or "
+                     "--metrics-port")
+        from functools import partial
+        factory = partial(_new_simulation, options, network)
+
+    if options.replications is not None:
+        from replication import ReplicationEngine
+        engine = ReplicationEngine(lines, options.replications, options.seed,
+                                   options.jitter, options.spread, network,
+                                   factory=factory)
+        engine.run()
+        _print({"replications": engine.reports,
+                "summary": engine.summary()}, options.json)
+        return
+
+    if options.approximate is not None:
+        if not 0 < options.approximate <= 1 or options.samples < 1:
+            sys.exit("--approximate needs a RATE from 0 to 1 and at least one "
+                     "sample")
+        from sampling import Calibration, estimate
+        calibration = None
+        if options.calibrate is not None:
+            with open_trace(options.calibrate) as trace:
+                calibration = Calibration(list(trace), options.approximate,
+                                          network=network, factory=factory)
+        _print(estimate(lines, options.approximate, calibration,
+                        options.samples, options.seed, network,
+                        options.tolerance, factory), options.json)
+        return
+
+    dispatcher = _make_dispatcher(options, network)
+    rebalancer = _make_rebalancer(options)
+    memory = None
+    if options.memory is not None:
+        from memory import MemoryAccountant
+        memory = MemoryAccountant(options.memory, options.trace_malloc)
+    metrics = server = None
+    if options.metrics_port is not None:
+        from metrics import MetricsServer, SimulationMetrics
+        metrics = SimulationMetrics()
+        server = MetricsServer(metrics, options.metrics_port)
+    monitor = None
+    if options.results is not None:
+        from results import SQLiteMonitor
+        monitor = SQLiteMonitor(options.results, options.trace,
+                                dispatcher.travel)
+    journal = None
+    if options.journal is not None:
+        from journal import JournalWriter
+        journal = JournalWriter(options.journal)
+    sim = Simulation(dispatcher=dispatcher, journal=journal,
+                     rebalancer=rebalancer, metrics=metrics, monitor=monitor,
+                     events=_make_events(options), memory=memory)
+    if server is not None:
+        server.start()
+    try:
+        if stream is not None:
+            report = sim.run_stream(events)
+        else:
+            report = sim.run(events)
+    except ValueError as error:
+        if stream is None:
+            raise
+        sys.exit("--stream: {}".format(error))
+    finally:
+        if stream is not None:
+            stream.close()
+        if server is not None:
+            server.stop()
+        if options.results is not None:
+            sim.get_monitor().close()
+        if journal is not None:
+            journal.close()
+    finished = perf_counter()
+    if cache is not None:
+        cache.put(key, report)
+
+    if options.stats:
+        counts = {}
+        for event in events:
+            name = type(event).__name__
+            counts[name] = counts.get(name, 0) + 1
+        report = {"report": report,
+                  "initial_events": counts,
+                  "load_seconds": loaded - start,
+                  "run_seconds": finished - loaded,
+                  "travel_cache": dispatcher.travel.stats()}
+        if rebalancer is not None:
+            report["rebalanced_drivers"] = rebalancer.moves
+        if options.pool is not None:
+            report["shared_rides"] = dispatcher.shared
+    if memory is not None:
+        if not options.stats:
+            report = {"report": report}
+        report["memory"] = memory.series
+    _print(report, options.json)
+
+
+def _make_dispatcher(options, network):
+    """Return a new dispatcher configured by the command-line <options>,
+    routing on <network>.
+
+    @type options: argparse.Namespace
+    @type network: RoadNetwork | None
+    @rtype: Dispatcher
+    """
+    wait_list = None
+    if options.dispatcher == "regional":
+        from dispatcher import RegionalWaitList
+        wait_list = RegionalWaitList(options.region_size, options.max_radius,
+                                     options.max_skips)
+    strategy = None
+    if options.strategy != "first-idle":
+        if options.pool is not None:
+            sys.exit("--strategy cannot be combined with --pool")
+        from strategy import STRATEGIES
+        if options.strategy == "batched":
+            strategy = STRATEGIES["batched"](options.batch_interval)
+        else:
+            strategy = STRATEGIES[options.strategy]()
+    if options.dispatcher == "concurrent":
+        if options.pool is not None or strategy is not None:
+            sys.exit("--dispatcher concurrent cannot be combined with --pool "
+                     "or --strategy")
+        from threadsafe import ConcurrentDispatcher
+        return ConcurrentDispatcher(network, region_size=options.region_size)
+    if options.pool is not None:
+        from pooling import PoolingDispatcher
+        return PoolingDispatcher(network, wait_list=wait_list,
+                                 capacity=options.pool)
+    return Dispatcher(network, wait_list=wait_list, strategy=strategy)
+
+
+def _make_rebalancer(options):
+    """Return a new rebalancer configured by the command-line <options>, or
+    None if they ask for none.
+
+    @type options: argparse.Namespace
+    @rtype: Rebalancer | None
+    """
+    if options.rebalance is None:
+        return None
+    from rebalance import Rebalancer
+    return Rebalancer(interval=options.rebalance)
+
+
+def _new_simulation(options, network):
+    """Return a new Simulation with the dispatcher, dispatch strategy and
+    rebalancing configured by the command-line <options>, routing on
+    <network>.
+
+    @type options: argparse.Namespace
+    @type network: RoadNetwork | None
+    @rtype: Simulation
+    """
+    return Simulation(dispatcher=_make_dispatcher(options, network),
+                      rebalancer=_make_rebalancer(options),
+                      events=_make_events(options))
+
+
+def _make_events(options):
+    """Return the empty event queue of the scheduler selected by the
+    command-line <options>, or None for the default EventQueue.
+
+    @type options: argparse.Namespace
+    @rtype: PriorityQueue | None
+    """
+    if options.scheduler == "priority":
+        return PriorityQueue()
+    return None
+
+
+def _print(report, as_json):
+    """Print <report>, as JSON if <as_json> is True.
+
+    @type report: dict[str, object]
+    @type as_json: bool
+    @rtype: None
+    """
+    if as_json:
+        import json
+        print(json.dumps(report, sort_keys=True))
+    else:
+        print(report)
 
 
 if __name__ == "__main__":
-    events = create_event_list("events.txt")
-    sim = Simulation()
-    final_stats = sim.run(events)
-    print(final_stats)
+    main()
@@ -0,0 +1,508 @@
+from heapq import heapify, heappop, heappush
+from itertools import compress
+
+from rider import WAITING
+
+"""
+The strategy module contains the policies a Dispatcher can use to match
+riders with drivers.
+
+A strategy decides which idle driver a requesting rider gets, and which
+waiting rider a requesting driver gets. A batched strategy instead leaves
+both waiting, and matches them all at once every <interval> time units, in
+a Match event the Simulation schedules.
+
+Distances between drivers and riders are measured on the open grid, from
+the FleetTable arrays, whatever the road network.
+
+=== Constants ===
+@type GRID_THRESHOLD: int
+    The number of rider and driver pairs in a batch above which a
+    BatchedStrategy only considers the nearest drivers of each rider;
+    smaller batches consider every pair.
+@type STRATEGIES: dict[str, type]
+    The strategy class with each name.
+"""
+
+GRID_THRESHOLD = 1000
+
+
+class DispatchStrategy:
+    """A policy for matching riders with drivers.
+
+    This is an abstract class. Only child classes should be instantiated.
+
+    === Attributes ===
+    @type name: str
+        The name the strategy is selected by.
+    @type interval: int | None
+        The time between batch matches, or None if the strategy matches on
+        every request.
+    @type until: int | None
+        The time of the last scheduled batch match, set by the Simulation.
+    """
+
+    name = None
+    interval = None
+    until = None
+
+    def driver_for(self, dispatcher, rider):
+        """Return the idle driver of <dispatcher> that <rider> gets, or None
+        to put the rider on the wait list.
+
+        @type self: DispatchStrategy
+        @type dispatcher: Dispatcher
+        @type rider: Rider
+        @rtype: Driver | None
+        """
+        raise NotImplementedError("Implemented in a subclass")
+
+    def rider_for(self, dispatcher, driver):
+        """Remove and return the waiting rider that <driver> gets, or None
+        to leave the driver idle.
+
+        By default, the driver gets the rider the Dispatcher would give
+        them.
+
+        @type self: DispatchStrategy
+        @type dispatcher: Dispatcher
+        @type driver: Driver
+        @rtype: Rider | None
+        """
+        return dispatcher.next_waiting(driver.location)
+
+    def match(self, dispatcher, timestamp):
+        """Match waiting riders with idle drivers at time <timestamp>, and
+        return the (driver, rider) pairs.
+
+        Only batched strategies match riders this way.
+
+        @type self: DispatchStrategy
+        @type dispatcher: Dispatcher
+        @type timestamp: int
+        @rtype: list[(Driver, Rider)]
+        """
+        return []
+
+
+class FirstIdleStrategy(DispatchStrategy):
+    """Give a rider the idle driver who registered first, and a driver the
+    longest-waiting rider.
+
+    This is what a Dispatcher does without a strategy.
+    """
+
+    name = "first-idle"
+
+    def driver_for(self, dispatcher, rider):
+        """Return the idle driver of <dispatcher> who registered first, or
+        None if no driver is idle.
+
+        @type self: FirstIdleStrategy
+        @type dispatcher: Dispatcher
+        @type rider: Rider
+        @rtype: Driver | None
+        """
+        driver_id = dispatcher.driver_fleet.first_idle()
+        return None if driver_id < 0 else dispatcher.driver_fleet.drivers[
+            driver_id]
+
+
+class NearestIdleStrategy(DispatchStrategy):
+    """Give a rider the nearest idle driver, and a driver the
+    longest-waiting rider.
+    """
+
+    name = "nearest-idle"
+
+    def driver_for(self, dispatcher, rider):
+        """Return the idle driver of <dispatcher> nearest to the origin of
+        <rider>, or None if no driver is idle.
+
+        @type self: NearestIdleStrategy
+        @type dispatcher: Dispatcher
+        @type rider: Rider
+        @rtype: Driver | None
+
+        >>> from dispatcher import Dispatcher
+        >>> from driver import Driver
+        >>> from location import Location
+        >>> from rider import Rider
+        >>> dispatcher = Dispatcher(strategy=NearestIdleStrategy())
+        >>> for name, row in [("Fig", 9), ("Guava", 2)]:
+        ...     _ = dispatcher.request_rider(Driver(name, Location(row, 1),
+        ...                                         1))
+        >>> dispatcher.request_driver(Rider("Hazel", Location(1, 1),
+        ...                                 Location(5, 5), 10)).identifier
+        'Guava'
+        """
+        driver_id = dispatcher.driver_fleet.nearest_idle(rider.origin)
+        return None if driver_id < 0 else dispatcher.driver_fleet.drivers[
+            driver_id]
+
+
+class LeastRecentlyUsedStrategy(DispatchStrategy):
+    """Give a rider the idle driver whose last ride was assigned longest
+    ago, spreading work evenly over the fleet, and a driver the
+    longest-waiting rider.
+
+    Drivers who have never had a ride come first, in order of registration.
+    """
+
+    # === Private Attributes ===
+    # @type _last_used: dict[str, int]
+    #   The number of assignments made before each driver's latest one, by
+    #   identifier.
+    # @type _assignments: int
+    #   The number of assignments made so far.
+
+    name = "lru"
+
+    def __init__(self):
+        """Initialize a LeastRecentlyUsedStrategy.
+
+        @type self: LeastRecentlyUsedStrategy
+        @rtype: None
+        """
+        self._last_used = {}
+        self._assignments = 0
+
+    def _use(self, driver):
+        """Record an assignment of <driver>.
+
+        @type self: LeastRecentlyUsedStrategy
+        @type driver: Driver
+        @rtype: None
+        """
+        self._last_used[driver.identifier] = self._assignments
+        self._assignments += 1
+
+    def driver_for(self, dispatcher, rider):
+        """Return the idle driver of <dispatcher> whose last ride was
+        assigned longest ago, or None if no driver is idle.
+
+        @type self: LeastRecentlyUsedStrategy
+        @type dispatcher: Dispatcher
+        @type rider: Rider
+        @rtype: Driver | None
+
+        >>> from dispatcher import Dispatcher
+        >>> from driver import Driver
+        >>> from location import Location
+        >>> from rider import Rider
+        >>> dispatcher = Dispatcher(strategy=LeastRecentlyUsedStrategy())
+        >>> drivers = [Driver(name, Location(1, 1), 1)
+        ...            for name in ["Ivy", "Juniper"]]
+        >>> for driver in drivers:
+        ...     _ = dispatcher.request_rider(driver)
+        >>> rider = Rider("Kiwi", Location(1, 1), Location(5, 5), 10)
+        >>> first = dispatcher.request_driver(rider)
+        >>> first.identifier, dispatcher.request_driver(rider).identifier
+        ('Ivy', 'Juniper')
+        """
+        fleet = dispatcher.driver_fleet
+        last_used = self._last_used
+        best = None
+        best_used = None
+        for driver in compress(fleet.drivers, fleet.idle):
+            used = last_used.get(driver.identifier, -1)
+            if best_used is None or used < best_used:
+                best = driver
+                best_used = used
+                if used < 0:
+                    break
+        if best is not None:
+            self._use(best)
+        return best
+
+    def rider_for(self, dispatcher, driver):
+        """Remove and return the longest-waiting rider, or None if no rider
+        is waiting.
+
+        @type self: LeastRecentlyUsedStrategy
+        @type dispatcher: Dispatcher
+        @type driver: Driver
+        @rtype: Rider | None
+        """
+        rider = dispatcher.next_waiting(driver.location)
+        if rider is not None:
+            self._use(driver)
+        return rider
+
+
+class BatchedStrategy(DispatchStrategy):
+    """Leave riders and drivers waiting, and every <interval> time units
+    match the waiting riders with the idle drivers, closest pairs first.
+
+    Matching a batch can pair riders with nearer drivers than matching
+    each request as it comes, at the cost of up to <interval> more waiting.
+
+    In a batch of more than GRID_THRESHOLD pairs, each rider only considers
+    their <candidates> nearest idle drivers, found by placing the drivers
+    on a grid of square regions and searching it ring by ring. A rider
+    whose candidates are all matched to others looks up their next
+    nearest, so the pairs are the same as when every rider considers every
+    driver.
+
+    === Attributes ===
+    @type region_size: int
+        The width and height of a region of the grid, in streets.
+    @type candidates: int
+        The number of nearest drivers a rider considers at a time.
+    """
+
+    name = "batched"
+
+    def __init__(self, interval=5, region_size=4, candidates=8):
+        """Initialize a BatchedStrategy.
+
+        @type self: BatchedStrategy
+        @type interval: int
+        @type region_size: int
+        @type candidates: int
+        @rtype: None
+
+        >>> BatchedStrategy(interval=0)
+        Traceback (most recent call last):
+        ...
+        ValueError: the batch interval must be at least 1, not 0
+        """
+        if interval < 1:
+            # A batch every 0 time units would reschedule itself forever.
+            raise ValueError("the batch interval must be at least 1, "
+                             "not {}".format(interval))
+        self.interval = interval
+        self.region_size = region_size
+        self.candidates = candidates
+
+    def driver_for(self, dispatcher, rider):
+        """Return None: the rider waits for the next batch.
+
+        @type self: BatchedStrategy
+        @type dispatcher: Dispatcher
+        @type rider: Rider
+        @rtype: None
+        """
+        return None
+
+    def rider_for(self, dispatcher, driver):
+        """Return None: the driver waits for the next batch.
+
+        @type self: BatchedStrategy
+        @type dispatcher: Dispatcher
+        @type driver: Driver
+        @rtype: None
+        """
+        return None
+
+    def match(self, dispatcher, timestamp):
+        """Match the waiting riders of <dispatcher> with its idle drivers,
+        closest pairs first, and return the (driver, rider) pairs.
+
+        Unmatched riders stay on the wait list in their order.
+
+        @type self: BatchedStrategy
+        @type dispatcher: Dispatcher
+        @type timestamp: int
+        @rtype: list[(Driver, Rider)]
+
+        >>> from dispatcher import Dispatcher
+        >>> from driver import Driver
+        >>> from location import Location
+        >>> from rider import Rider
+        >>> dispatcher = Dispatcher(strategy=BatchedStrategy())
+        >>> for name, row in [("Lime", 1), ("Mango", 8)]:
+        ...     _ = dispatcher.request_rider(Driver(name, Location(row, 1),
+        ...                                         1))
+        >>> for name, row in [("Nutmeg", 9), ("Olive", 2), ("Pecan", 5)]:
+        ...     _ = dispatcher.request_driver(Rider(name, Location(row, 1),
+        ...                                         Location(5, 5), 10))
+        >>> [(driver.identifier, rider.identifier)
+        ...  for driver, rider in dispatcher.strategy.match(dispatcher, 0)]
+        [('Mango', 'Nutmeg'), ('Lime', 'Olive')]
+        >>> dispatcher.wait_list.remove().identifier
+        'Pecan'
+        """
+        wait_list = dispatcher.wait_list
+        riders = []
+        while not wait_list.is_empty():
+            rider = wait_list.remove()
+            if rider.status == WAITING:
+                riders.append(rider)
+        fleet = dispatcher.driver_fleet
+        idle = list(compress(zip(range(len(fleet.idle)), fleet.rows,
+                                 fleet.cols), fleet.idle))
+        pairs = []
+        if riders and idle:
+            grid = None
+            if len(riders) * len(idle) > GRID_THRESHOLD:
+                grid = _DriverGrid(idle, self.region_size)
+            taken = set()
+            # The number of each rider's candidates on the heap that may
+            # not be taken.
+            remaining = []
+            candidates = []
+            for index, rider in enumerate(riders):
+                nearest = self._candidates(idle, grid, index, rider.origin)
+                remaining.append(len(nearest))
+                candidates.extend(nearest)
+            heapify(candidates)
+            matched = set()
+            limit = min(len(riders), len(idle))
+            while len(pairs) < limit:
+                _, index, driver_id = heappop(candidates)
+                if index in matched:
+                    continue
+                if driver_id in taken:
+                    remaining[index] -= 1
+                    if remaining[index] == 0:
+                        nearest = self._candidates(idle, grid, index,
+                                                   riders[index].origin)
+                        remaining[index] = len(nearest)
+                        for candidate in nearest:
+                            heappush(candidates, candidate)
+                    continue
+                matched.add(index)
+                taken.add(driver_id)
+                if grid is not None:
+                    grid.remove(driver_id, fleet.rows[driver_id],
+                                fleet.cols[driver_id])
+                pairs.append((fleet.drivers[driver_id], riders[index]))
+            riders = [rider for index, rider in enumerate(riders)
+                      if index not in matched]
+        for rider in riders:
+            wait_list.add(rider)
+        return pairs
+
+    def _candidates(self, idle, grid, index, location):
+        """Return the candidate pairs of the rider with <index>, at
+        <location>, as (distance, index, driver id): every idle driver if
+        <grid> is None, and otherwise the <self.candidates> drivers left on
+        <grid> nearest to <location>.
+
+        @type self: BatchedStrategy
+        @type idle: list[(int, int, int)]
+            The id, row and column of every idle driver.
+        @type grid: _DriverGrid | None
+            The idle drivers not yet matched.
+        @type index: int
+        @type location: Location
+        @rtype: list[(int, int, int)]
+        """
+        row, col = location.get_row(), location.get_col()
+        if grid is None:
+            return [(abs(driver_row - row) + abs(driver_col - col), index,
+                     driver_id)
+                    for driver_id, driver_row, driver_col in idle]
+        return [(distance, index, driver_id) for distance, driver_id
+                in grid.nearest(row, col, self.candidates)]
+
+
+class _DriverGrid:
+    """The positions of drivers on a grid of square regions, for finding
+    the drivers nearest to a location.
+    """
+
+    # === Private Attributes ===
+    # @type _size: int
+    #   The width and height of a region, in streets.
+    # @type _regions: dict[(int, int), dict[int, (int, int)]]
+    #   The row and column of the drivers in each non-empty region, by
+    #   driver id.
+    # @type _extent: (int, int, int, int)
+    #   The lowest and highest region rows and columns that have held a
+    #   driver.
+    # @type _count: int
+    #   The number of drivers on the grid.
+
+    def __init__(self, drivers, region_size):
+        """Initialize a _DriverGrid holding <drivers>.
+
+        @type self: _DriverGrid
+        @type drivers: list[(int, int, int)]
+            The id, row and column of each driver; there is at least one.
+        @type region_size: int
+        @rtype: None
+        """
+        self._size = region_size
+        self._regions = {}
+        for driver_id, row, col in drivers:
+            region = (row // region_size, col // region_size)
+            if region not in self._regions:
+                self._regions[region] = {}
+            self._regions[region][driver_id] = (row, col)
+        rows = [region[0] for region in self._regions]
+        cols = [region[1] for region in self._regions]
+        self._extent = (min(rows), max(rows), min(cols), max(cols))
+        self._count = len(drivers)
+
+    def remove(self, driver_id, row, col):
+        """Remove the driver with <driver_id>, at <row> and <col>.
+
+        @type self: _DriverGrid
+        @type driver_id: int
+        @type row: int
+        @type col: int
+        @rtype: None
+        """
+        region = (row // self._size, col // self._size)
+        del self._regions[region][driver_id]
+        if not self._regions[region]:
+            del self._regions[region]
+        self._count -= 1
+
+    def nearest(self, row, col, count):
+        """Return the distance and id of the <count> drivers nearest to
+        <row> and <col>, nearest first, with ties going to the lowest id.
+
+        @type self: _DriverGrid
+        @type row: int
+        @type col: int
+        @type count: int
+        @rtype: list[(int, int)]
+
+        >>> grid = _DriverGrid([(0, 9, 9), (1, 1, 2), (2, 2, 1)], 2)
+        >>> grid.nearest(1, 1, 2)
+        [(1, 1), (1, 2)]
+        >>> grid.remove(1, 1, 2)
+        >>> grid.nearest(1, 1, 2)
+        [(1, 2), (16, 0)]
+        """
+        size = self._size
+        region_row, region_col = row // size, col // size
+        low_row, high_row, low_col, high_col = self._extent
+        # Beyond this radius, no region of the grid is left.
+        last = (max(region_row - low_row, high_row - region_row) +
+                max(region_col - low_col, high_col - region_col))
+        found = []
+        seen = 0
+        for radius in range(last + 1):
+            for d_row in range(-radius, radius + 1):
+                d_col = radius - abs(d_row)
+                for ring_col in {region_col - d_col, region_col + d_col}:
+                    region = self._regions.get((region_row + d_row,
+                                                ring_col))
+                    if region is not None:
+                        seen += len(region)
+                        found.extend(
+                            (abs(driver_row - row) + abs(driver_col - col),
+                             driver_id)
+                            for driver_id, (driver_row, driver_col)
+                            in region.items())
+            if seen == self._count:
+                break
+            # A driver in a region further out is at least this far away.
+            bound = (radius - 1) * size + 2
+            if len(found) >= count:
+                found.sort()
+                del found[count:]
+                if found[-1][0] < bound:
+                    break
+        found.sort()
+        del found[count:]
+        return found
+
+
+STRATEGIES = {strategy.name: strategy
+              for strategy in [FirstIdleStrategy, NearestIdleStrategy,
+                               LeastRecentlyUsedStrategy, BatchedStrategy]}
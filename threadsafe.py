@@ -0,0 +1,526 @@
+import threading
+
+from container import Container
+from dispatcher import Dispatcher
+from rider import WAITING, CANCELLED
+
+"""
+The threadsafe module contains a Dispatcher that many threads can drive at
+once, for serving live requests.
+
+The city grid is partitioned into square regions, each holding its waiting
+riders and idle drivers under its own lock, so requests in different
+regions do not contend. A driver is claimed by removing them from the idle
+drivers of their region while holding its lock, so exactly one request can
+claim them; a rider is claimed the same way. A rider is cancelled under the
+lock of their region too, so a rider is either claimed before they cancel
+or skipped.
+
+A request that finds nobody to match waits in its region and then searches
+once more, holding its own region's lock and the other region's lock in a
+fixed order. Of a rider and a driver that request at the same time, the
+one that starts waiting last therefore finds the other, so no match is
+missed.
+
+Only the locks of the regions searched are taken; no lock is held for
+longer than one region's queue operation, so throughput can grow with
+threads on CPython builds without the global interpreter lock. The fleet
+and rider registry are updated under their own locks; the fleet is never
+compacted, so that each driver's row stays fixed.
+"""
+
+
+class _Region:
+    """The waiting riders and idle drivers in one region of the grid.
+
+    === Attributes ===
+    @type key: (int, int)
+        The region's position in the grid of regions.
+    @type lock: threading.Lock
+        The lock guarding riders and drivers.
+    @type riders: list[list]
+        The entries of the waiting riders, oldest first. An entry is
+        [rider]; the rider is set to None once claimed.
+    @type head: int
+        The index in riders of the oldest entry that may be unclaimed.
+    @type drivers: dict[str, Driver]
+        The idle drivers, by identifier, in the order they became idle.
+    """
+
+    def __init__(self, key):
+        """Initialize an empty _Region at <key>.
+
+        @type self: _Region
+        @type key: (int, int)
+        @rtype: None
+        """
+        self.key = key
+        self.lock = threading.Lock()
+        self.riders = []
+        self.head = 0
+        self.drivers = {}
+
+    def take_rider(self):
+        """Remove and return the oldest rider still waiting, or None.
+
+        Precondition: the caller holds self.lock.
+
+        @type self: _Region
+        @rtype: Rider | None
+        """
+        riders = self.riders
+        while self.head < len(riders):
+            entry = riders[self.head]
+            self.head += 1
+            rider = entry[0]
+            if rider is not None and rider.status != CANCELLED:
+                entry[0] = None
+                return rider
+        del riders[:]
+        self.head = 0
+        return None
+
+    def take_driver(self):
+        """Remove and return the driver idle longest, or None.
+
+        Precondition: the caller holds self.lock.
+
+        @type self: _Region
+        @rtype: Driver | None
+        """
+        for identifier in self.drivers:
+            return self.drivers.pop(identifier)
+        return None
+
+
+class _Locked:
+    """Holds the locks of two regions, always acquired in the order of
+    their keys so that two threads cannot deadlock.
+    """
+
+    def __init__(self, first, second):
+        """Initialize a _Locked for the regions <first> and <second>.
+
+        @type self: _Locked
+        @type first: _Region
+        @type second: _Region
+        @rtype: None
+        """
+        if first is second:
+            self._locks = [first.lock]
+        elif first.key < second.key:
+            self._locks = [first.lock, second.lock]
+        else:
+            self._locks = [second.lock, first.lock]
+
+    def __enter__(self):
+        for lock in self._locks:
+            lock.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for lock in reversed(self._locks):
+            lock.release()
+
+
+class RegionBoard(Container):
+    """The waiting riders and idle drivers of a ConcurrentDispatcher,
+    partitioned into square regions of the grid with a lock each.
+
+    As a Container it holds the waiting riders.
+
+    === Attributes ===
+    @type region_size: int
+        The width and height of a region, in streets.
+    """
+
+    # === Private Attributes ===
+    # @type _regions: dict[(int, int), _Region]
+    #   The regions that have had a rider or driver.
+    # @type _keys: tuple[(int, int)]
+    #   The keys of _regions, replaced whole when a region is created so
+    #   that it can be read without a lock.
+    # @type _create_lock: threading.Lock
+    #   The lock guarding the creation of regions.
+    # @type _orders: dict[(int, int), (tuple, list[_Region])]
+    #   The regions in order of distance from each region, with the _keys
+    #   they were ordered from; an order is recomputed once regions have
+    #   been created since.
+
+    def __init__(self, region_size=4):
+        """Initialize an empty RegionBoard.
+
+        @type self: RegionBoard
+        @type region_size: int
+        @rtype: None
+
+        >>> RegionBoard(0)
+        Traceback (most recent call last):
+        ...
+        ValueError: the region size must be at least 1, not 0
+        """
+        if region_size < 1:
+            raise ValueError("the region size must be at least 1, "
+                             "not {}".format(region_size))
+        self.region_size = region_size
+        self._regions = {}
+        self._keys = ()
+        self._create_lock = threading.Lock()
+        self._orders = {}
+
+    def __len__(self):
+        """Return the number of riders on the board, counting those who
+        cancelled but have not been skipped yet.
+
+        @type self: RegionBoard
+        @rtype: int
+        """
+        return sum(len(region.riders) - region.head
+                   for region in self._snapshot())
+
+    def __str__(self):
+        """Return a str representation of the RegionBoard.
+
+        @type self: RegionBoard
+        @rtype: str
+        """
+        return "RegionBoard ({} regions)".format(len(self._keys))
+
+    def _snapshot(self):
+        """Return the regions, read without a lock.
+
+        @type self: RegionBoard
+        @rtype: list[_Region]
+        """
+        regions = self._regions
+        return [regions[key] for key in self._keys]
+
+    def region(self, location):
+        """Return the region containing <location>, creating it if needed.
+
+        @type self: RegionBoard
+        @type location: Location
+        @rtype: _Region
+        """
+        key = (location.get_row() // self.region_size,
+               location.get_col() // self.region_size)
+        region = self._regions.get(key)
+        if region is None:
+            with self._create_lock:
+                region = self._regions.get(key)
+                if region is None:
+                    region = _Region(key)
+                    self._regions[key] = region
+                    self._keys = self._keys + (key,)
+        return region
+
+    def nearest(self, location):
+        """Return the regions in order of distance from the region of
+        <location>.
+
+        @type self: RegionBoard
+        @type location: Location
+        @rtype: list[_Region]
+        """
+        row = location.get_row() // self.region_size
+        col = location.get_col() // self.region_size
+        keys = self._keys
+        order = self._orders.get((row, col))
+        if order is not None and order[0] is keys:
+            return order[1]
+        regions = self._regions
+        nearest = [regions[key] for key in sorted(
+            keys, key=lambda key: (abs(key[0] - row) + abs(key[1] - col), key))]
+        self._orders[(row, col)] = (keys, nearest)
+        return nearest
+
+    def add(self, rider):
+        """Add <rider> to the waiting riders of the region of their origin,
+        and return their entry.
+
+        @type self: RegionBoard
+        @type rider: Rider
+        @rtype: list
+        """
+        entry = [rider]
+        region = self.region(rider.origin)
+        with region.lock:
+            region.riders.append(entry)
+        return entry
+
+    def remove(self):
+        """Remove and return a waiting rider, from the first region that
+        has one, or None if no rider is waiting.
+
+        @type self: RegionBoard
+        @rtype: Rider | None
+        """
+        for region in self._snapshot():
+            with region.lock:
+                rider = region.take_rider()
+            if rider is not None:
+                return rider
+        return None
+
+    def is_empty(self):
+        """Return True iff no rider is on the board.
+
+        @type self: RegionBoard
+        @rtype: bool
+        """
+        return len(self) == 0
+
+
+class ConcurrentDispatcher(Dispatcher):
+    """A Dispatcher that many threads can call at once.
+
+    A rider gets the idle driver who has been idle longest in the nearest
+    region that has one, and a driver gets the longest-waiting rider in the
+    nearest region that has one. No driver or rider is ever given to two
+    requests.
+
+    === Attributes ===
+    @type wait_list: RegionBoard
+        The waiting riders and idle drivers.
+    """
+
+    # === Private Attributes ===
+    # @type _fleet_lock: threading.Lock
+    #   The lock guarding driver_fleet.
+    # @type _riders_lock: threading.Lock
+    #   The lock guarding riders.
+    # @type _idle_in: dict[str, _Region]
+    #   The region each idle driver is waiting in, by identifier.
+
+    def __init__(self, network=None, travel_cache_size=65536, region_size=4):
+        """Initialize a ConcurrentDispatcher.
+
+        @type self: ConcurrentDispatcher
+        @type network: RoadNetwork | None
+        @type travel_cache_size: int
+        @type region_size: int
+        @rtype: None
+        """
+        Dispatcher.__init__(self, network, travel_cache_size,
+                            RegionBoard(region_size))
+        self._fleet_lock = threading.Lock()
+        self._riders_lock = threading.Lock()
+        self._idle_in = {}
+
+    def request_driver(self, rider):
+        """Return a driver for the rider, or None if no driver is available.
+
+        The rider waits on the board if there is no available driver.
+
+        @type self: ConcurrentDispatcher
+        @type rider: Rider
+        @rtype: Driver | None
+        """
+        with self._riders_lock:
+            self.riders.register(rider)
+        board = self.wait_list
+        driver = self._claim(board.nearest(rider.origin), "drivers")
+        if driver is not None:
+            return driver
+        entry = board.add(rider)
+        home = board.region(rider.origin)
+        for region in board.nearest(rider.origin):
+            if not region.drivers:
+                continue
+            with _Locked(home, region):
+                if entry[0] is None:
+                    # A driver has claimed the rider meanwhile.
+                    return None
+                driver = region.take_driver()
+                if driver is not None:
+                    entry[0] = None
+                    self._idle_in.pop(driver.identifier, None)
+                    return driver
+        return None
+
+    def request_rider(self, driver):
+        """Return a rider for the driver, or None if no rider is available.
+
+        The driver is registered on their first request, and waits idle on
+        the board if there is no available rider. A driver whose shift has
+        ended is not registered or given a rider.
+
+        @type self: ConcurrentDispatcher
+        @type driver: Driver
+        @rtype: Rider | None
+        """
+        if not driver.on_shift:
+            self.remove_driver(driver)
+            return None
+        with self._fleet_lock:
+            self.driver_fleet.add(driver)
+        board = self.wait_list
+        rider = self._claim(board.nearest(driver.location), "riders")
+        if rider is not None:
+            return rider
+        home = board.region(driver.location)
+        with home.lock:
+            home.drivers[driver.identifier] = driver
+            self._idle_in[driver.identifier] = home
+        for region in board.nearest(driver.location):
+            if len(region.riders) == region.head:
+                continue
+            with _Locked(home, region):
+                if driver.identifier not in home.drivers:
+                    # A rider has claimed the driver meanwhile.
+                    return None
+                rider = region.take_rider()
+                if rider is not None:
+                    del home.drivers[driver.identifier]
+                    self._idle_in.pop(driver.identifier, None)
+                    return rider
+        return None
+
+    def _claim(self, regions, kind):
+        """Claim and return the first rider or driver, as <kind> says, in
+        <regions>, or None.
+
+        @type self: ConcurrentDispatcher
+        @type regions: list[_Region]
+        @type kind: str
+            "riders" or "drivers".
+        @rtype: Rider | Driver | None
+        """
+        for region in regions:
+            if kind == "drivers":
+                if not region.drivers:
+                    continue
+                with region.lock:
+                    driver = region.take_driver()
+                    if driver is not None:
+                        self._idle_in.pop(driver.identifier, None)
+                        return driver
+            elif len(region.riders) > region.head:
+                with region.lock:
+                    rider = region.take_rider()
+                if rider is not None:
+                    return rider
+        return None
+
+    def remove_driver(self, driver):
+        """Unregister <driver>, whose shift has ended.
+
+        @type self: ConcurrentDispatcher
+        @type driver: Driver
+        @rtype: None
+        """
+        region = self._idle_in.get(driver.identifier)
+        if region is not None:
+            with region.lock:
+                if region.drivers.pop(driver.identifier, None) is not None:
+                    self._idle_in.pop(driver.identifier, None)
+        with self._fleet_lock:
+            self.driver_fleet.remove(driver)
+
+    def cancel_ride(self, rider):
+        """Cancel the ride request for rider.
+
+        Precondition: A ride request exists for the rider.
+
+        @type self: ConcurrentDispatcher
+        @type rider: Rider
+        @rtype: None
+        """
+        region = self.wait_list.region(rider.origin)
+        with region.lock:
+            if rider.status == WAITING:
+                # Setting the status changes the shared registry.
+                with self._riders_lock:
+                    rider.status = CANCELLED
+
+
+def stress_test(threads=8, drivers=40, requests=500, seed=0):
+    """Drive a ConcurrentDispatcher from <threads> threads at once and
+    return how many matches were made, how many times a driver or rider
+    was given to a second request while still held by the first, and the
+    requests made per second.
+
+    Each thread makes <requests> requests: riders request drivers, and
+    drivers that finish a ride, or that got no rider, request riders
+    again. Threads switch every few bytecodes to force contention.
+
+    @type threads: int
+    @type drivers: int
+    @type requests: int
+    @type seed: int
+    @rtype: dict[str, int | float]
+
+    >>> result = stress_test()
+    >>> result["double_assignments"], result["matches"] > 0
+    (0, True)
+    """
+    import random
+    import sys
+    from time import perf_counter
+    from driver import Driver
+    from location import Location
+    from rider import Rider
+
+    dispatcher = ConcurrentDispatcher(region_size=3)
+    fleet = [Driver("D{}".format(i), Location(i % 10, i // 10 % 10), 1)
+             for i in range(drivers)]
+    held = set()
+    held_lock = threading.Lock()
+    counts = {"matches": 0, "double_assignments": 0}
+
+    def hold(driver, rider):
+        with held_lock:
+            for name in (driver.identifier, rider.identifier):
+                if name in held:
+                    counts["double_assignments"] += 1
+                held.add(name)
+            counts["matches"] += 1
+
+    def release(*names):
+        with held_lock:
+            for name in names:
+                held.discard(name)
+
+    def work(number):
+        rng = random.Random(seed + number)
+        mine = fleet[number::threads]
+        busy = []
+        for request in range(requests):
+            if busy and rng.random() < 0.5:
+                driver, rider = busy.pop(rng.randrange(len(busy)))
+                release(driver.identifier, rider.identifier)
+                rider = dispatcher.request_rider(driver)
+                if rider is not None:
+                    hold(driver, rider)
+                    busy.append((driver, rider))
+            elif mine and rng.random() < 0.2:
+                driver = mine.pop()
+                rider = dispatcher.request_rider(driver)
+                if rider is not None:
+                    hold(driver, rider)
+                    busy.append((driver, rider))
+            else:
+                rider = Rider("R{}-{}".format(number, request),
+                              Location(rng.randrange(10), rng.randrange(10)),
+                              Location(0, 0), 5)
+                driver = dispatcher.request_driver(rider)
+                if driver is not None:
+                    hold(driver, rider)
+                    busy.append((driver, rider))
+                elif rng.random() < 0.1:
+                    dispatcher.cancel_ride(rider)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    start = perf_counter()
+    try:
+        workers = [threading.Thread(target=work, args=(number,))
+                   for number in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        sys.setswitchinterval(interval)
+    counts["requests_per_second"] = (threads * requests /
+                                     (perf_counter() - start))
+    return counts
@@ -0,0 +1,217 @@
+import json
+import os
+
+from driver import Driver
+from event import DriverRequest, parse_events
+from location import deserialize_location
+from traces import detect_compression
+
+"""
+The timeindex module replays a window of time out of a large trace without
+parsing the trace from the top.
+
+A sidecar index, built once in a single streaming pass and stored next to
+the trace, maps each bucket of time to the byte offset of the first line at
+or after the start of the bucket, and summarizes every driver: when and
+where they registered, their speed, and the times they went online and
+offline. Loading a window seeks straight to its first bucket and parses
+only the lines in the window. The drivers registered before the window are
+reconstructed from the summary and request a rider at the start of the
+window, from where they registered: their position at that time would take
+a replay of everything before it to know.
+
+The trace must be uncompressed, so that it can be seeked, and sorted by
+timestamp. The index records the size and modification time of the trace,
+and is rebuilt when they change.
+
+=== Constants ===
+@type INDEX_VERSION: int
+    The version of the index format; indexes of other versions are rebuilt.
+@type INDEX_SUFFIX: str
+    The suffix of the sidecar index of a trace.
+"""
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+
+
+def _stamp(path):
+    """Return the size and modification time of the file at <path>.
+
+    @type path: str
+    @rtype: [int, int]
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_index(path, bucket=60):
+    """Return the time index of the trace at <path>, with buckets of
+    <bucket> time units, in a single pass over the trace.
+
+    Raise a ValueError if the trace is compressed or not sorted by
+    timestamp.
+
+    @type path: str
+    @type bucket: int
+    @rtype: dict[str, object]
+
+    >>> index = build_index("events.txt", bucket=5)
+    >>> index["first"], index["offsets"][:3]
+    (0, [248, 621, 653])
+    >>> index["drivers"]["Foxglove"]
+    [0, 5, 2, 1, [[30, 0]]]
+    """
+    index = {"version": INDEX_VERSION, "stamp": _stamp(path),
+             "bucket": bucket, "first": None, "offsets": [], "drivers": {}}
+    offsets = index["offsets"]
+    drivers = index["drivers"]
+    with open(path, "rb") as trace:
+        if detect_compression(trace.read(8)) is not None:
+            raise ValueError("{} is compressed and cannot be indexed"
+                             .format(path))
+        trace.seek(0)
+        offset = 0
+        previous = None
+        for raw in trace:
+            line = raw.strip()
+            if line and not line.startswith(b"#"):
+                tokens = line.split()
+                timestamp = int(tokens[0])
+                if previous is not None and timestamp < previous:
+                    raise ValueError("{} is not sorted by timestamp"
+                                     .format(path))
+                previous = timestamp
+                if index["first"] is None:
+                    index["first"] = timestamp
+                while len(offsets) <= (timestamp - index["first"]) // bucket:
+                    offsets.append(offset)
+                _summarize(drivers, timestamp, tokens)
+            offset += len(raw)
+    return index
+
+
+def _summarize(drivers, timestamp, tokens):
+    """Add the driver event with <timestamp> and the other <tokens> of its
+    line to the driver summary <drivers>.
+
+    The summary of a driver is [registration time, row, column, speed,
+    shift changes], where each shift change is [time, 1 if online else 0].
+
+    @type drivers: dict[str, list]
+    @type timestamp: int
+    @type tokens: list[bytes]
+    @rtype: None
+    """
+    kind = tokens[1]
+    if kind == b"RiderRequest":
+        return
+    identifier = tokens[2].decode("utf-8")
+    summary = drivers.get(identifier)
+    if summary is None and kind in (b"DriverRequest", b"DriverOnline"):
+        location = deserialize_location(tokens[3].decode("utf-8"))
+        drivers[identifier] = [timestamp, location.get_row(),
+                               location.get_col(), int(tokens[4]), []]
+    elif summary is not None and kind in (b"DriverOnline", b"DriverOffline"):
+        summary[4].append([timestamp, int(kind == b"DriverOnline")])
+
+
+def load_index(path, bucket=60):
+    """Return the time index of the trace at <path>, reading it from its
+    sidecar, or building and storing it if the sidecar is missing, out of
+    date or built with other buckets.
+
+    @type path: str
+    @type bucket: int
+    @rtype: dict[str, object]
+    """
+    sidecar = path + INDEX_SUFFIX
+    try:
+        with open(sidecar) as file:
+            index = json.load(file)
+        if (index.get("version") == INDEX_VERSION and
+                index.get("bucket") == bucket and
+                index.get("stamp") == _stamp(path)):
+            return index
+    except (OSError, ValueError):
+        pass
+    index = build_index(path, bucket)
+    with open(sidecar, "w") as file:
+        json.dump(index, file, separators=(",", ":"))
+    return index
+
+
+def drivers_at(index, start):
+    """Return the drivers registered before time <start>, by identifier,
+    as the summary in <index> describes them at that time.
+
+    A driver whose shift has ended by <start> is off shift.
+
+    @type index: dict[str, object]
+    @type start: int
+    @rtype: dict[str, Driver]
+    """
+    drivers = {}
+    for identifier, (time, row, col, speed, shifts) in \
+            index["drivers"].items():
+        if time >= start:
+            continue
+        driver = Driver(identifier, deserialize_location(
+            "{},{}".format(row, col)), speed)
+        online = True
+        for change, state in shifts:
+            if change >= start:
+                break
+            online = bool(state)
+        if not online:
+            driver.end_shift()
+        drivers[identifier] = driver
+    return drivers
+
+
+def read_window(path, start, end, index=None):
+    """Return the events of the trace at <path> from time <start> to time
+    <end> inclusive, preceded by a DriverRequest at <start> for every
+    driver on shift who registered before <start>.
+
+    @type path: str
+    @type start: int
+    @type end: int
+    @type index: dict[str, object] | None
+        The time index of the trace, or None to load it from its sidecar.
+    @rtype: list[Event]
+
+    >>> index = build_index("events.txt", bucket=5)
+    >>> events = read_window("events.txt", 10, 20, index)
+    >>> [type(event).__name__ for event in events].count("DriverRequest")
+    6
+    >>> [event.timestamp for event in events][6:]
+    [10, 15, 20]
+    """
+    if index is None:
+        index = load_index(path)
+    drivers = drivers_at(index, start)
+    events = [DriverRequest(start, driver) for driver in drivers.values()
+              if driver.on_shift]
+    offsets = index["offsets"]
+    if index["first"] is None or not offsets:
+        return events
+    position = max(0, (start - index["first"]) // index["bucket"])
+    if position >= len(offsets):
+        return events
+
+    def window_lines(trace):
+        for raw in trace:
+            line = raw.strip()
+            if not line or line.startswith(b"#"):
+                continue
+            timestamp = int(line.split(None, 1)[0])
+            if timestamp > end:
+                break
+            if timestamp >= start:
+                yield line.decode("utf-8")
+
+    with open(path, "rb") as trace:
+        trace.seek(offsets[position])
+        events.extend(parse_events(window_lines(trace), drivers))
+    return events
@@ -0,0 +1,353 @@
+import struct
+import zlib
+
+"""
+The traces module reads event traces that may be compressed, or in the
+binary trace format that tracesort writes.
+
+The compression of a trace is detected from its first bytes, so gzip, xz
+and bzip2 traces can be read without decompressing them to disk first.
+Compressed traces are decompressed in large blocks on a background thread,
+which overlaps with parsing the lines of the blocks already decompressed;
+the decompressors release the interpreter lock while they work. The
+modules needed only for compressed traces are imported on first use, so
+reading a small uncompressed trace starts quickly.
+
+A binary trace starts with MAGIC, followed for every event by its
+timestamp and the length of its line, packed as RECORD, and the UTF-8
+encoded line. Its lines are read as they would be from a text trace.
+
+=== Constants ===
+@type BLOCK_SIZE: int
+    The default number of bytes read from an uncompressed trace at a time.
+@type CHUNK_SIZE: int
+    The number of bytes read from a compressed trace at a time; it is
+    smaller than BLOCK_SIZE so that the first blocks reach the parser
+    early.
+@type PREFETCH: int
+    The number of decompressed blocks the background thread may read
+    ahead of the parser.
+@type SIGNATURES: list[(bytes, str)]
+    The magic bytes that start a file of each supported compression.
+@type MAGIC: bytes
+    The first bytes of a binary trace.
+@type RECORD: struct.Struct
+    The layout of the fixed part of an event in a binary trace.
+"""
+
+BLOCK_SIZE = 1 << 20
+CHUNK_SIZE = 1 << 16
+PREFETCH = 4
+
+SIGNATURES = [(b"\x1f\x8b", "gzip"),
+              (b"\xfd7zXZ\x00", "xz"),
+              (b"BZh", "bzip2")]
+MAGIC = b"RSCTRC01"
+RECORD = struct.Struct("<qI")
+
+
+def detect_compression(head):
+    """Return the compression of a file starting with the bytes <head>, or
+    None if it is not compressed.
+
+    @type head: bytes
+    @rtype: str | None
+
+    >>> detect_compression(b"\\x1f\\x8b\\x08\\x00")
+    'gzip'
+    >>> detect_compression(b"0 DriverRequest") is None
+    True
+    """
+    for signature, compression in SIGNATURES:
+        if head.startswith(signature):
+            return compression
+    return None
+
+
+def _decompressor(compression):
+    """Return a new decompressor for <compression>.
+
+    @type compression: str
+    @rtype: object
+    """
+    if compression == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == "xz":
+        import lzma
+        return lzma.LZMADecompressor()
+    import bz2
+    return bz2.BZ2Decompressor()
+
+
+def _decompress(file, head, compression, chunk_size):
+    """Yield the decompressed blocks of <file>, which starts with <head>.
+
+    Files made of several concatenated compressed streams, as written by
+    pigz or pbzip2, are read stream by stream.
+
+    @type file: file
+    @type head: bytes
+    @type compression: str
+    @type chunk_size: int
+    @rtype: iterator[bytes]
+    """
+    decompressor = _decompressor(compression)
+    data = head
+    while True:
+        if not data:
+            data = file.read(chunk_size)
+            if not data:
+                return
+        block = decompressor.decompress(data)
+        if block:
+            yield block
+        data = b""
+        if decompressor.eof:
+            data = decompressor.unused_data
+            if not data:
+                data = file.read(chunk_size)
+                if not data:
+                    return
+            decompressor = _decompressor(compression)
+
+
+def _read(file, head, block_size):
+    """Yield the blocks of the uncompressed <file>, which starts with
+    <head>.
+
+    @type file: file
+    @type head: bytes
+    @type block_size: int
+    @rtype: iterator[bytes]
+    """
+    if head:
+        yield head
+    while True:
+        block = file.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+def _unpack(file, data, block_size):
+    """Yield the lines of the events of the binary trace <file>, whose
+    MAGIC has been read and whose records start with the bytes <data>.
+
+    Raise a ValueError if the trace ends with a partial record.
+
+    @type file: file
+    @type data: bytes
+    @type block_size: int
+    @rtype: iterator[str]
+    """
+    size = RECORD.size
+    unpack_from = RECORD.unpack_from
+    position = 0
+    while True:
+        end = position + size
+        if end <= len(data):
+            end += unpack_from(data, position)[1]
+            if end <= len(data):
+                yield data[position + size:end].decode("utf-8")
+                position = end
+                continue
+        block = file.read(max(block_size, end - len(data)))
+        if not block:
+            if position < len(data):
+                raise ValueError("the binary trace ends with a partial "
+                                 "record")
+            return
+        data = data[position:] + block
+        position = 0
+
+
+class TraceReader:
+    """An iterator over the lines of a trace, which may be compressed.
+
+    A TraceReader is a context manager; closing it closes the trace file
+    if the TraceReader opened it.
+
+    === Attributes ===
+    @type compression: str | None
+        The compression of the trace, or None if it is not compressed.
+    @type binary: bool
+        True iff the trace is in the binary trace format.
+    """
+
+    # === Private Attributes ===
+    # @type _file: file
+    #   The trace file, opened in binary mode.
+    # @type _owned: bool
+    #   Whether _file was opened by this TraceReader.
+    # @type _blocks: iterator[bytes] | None
+    #   The blocks of the trace's content; None if the trace is binary.
+    # @type _lines: iterator[str] | None
+    #   The lines of the events of a binary trace; None otherwise.
+    # @type _queue: BlockQueue | None
+    #   The blocks decompressed by the background thread, then None at the
+    #   end of the trace or an exception if decompressing failed; None if
+    #   the trace is not compressed.
+    # @type _stop: threading.Event | None
+    #   Set to tell the background thread to stop early; None if the trace
+    #   is not compressed.
+    # @type _thread: threading.Thread | None
+    #   The background thread, if the trace is compressed.
+
+    def __init__(self, source, block_size=BLOCK_SIZE):
+        """Initialize a TraceReader for <source>.
+
+        @type self: TraceReader
+        @type source: str | file
+            The name of the trace, or a trace file opened in binary mode.
+        @type block_size: int
+            The number of bytes read at a time from an uncompressed trace.
+        @rtype: None
+        """
+        if isinstance(source, str):
+            self._file = open(source, "rb")
+            self._owned = True
+        else:
+            self._file = source
+            self._owned = False
+        head = self._file.read(max([len(MAGIC)] +
+                                   [len(signature)
+                                    for signature, _ in SIGNATURES]))
+        self.compression = detect_compression(head)
+        self.binary = head.startswith(MAGIC)
+        self._lines = None
+        if self.compression is None:
+            self._queue = None
+            self._stop = None
+            self._thread = None
+            if self.binary:
+                self._blocks = None
+                self._lines = _unpack(self._file, head[len(MAGIC):],
+                                      block_size)
+            else:
+                self._blocks = _read(self._file, head, block_size)
+        else:
+            import threading
+            from queue import Queue as BlockQueue
+            self._queue = BlockQueue(PREFETCH)
+            self._stop = threading.Event()
+            self._blocks = self._receive()
+            self._thread = threading.Thread(
+                target=self._send,
+                args=(_decompress(self._file, head, self.compression,
+                                  CHUNK_SIZE),),
+                name="trace-decompressor", daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        """Return this TraceReader.
+
+        @type self: TraceReader
+        @rtype: TraceReader
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close this TraceReader.
+
+        @type self: TraceReader
+        @rtype: None
+        """
+        self.close()
+
+    def _send(self, blocks):
+        """Put the blocks of <blocks> on the queue, then None; run by the
+        background thread.
+
+        @type self: TraceReader
+        @type blocks: iterator[bytes]
+        @rtype: None
+        """
+        try:
+            for block in blocks:
+                if self._stop.is_set():
+                    return
+                self._queue.put(block)
+            self._queue.put(None)
+        except Exception as error:
+            self._queue.put(error)
+
+    def _receive(self):
+        """Yield the blocks the background thread decompresses.
+
+        Raise the exception met by the background thread, if any.
+
+        @type self: TraceReader
+        @rtype: iterator[bytes]
+        """
+        while True:
+            block = self._queue.get()
+            if block is None:
+                return
+            if isinstance(block, Exception):
+                raise block
+            yield block
+
+    def __iter__(self):
+        """Yield the lines of the trace, without their line endings.
+
+        Lines are decoded as UTF-8 a block at a time. The lines of a binary
+        trace are those of its events.
+
+        @type self: TraceReader
+        @rtype: iterator[str]
+        """
+        if self._lines is not None:
+            yield from self._lines
+            return
+        rest = b""
+        for block in self._blocks:
+            end = block.rfind(b"\n")
+            if end < 0:
+                rest += block
+                continue
+            lines = (rest + block[:end]).decode("utf-8").split("\n")
+            rest = block[end + 1:]
+            for line in lines:
+                yield line
+        if rest:
+            yield rest.decode("utf-8")
+
+    def close(self):
+        """Stop the background thread and close the trace file if this
+        TraceReader opened it.
+
+        @type self: TraceReader
+        @rtype: None
+        """
+        if self._thread is not None:
+            self._stop.set()
+            while self._thread.is_alive():
+                # Make room for a block the thread may be waiting to put.
+                while not self._queue.empty():
+                    self._queue.get_nowait()
+                self._thread.join(0.01)
+            self._thread = None
+        if self._owned:
+            self._file.close()
+
+
+def open_trace(source, block_size=BLOCK_SIZE):
+    """Return a TraceReader over the lines of the trace <source>.
+
+    @type source: str | file
+        The name of the trace, or a trace file opened in binary mode.
+    @type block_size: int
+    @rtype: TraceReader
+
+    >>> with open_trace("events.txt") as trace:
+    ...     lines = [line for line in trace if line and line[0] != "#"]
+    >>> trace.compression is None, lines[0]
+    (True, '0 DriverRequest Amaranth 1,1 1')
+    >>> from io import BytesIO
+    >>> data = "0 DriverRequest Amaranth 1,1 1".encode("utf-8")
+    >>> with open_trace(BytesIO(MAGIC + RECORD.pack(0, len(data)) + data),
+    ...                 block_size=4) as trace:
+    ...     trace.binary, list(trace)
+    (True, ['0 DriverRequest Amaranth 1,1 1'])
+    """
+    return TraceReader(source, block_size)
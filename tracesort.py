@@ -0,0 +1,260 @@
+import os
+import sys
+from heapq import merge
+from operator import itemgetter
+from tempfile import TemporaryDirectory
+
+from traces import MAGIC, RECORD, open_trace
+
+"""
+The tracesort module sorts and merges event traces that are not in order of
+timestamp, such as the logs of many regions, into a single trace in order,
+however many events they hold.
+
+The events are read from every trace in turn and gathered into runs of at
+most <run_size> events. Each run is sorted in memory and spilled to a
+temporary file, and the runs are then merged, <fan_in> at a time, with
+heapq.merge. Only one run, and a buffer of each run being merged, are in
+memory at once. Events with the same timestamp stay in the order they are
+read, so the result is that of a stable sort of the traces one after the
+other.
+
+Traces are read in the events.txt format, possibly compressed, or in the
+binary trace format of the traces module, which is also the format of the
+spilled runs. Binary traces are read without parsing timestamps out of
+their lines.
+
+The sorted events can be written to a trace, text or binary, that the
+simulation reads, or streamed straight into a simulation:
+
+    python tracesort.py region1.txt region2.txt.gz | \
+        python simulation.py - --stream
+
+=== Constants ===
+@type RUN_SIZE: int
+    The default number of events sorted in memory at a time.
+@type FAN_IN: int
+    The default number of runs merged at a time.
+"""
+
+RUN_SIZE = 500000
+FAN_IN = 64
+
+
+def is_binary(path):
+    """Return True iff the file at <path> is a binary trace.
+
+    @type path: str
+    @rtype: bool
+    """
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def read_records(path):
+    """Yield the events of the trace at <path>, in the order they are in the
+    trace, as (timestamp, line) pairs.
+
+    Blank lines and lines starting with "#" are skipped.
+
+    @type path: str
+    @rtype: iterator[(int, str)]
+
+    >>> next(read_records("events.txt"))
+    (0, '0 DriverRequest Amaranth 1,1 1')
+    """
+    if is_binary(path):
+        with open(path, "rb") as file:
+            file.read(len(MAGIC))
+            size = RECORD.size
+            header = file.read(size)
+            while len(header) == size:
+                timestamp, length = RECORD.unpack(header)
+                yield timestamp, file.read(length).decode("utf-8")
+                header = file.read(size)
+            if header:
+                raise ValueError("{} ends with a partial record".format(path))
+        return
+    with open_trace(path) as trace:
+        for line in trace:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield int(line.split(None, 1)[0]), line
+
+
+def write_records(records, path):
+    """Write the (timestamp, line) pairs of <records> to a binary trace at
+    <path>.
+
+    @type records: iterable[(int, str)]
+    @type path: str
+    @rtype: None
+    """
+    pack = RECORD.pack
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        for timestamp, line in records:
+            data = line.encode("utf-8")
+            file.write(pack(timestamp, len(data)))
+            file.write(data)
+
+
+def _merge_runs(runs):
+    """Return an iterator over the records of the sorted binary traces
+    <runs>, in order of timestamp; ties come in the order of <runs>.
+
+    @type runs: list[str]
+    @rtype: iterator[(int, str)]
+    """
+    return merge(*[read_records(run) for run in runs], key=itemgetter(0))
+
+
+def sort_records(paths, run_size=RUN_SIZE, fan_in=FAN_IN, directory=None):
+    """Yield the events of the traces at <paths>, read one after the other,
+    in order of timestamp, as (timestamp, line) pairs.
+
+    The runs spilled along the way are removed once the iterator is
+    exhausted or closed. Raise a ValueError, when iterated, if <run_size>
+    is less than 1 or <fan_in> less than 2.
+
+    @type paths: list[str]
+    @type run_size: int
+        The most events sorted in memory at a time.
+    @type fan_in: int
+        The most runs merged at a time.
+    @type directory: str | None
+        The directory to spill runs to, or None for the system's temporary
+        directory.
+    @rtype: iterator[(int, str)]
+
+    >>> records = list(sort_records(["events.txt"], run_size=4, fan_in=3))
+    >>> times = [timestamp for timestamp, _ in records]
+    >>> times == sorted(times), len(records)
+    (True, 13)
+    >>> records == sorted(read_records("events.txt"), key=itemgetter(0))
+    True
+    >>> list(sort_records(["events.txt"], fan_in=1))
+    Traceback (most recent call last):
+    ...
+    ValueError: run_size must be at least 1 and fan_in at least 2
+    """
+    if run_size < 1 or fan_in < 2:
+        raise ValueError("run_size must be at least 1 and fan_in at least 2")
+    key = itemgetter(0)
+    run = []
+    with TemporaryDirectory(dir=directory) as spill:
+        runs = []
+        for path in paths:
+            for record in read_records(path):
+                run.append(record)
+                if len(run) == run_size:
+                    run.sort(key=key)
+                    runs.append(os.path.join(spill, str(len(runs))))
+                    write_records(run, runs[-1])
+                    run = []
+        run.sort(key=key)
+        if not runs:
+            yield from run
+            return
+        if run:
+            runs.append(os.path.join(spill, str(len(runs))))
+            write_records(run, runs[-1])
+            run = []
+        count = len(runs)
+        while len(runs) > fan_in:
+            # Merge consecutive runs, keeping ties in the order read.
+            merged_runs = []
+            for start in range(0, len(runs), fan_in):
+                group = runs[start:start + fan_in]
+                merged = os.path.join(spill, str(count))
+                count += 1
+                write_records(_merge_runs(group), merged)
+                for done in group:
+                    os.remove(done)
+                merged_runs.append(merged)
+            runs = merged_runs
+        yield from _merge_runs(runs)
+
+
+def sort_lines(paths, run_size=RUN_SIZE, fan_in=FAN_IN, directory=None):
+    """Yield the lines of the events of the traces at <paths> in order of
+    timestamp, as sort_records orders them.
+
+    The lines can be parsed with event.iter_events and run with
+    Simulation.run_stream.
+
+    @type paths: list[str]
+    @type run_size: int
+    @type fan_in: int
+    @type directory: str | None
+    @rtype: iterator[str]
+
+    >>> from event import iter_events
+    >>> from simulation import Simulation
+    >>> report = Simulation().run_stream(iter_events(sort_lines(
+    ...     ["events.txt"], run_size=4)))
+    >>> report["rider_wait_time"]
+    2.8333333333333335
+    """
+    for _, line in sort_records(paths, run_size, fan_in, directory):
+        yield line
+
+
+def _parse_args(argv):
+    """Return the command-line options in <argv>.
+
+    @type argv: list[str]
+    @rtype: argparse.Namespace
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(
+        prog="tracesort.py",
+        description="Sort and merge traces of events by timestamp.")
+    parser.add_argument("traces", nargs="+",
+                        help="the traces, in the events.txt format (possibly "
+                             "compressed) or the binary format")
+    parser.add_argument("-o", "--output",
+                        help="the sorted trace to write (default: standard "
+                             "output)")
+    parser.add_argument("--binary", action="store_true",
+                        help="write the binary format")
+    parser.add_argument("--run-size", type=int, default=RUN_SIZE,
+                        help="the most events sorted in memory at a time")
+    parser.add_argument("--fan-in", type=int, default=FAN_IN,
+                        help="the most runs merged at a time")
+    parser.add_argument("--temp-dir",
+                        help="the directory to spill sorted runs to")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Sort and merge the traces named by the command-line options in
+    <argv>.
+
+    @type argv: list[str] | None
+        The command-line options, or None for sys.argv.
+    @rtype: None
+    """
+    options = _parse_args(argv)
+    if options.run_size < 1 or options.fan_in < 2:
+        sys.exit("--run-size must be at least 1 and --fan-in at least 2")
+    records = sort_records(options.traces, options.run_size, options.fan_in,
+                           options.temp_dir)
+    if options.binary:
+        if options.output is None:
+            sys.exit("--binary needs --output")
+        write_records(records, options.output)
+        return
+    output = sys.stdout if options.output is None else open(options.output,
+                                                            "w")
+    try:
+        for _, line in records:
+            output.write(line)
+            output.write("\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
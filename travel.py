@@ -0,0 +1,124 @@
+from container import LRUCache
+from location import manhattan_distance
+
+"""
+The travel module contains the TravelCache class, a bounded memoization
+layer for the distance and travel-time computations of the simulation.
+"""
+
+
+class TravelCache:
+    """A size-limited cache of driving distances and travel times.
+
+    A TravelCache can be used wherever a RoadNetwork is accepted. Distances
+    are keyed on (origin, destination) and travel times on
+    (origin, destination, speed). Locations are expected to be interned
+    (see intern_location), so that key comparisons are identity checks.
+
+    === Attributes ===
+    @type network: RoadNetwork | None
+        The road network distances are measured on, or None for the open
+        grid.
+    """
+
+    # === Private Attributes ===
+    # @type _cache: LRUCache
+    #   The memoized distances and travel times.
+
+    def __init__(self, network=None, capacity=65536):
+        """Initialize an empty TravelCache.
+
+        @type self: TravelCache
+        @type network: RoadNetwork | None
+        @type capacity: int
+            The maximum number of distances and travel times held.
+        @rtype: None
+        """
+        self.network = network
+        self._cache = LRUCache(capacity)
+
+    def __str__(self):
+        """Return a string representation.
+
+        @type self: TravelCache
+        @rtype: str
+        """
+        return "TravelCache ({} entries, {} hits, {} misses)".format(
+            len(self._cache), self._cache.hits, self._cache.misses)
+
+    def distance(self, origin, destination):
+        """Return the driving distance from <origin> to <destination>.
+
+        @type self: TravelCache
+        @type origin: Location
+        @type destination: Location
+        @rtype: int | float
+
+        >>> from location import intern_location
+        >>> travel = TravelCache()
+        >>> travel.distance(intern_location(1, 1), intern_location(3, 4))
+        5
+        >>> travel.distance(intern_location(1, 1), intern_location(3, 4))
+        5
+        >>> travel.stats()["hits"]
+        1
+        """
+        key = (origin, destination)
+        distance = self._cache.get(key)
+        if distance is None:
+            distance = self._compute_distance(origin, destination)
+            self._cache.put(key, distance)
+        return distance
+
+    def _compute_distance(self, origin, destination):
+        """Return the driving distance from <origin> to <destination>,
+        without looking it up in the cache.
+
+        @type self: TravelCache
+        @type origin: Location
+        @type destination: Location
+        @rtype: int | float
+        """
+        if self.network is None:
+            return manhattan_distance(origin, destination)
+        return self.network.distance(origin, destination)
+
+    def travel_time(self, origin, destination, speed):
+        """Return the time a driver with <speed> needs to get from <origin>
+        to <destination>, rounded down to an integer.
+
+        @type self: TravelCache
+        @type origin: Location
+        @type destination: Location
+        @type speed: int
+        @rtype: int
+
+        >>> from location import intern_location
+        >>> travel = TravelCache()
+        >>> travel.travel_time(intern_location(1, 1), intern_location(3, 4), 2)
+        2
+        >>> travel.stats()["misses"]
+        1
+        """
+        key = (origin, destination, speed)
+        time = self._cache.get(key)
+        if time is None:
+            # A lookup of the distance would count the miss a second time.
+            time = int(self._compute_distance(origin, destination) / speed)
+            self._cache.put(key, time)
+        return time
+
+    def stats(self):
+        """Return the hit/miss statistics of this TravelCache.
+
+        @type self: TravelCache
+        @rtype: dict[str, object]
+        """
+        hits = self._cache.hits
+        misses = self._cache.misses
+        lookups = hits + misses
+        return {"hits": hits,
+                "misses": misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "size": len(self._cache),
+                "capacity": self._cache.capacity}